@@ -17,7 +17,16 @@
 ################################################################################
 #
 # Usage: put this in directory with JPEGs you want to extract from and then run ./exif2gpx.sh > file.gpx
-# This script requires exiftool, get it here: https://www.sno.phy.queensu.ca/~phil/exiftool/install.html
+#
+# If video_upload/exif_gps.py from this repository is available (or EXIF_GPS
+# points to it), the GPS tags are read directly from the JPEG headers in a
+# single Python process.  Otherwise this script requires exiftool, get it here:
+# https://www.sno.phy.queensu.ca/~phil/exiftool/install.html
+
+EXIF_GPS=${EXIF_GPS:-"$(dirname "$0")/../video_upload/exif_gps.py"}
+if [ -f "$EXIF_GPS" ]; then
+	exec python "$EXIF_GPS" *.JPG
+fi
 
 echo '<?xml version="1.0" encoding="UTF-8"?><gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="https://github.com/smarquardt"><metadata><author></author></metadata><trk><trkseg>'
 for file in *.JPG; do
@@ -22,9 +22,17 @@
 # Usage:
 #
 # $ python basic_uploader.py \
-#    --video=<video file> \
+#    --video=<video file> [<video file> ...] \
 #    --blur (optional) \
+#    --resumable (optional) \
 #    --key=<developer key>
+#
+# Pass --resumable to upload the video in chunks.  If the upload is interrupted,
+# running the same command again continues from the last acknowledged byte.
+#
+# If more than one video is passed, all videos are uploaded concurrently from
+# this process, at most --max_concurrent at a time.  Resumable uploads are not
+# used in this mode.
 
 # Requirements:
 # This script requires the following libraries:
@@ -40,14 +48,18 @@
 import argparse
 import json
 import os
+import sys
 import urlparse
-from apiclient import discovery
 from apiclient import errors
 import httplib2
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
 import pycurl
+import discovery_cache
+import multi_upload
+import resumable_upload
+import token_manager
 
 
 API_NAME = "streetviewpublish"
@@ -60,11 +72,17 @@ CLIENT_SECRETS_FILE = "streetviewpublish_config.json"
 REDIRECT_URI = "http://localhost:8080"
 
 parser = argparse.ArgumentParser(parents=[tools.argparser])
-parser.add_argument("--video", help="Full path of the video to upload")
+parser.add_argument("--video", nargs="+", help="Full path of the video(s) to upload")
 parser.add_argument("--blur", default=False, action='store_true', help="Enable auto-blurring")
 parser.add_argument("--key", help="Your developer key")
+parser.add_argument("--resumable", default=False, action='store_true', help="Upload in chunks and resume interrupted uploads")
+parser.add_argument("--chunk_size", type=int, default=8, help="Chunk size in MB for resumable uploads")
+parser.add_argument("--max_concurrent", type=int, default=multi_upload.MAX_CONCURRENT, help="Maximum number of concurrent uploads")
 flags = parser.parse_args()
 
+api_service = None
+tokens = None
+
 
 def get_discovery_service_url():
   """Returns the discovery service url."""
@@ -76,15 +94,42 @@ def get_discovery_service_url():
   return discovery_service_url
 
 
+def get_service():
+  """Returns the API service object.
+
+  The service is built once per run from a cached copy of the discovery
+  document, and reused by every step.
+
+  Returns:
+    The Street View Publish API service object.
+  """
+  global api_service
+  if api_service is None:
+    credentials = get_credentials()
+    http = credentials.authorize(httplib2.Http())
+    api_service = discovery_cache.build(
+        API_NAME,
+        API_VERSION,
+        developerKey=flags.key,
+        discoveryServiceUrl=get_discovery_service_url(),
+        http=http)
+  return api_service
+
+
 def get_credentials():
   """Gets valid user credentials from storage.
 
   If nothing has been stored, or if the stored credentials are invalid,
   the OAuth2 flow is completed to obtain the new credentials.
+  The credentials are only loaded once per run.  After that, a TokenManager
+  keeps the access token valid and the same credentials are returned.
 
   Returns:
       Credentials, the obtained credential.
   """
+  global tokens
+  if tokens is not None:
+    return tokens.get_credentials()
   home_dir = os.path.expanduser("~")
   credential_dir = os.path.join(home_dir, ".credentials")
   if not os.path.exists(credential_dir):
@@ -102,7 +147,9 @@ def get_credentials():
     else:
       credentials = tools.run(flow, store)
     print "Storing credentials to " + credential_path
-  return credentials
+  tokens = token_manager.TokenManager(credential_path, credentials)
+  tokens.start()
+  return tokens.get_credentials()
 
 
 def get_file_size(file_name):
@@ -112,6 +159,29 @@ def get_file_size(file_name):
     return fh.tell()
 
 
+batch_progress = {}
+
+
+def xfer_progress(video_file, total_to_download, total_downloaded, total_to_upload, total_uploaded):
+  """Outputs transfer progress of all files in a batch upload.
+
+  Args:
+    video_file: The video file this progress report is for.
+    total_to_download: Total bytes to download
+    total_downloaded: Total bytes downloaded
+    total_to_upload: Total bytes to upload
+    total_uploaded: Total bytes uploaded
+
+  Returns: None
+  """
+  if total_to_upload:
+    batch_progress[video_file] = int(100 * total_uploaded / total_to_upload)
+    status = ", ".join("%s %d%%" % (os.path.basename(name), percent)
+                       for (name, percent) in sorted(batch_progress.items()))
+    sys.stdout.write("Uploaded %s\r" % status)
+    sys.stdout.flush()
+
+
 def get_headers(credentials, file_size, url):
   """Returns a list of header parameters in HTTP header format.
 
@@ -145,26 +215,50 @@ def publish(video_file):
   Returns:
     The id if the upload was successful, otherwise None.
   """
-  upload_url = request_upload_url()
+  upload_url = None
+  if flags.resumable:
+    upload_url = resumable_upload.journaled_upload_url(video_file)
+  if upload_url is None:
+    upload_url = request_upload_url()
   upload_video(video_file, upload_url)
   publish_response = publish_sequence(upload_url)
+  if publish_response is not None:
+    resumable_upload.clear_journal(video_file)
   return publish_response
 
 
+def publish_batch(video_files):
+  """Uploads several videos concurrently and publishes each of them.
+
+  Args:
+    video_files: List of full paths of the videos to upload.
+  Returns:
+    Dict of video file to sequence id, or None if that video failed.
+  """
+  upload_urls = dict((video_file, request_upload_url()) for video_file in video_files)
+  credentials = get_credentials()
+  results = multi_upload.upload_videos(
+      [(video_file, upload_urls[video_file]) for video_file in video_files],
+      credentials, max_concurrent=flags.max_concurrent, progress=xfer_progress)
+  print
+  sequence_ids = {}
+  for video_file in video_files:
+    result = results[video_file]
+    if result["error"] is not None:
+      print "Error uploading file %s: %s" % (video_file, result["error"])
+      sequence_ids[video_file] = None
+    else:
+      sequence_ids[video_file] = publish_sequence(upload_urls[video_file])
+  return sequence_ids
+
+
 def request_upload_url():
   """Requests an Upload URL from SV servers (step 1/3).
 
   Returns:
     The Upload URL.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   start_upload_response = service.photoSequence().startUpload(body={}).execute()
   upload_url = str(start_upload_response["uploadUrl"])
   return upload_url
@@ -181,6 +275,13 @@ def upload_video(video_file, upload_url):
   """
   credentials = get_credentials()
   credentials.authorize(httplib2.Http())
+  if flags.resumable:
+    try:
+      resumable_upload.upload(str(video_file), upload_url, credentials,
+                              chunk_size=flags.chunk_size * 1024 * 1024)
+    except resumable_upload.UploadError as error:
+      print("Error uploading file %s: %s" % (video_file, error))
+    return
   file_size = get_file_size(str(video_file))
   try:
     curl = pycurl.Curl()
@@ -211,14 +312,7 @@ def publish_sequence(upload_url):
   Returns:
     The id if the upload was successful, otherwise None.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   publish_request = {"uploadReference": {"uploadUrl": upload_url}}
   if flags.blur:
     publish_request["blurringOptions"] = {"blurFaces":"true","blurLicensePlates":"true"}
@@ -240,8 +334,12 @@ def main():
     print "You must specify a video file."
     exit(1)
 
-  if flags.video is not None:
-    sequence_id = publish(flags.video)
+  if len(flags.video) > 1:
+    sequence_ids = publish_batch(flags.video)
+    for video_file in flags.video:
+      print "%s: sequence id %s" % (video_file, sequence_ids[video_file])
+  elif flags.video is not None:
+    sequence_id = publish(flags.video[0])
     output = "Sequence uploaded! Sequence id: " + sequence_id
     print output
 
@@ -0,0 +1,107 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# On-disk cache of API discovery documents.
+#
+# discovery.build() downloads and parses the discovery document every time it
+# is called.  This keeps a copy of the document per API, version and discovery
+# URL in ~/.cache/streetviewpublish and builds the service from that copy with
+# build_from_document().  The copy is refreshed once it is older than the TTL;
+# if the refresh fails (e.g. when offline) the stale copy is used instead.
+
+
+import hashlib
+import json
+import os
+import time
+from apiclient import discovery
+import httplib2
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "streetviewpublish")
+TTL = 24 * 60 * 60
+
+
+def _cache_path(api_name, api_version, discovery_url):
+  # The discovery URL contains the developer key, so only a hash of it is
+  # used in the file name.
+  url_hash = hashlib.sha1(discovery_url.encode("utf-8")).hexdigest()[:12]
+  return os.path.join(CACHE_DIR, "%s.%s.%s.json" % (api_name, api_version, url_hash))
+
+
+def _read_cache(path):
+  try:
+    with open(path, "r") as fh:
+      return json.load(fh)
+  except (IOError, ValueError):
+    return None
+
+
+def _write_cache(path, document):
+  if not os.path.exists(CACHE_DIR):
+    os.makedirs(CACHE_DIR)
+  temp_path = "%s.%d.tmp" % (path, os.getpid())
+  with open(temp_path, "w") as fh:
+    json.dump({"fetched": time.time(), "document": document}, fh)
+  os.rename(temp_path, path)
+
+
+def get_document(api_name, api_version, discovery_url, ttl=TTL):
+  """Returns the discovery document, from the cache if it is fresh enough.
+
+  Args:
+    api_name: Name of the API, e.g. "streetviewpublish".
+    api_version: Version of the API, e.g. "v1".
+    discovery_url: The full discovery URL, including key and labels.
+    ttl: Maximum age of the cached document in seconds.
+  Returns:
+    The discovery document as a string.
+  """
+  path = _cache_path(api_name, api_version, discovery_url)
+  cached = _read_cache(path)
+  if cached is not None and time.time() - cached["fetched"] < ttl:
+    return cached["document"]
+  try:
+    response, content = httplib2.Http().request(discovery_url)
+    if response.status == 200:
+      content = content.decode("utf-8") if isinstance(content, bytes) else content
+      json.loads(content)
+      _write_cache(path, content)
+      return content
+    error = "response code %s" % response.status
+  except (httplib2.HttpLib2Error, IOError, ValueError) as e:
+    error = str(e)
+  if cached is not None:
+    print("Could not refresh discovery document (%s), using cached copy" % error)
+    return cached["document"]
+  raise IOError("Could not fetch discovery document: %s" % error)
+
+
+def build(api_name, api_version, developerKey, discoveryServiceUrl, http,
+          ttl=TTL):
+  """Builds a service object like discovery.build(), using the cache.
+
+  Args:
+    api_name: Name of the API, e.g. "streetviewpublish".
+    api_version: Version of the API, e.g. "v1".
+    developerKey: The developer key.
+    discoveryServiceUrl: The full discovery URL, including key and labels.
+    http: An authorized httplib2.Http to make API calls with.
+    ttl: Maximum age of the cached document in seconds.
+  Returns:
+    The service object.
+  """
+  document = get_document(api_name, api_version, discoveryServiceUrl, ttl)
+  return discovery.build_from_document(document, developerKey=developerKey, http=http)
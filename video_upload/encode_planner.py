@@ -0,0 +1,167 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Picks the ffmpeg settings that get a video published soonest.
+#
+# Compressing harder takes longer to encode but less time to upload.  Each
+# candidate command is run on a short sample of the input to measure its
+# encode speed and output size.  Together with the upload throughput, that
+# predicts the total time to encode and upload the whole input, and the
+# candidate with the lowest prediction wins.  The sample is encoded by one
+# process, so the encode time is divided by the number of segments that the
+# full encode runs at the same time.
+
+
+import os
+import subprocess
+import time
+import urlparse
+import pycurl
+
+SAMPLE_FRAMES = 30
+
+
+class Estimate(object):
+  """The predicted cost of one candidate command for the whole input."""
+
+  def __init__(self, name, encode_seconds, output_bytes, upload_seconds, total_seconds):
+    self.name = name
+    self.encode_seconds = encode_seconds
+    self.output_bytes = output_bytes
+    self.upload_seconds = upload_seconds
+    self.total_seconds = total_seconds
+
+
+def sample_command(command, frames):
+  """Limits an ffmpeg command to the first frames of its input.
+
+  Args:
+    command: ffmpeg command line as a list, with the output file last.
+    frames: Number of frames to encode.
+  Returns:
+    The limited command.
+  """
+  return command[:-1] + ["-frames:v", str(frames), command[-1]]
+
+
+def sample_encode(command, frames):
+  """Runs an ffmpeg command on a sample of its input.
+
+  Args:
+    command: ffmpeg command line as a list, with the output file last.
+    frames: Number of frames to encode.
+  Returns:
+    Tuple of the encode time in seconds and the output size in bytes.
+  Raises:
+    OSError: If ffmpeg fails.
+  """
+  output = command[-1]
+  started = time.time()
+  with open(os.devnull, "w") as devnull:
+    returncode = subprocess.call(sample_command(command, frames),
+                                 stdout=devnull, stderr=devnull)
+  elapsed = time.time() - started
+  if returncode != 0 or not os.path.exists(output):
+    raise OSError("Sample encode failed: %s" % " ".join(command))
+  size = os.path.getsize(output)
+  os.remove(output)
+  return elapsed, size
+
+
+def measure_upload(upload_url, access_token, sample_file):
+  """Measures the upload throughput by uploading a sample file.
+
+  The Upload URL is only used for the measurement and must not be published.
+
+  Args:
+    upload_url: An Upload URL returned by startUpload.
+    access_token: A valid OAuth access token.
+    sample_file: The file to upload, a few MB are enough.
+  Returns:
+    Upload throughput in bytes per second.
+  Raises:
+    pycurl.error: If the upload fails.
+    IOError: If the server rejects the upload or no throughput was measured.
+  """
+  size = os.path.getsize(sample_file)
+  headers = {
+      "Content-Type": "video/mp4",
+      "Authorization": "Bearer " + access_token,
+      "X-Goog-Upload-Protocol": "raw",
+      "X-Goog-Upload-Content-Length": str(size),
+      "Host": urlparse.urlparse(upload_url)[1]
+  }
+  curl = pycurl.Curl()
+  try:
+    with open(sample_file, "rb") as fh:
+      curl.setopt(pycurl.URL, upload_url)
+      curl.setopt(pycurl.CUSTOMREQUEST, "POST")
+      curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (k, v) for (k, v) in headers.items()])
+      curl.setopt(pycurl.INFILESIZE, size)
+      curl.setopt(pycurl.READFUNCTION, fh.read)
+      curl.setopt(pycurl.WRITEFUNCTION, lambda data: None)
+      curl.setopt(pycurl.UPLOAD, 1)
+      curl.perform()
+    response_code = curl.getinfo(pycurl.RESPONSE_CODE)
+    if not 200 <= response_code < 300:
+      raise IOError("Sample upload failed with HTTP %d" % response_code)
+    throughput = curl.getinfo(pycurl.SPEED_UPLOAD)
+    if throughput <= 0:
+      raise IOError("Sample upload measured no throughput")
+    return throughput
+  finally:
+    curl.close()
+
+
+def estimate(name, sample_seconds, sample_bytes, sample_frames, total_frames,
+             throughput, overlap=False, parallelism=1):
+  """Predicts the time to encode and upload the whole input.
+
+  Args:
+    name: Name of the candidate.
+    sample_seconds: Time the sample encode took.
+    sample_bytes: Size of the sample output.
+    sample_frames: Number of frames in the sample.
+    total_frames: Number of frames in the whole input.
+    throughput: Upload throughput in bytes per second.
+    overlap: True if encoding and uploading run at the same time.
+    parallelism: Number of processes the whole input is encoded with at the
+      same time, e.g. segmented_encode.parallelism().
+  Returns:
+    An Estimate.
+  Raises:
+    ValueError: If the throughput isn't positive.
+  """
+  if throughput <= 0:
+    raise ValueError("Upload throughput must be positive, got %s" % throughput)
+  scale = float(total_frames) / sample_frames
+  encode_seconds = sample_seconds * scale / parallelism
+  output_bytes = sample_bytes * scale
+  upload_seconds = output_bytes / throughput
+  if overlap:
+    total_seconds = max(encode_seconds, upload_seconds)
+  else:
+    total_seconds = encode_seconds + upload_seconds
+  return Estimate(name, encode_seconds, output_bytes, upload_seconds, total_seconds)
+
+
+def report(estimates, throughput):
+  """Prints the estimates, fastest first."""
+  print("Upload throughput: %.1f Mbit/s" % (throughput * 8 / 1e6))
+  for e in sorted(estimates, key=lambda e: e.total_seconds):
+    print("  %-14s encode %7.0fs  upload %7.0fs (%7.1f MB)  total %7.0fs" % (
+        e.name, e.encode_seconds, e.upload_seconds, e.output_bytes / 1e6,
+        e.total_seconds))
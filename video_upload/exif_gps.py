@@ -0,0 +1,290 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Reads the GPS tags of JPEG photos without exiftool.
+#
+# Each photo is memory-mapped and only the APP1 Exif segment at the start of
+# the file is parsed, down to the GPS IFD.  Image data is never touched, so
+# the cost per photo is a few page reads regardless of resolution.  Photos
+# that can't be parsed this way are handed to a pool of exiftool workers.
+# Photos whose Exif header parses but has no GPS position are not, as
+# exiftool wouldn't find one either.
+#
+# It can also be run on its own to write a GPX file from a list of photos:
+#
+# $ python exif_gps.py *.JPG > file.gpx
+
+
+import argparse
+from calendar import timegm
+import mmap
+import struct
+import sys
+import time
+import exiftool_pool
+
+# TIFF tags used to find and read the GPS IFD.
+GPS_IFD_POINTER = 0x8825
+GPS_LATITUDE_REF = 0x0001
+GPS_LATITUDE = 0x0002
+GPS_LONGITUDE_REF = 0x0003
+GPS_LONGITUDE = 0x0004
+GPS_ALTITUDE_REF = 0x0005
+GPS_ALTITUDE = 0x0006
+GPS_TIMESTAMP = 0x0007
+GPS_DATESTAMP = 0x001D
+
+# Byte size of each TIFF field type, indexed by type id.
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+GPX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?><gpx xmlns="http://www.topografix.com/GPX/1/1" '
+              'version="1.1" creator="https://github.com/smarquardt"><metadata><author></author>'
+              '</metadata><trk><trkseg>')
+GPX_FOOTER = '</trkseg></trk></gpx>'
+
+
+class ExifError(Exception):
+  """Raised when the Exif header of a photo can't be parsed."""
+
+
+def _find_tiff(data):
+  """Returns the offset of the TIFF header inside the Exif APP1 segment."""
+  if data[0:2] != b"\xff\xd8":
+    raise ExifError("Not a JPEG")
+  offset = 2
+  end = len(data)
+  while offset + 4 <= end:
+    if data[offset:offset + 1] != b"\xff":
+      raise ExifError("Invalid JPEG marker at offset %d" % offset)
+    marker = ord(data[offset + 1:offset + 2])
+    if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+      offset += 2
+      continue
+    if marker == 0xFF:
+      offset += 1
+      continue
+    if marker == 0xDA or marker == 0xD9:
+      # Start of scan: the Exif segment must come before the image data.
+      raise ExifError("No Exif segment")
+    (length,) = struct.unpack_from(">H", data, offset + 2)
+    if marker == 0xE1 and data[offset + 4:offset + 10] == b"Exif\x00\x00":
+      return offset + 10
+    offset += 2 + length
+  raise ExifError("No Exif segment")
+
+
+def _read_ifd(data, tiff, ifd_offset, byte_order):
+  """Returns a dict of tag id to (type, count, value offset) for one IFD."""
+  start = tiff + ifd_offset
+  (count,) = struct.unpack_from(byte_order + "H", data, start)
+  entries = {}
+  for i in range(count):
+    entry = start + 2 + i * 12
+    tag, field_type, field_count = struct.unpack_from(
+        byte_order + "HHI", data, entry)
+    size = TYPE_SIZES.get(field_type, 1) * field_count
+    if size <= 4:
+      value_offset = entry + 8
+    else:
+      (value_offset,) = struct.unpack_from(byte_order + "I", data, entry + 8)
+      value_offset += tiff
+    entries[tag] = (field_type, field_count, value_offset)
+  return entries
+
+
+def _ascii(data, entry):
+  field_type, count, offset = entry
+  return str(data[offset:offset + count].split(b"\x00")[0].decode("ascii"))
+
+
+def _rationals(data, entry, byte_order):
+  field_type, count, offset = entry
+  code = "i" if field_type == 10 else "I"
+  values = struct.unpack_from(byte_order + code * (2 * count), data, offset)
+  return [float(values[i]) / values[i + 1] if values[i + 1] else 0.0
+          for i in range(0, len(values), 2)]
+
+
+def _degrees(dms):
+  degrees = dms[0]
+  if len(dms) > 1:
+    degrees += dms[1] / 60.0
+  if len(dms) > 2:
+    degrees += dms[2] / 3600.0
+  return degrees
+
+
+def parse_gps(data):
+  """Parses the GPS IFD from the bytes of a JPEG.
+
+  Args:
+    data: The JPEG contents, as a string or a memory map.
+  Returns:
+    Dict with "latitude", "longitude" and "altitude" in signed decimal
+    degrees and metres, and "datestamp" ("YYYY:MM:DD") and "timestamp"
+    ("HH:MM:SS") as exiftool prints them.  Tags that are not present are None.
+    Returns None if there is no GPS position in the photo.
+  Raises:
+    ExifError: If the photo has no Exif header that can be parsed here.
+  """
+  tiff = _find_tiff(data)
+  order_mark = data[tiff:tiff + 2]
+  if order_mark == b"II":
+    byte_order = "<"
+  elif order_mark == b"MM":
+    byte_order = ">"
+  else:
+    raise ExifError("Invalid TIFF byte order")
+  (ifd0,) = struct.unpack_from(byte_order + "I", data, tiff + 4)
+  ifd0_entries = _read_ifd(data, tiff, ifd0, byte_order)
+  if GPS_IFD_POINTER not in ifd0_entries:
+    return None
+  (gps_ifd,) = struct.unpack_from(
+      byte_order + "I", data, ifd0_entries[GPS_IFD_POINTER][2])
+  gps = _read_ifd(data, tiff, gps_ifd, byte_order)
+  if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+    return None
+
+  latitude = _degrees(_rationals(data, gps[GPS_LATITUDE], byte_order))
+  if GPS_LATITUDE_REF in gps and _ascii(data, gps[GPS_LATITUDE_REF]) == "S":
+    latitude = -latitude
+  longitude = _degrees(_rationals(data, gps[GPS_LONGITUDE], byte_order))
+  if GPS_LONGITUDE_REF in gps and _ascii(data, gps[GPS_LONGITUDE_REF]) == "W":
+    longitude = -longitude
+  altitude = None
+  if GPS_ALTITUDE in gps:
+    altitude = _rationals(data, gps[GPS_ALTITUDE], byte_order)[0]
+    if GPS_ALTITUDE_REF in gps:
+      ref_offset = gps[GPS_ALTITUDE_REF][2]
+      if data[ref_offset:ref_offset + 1] == b"\x01":
+        altitude = -altitude
+  timestamp = None
+  if GPS_TIMESTAMP in gps:
+    hms = _rationals(data, gps[GPS_TIMESTAMP], byte_order)
+    timestamp = "%02d:%02d:%02d" % (hms[0], hms[1], hms[2])
+  datestamp = None
+  if GPS_DATESTAMP in gps:
+    datestamp = _ascii(data, gps[GPS_DATESTAMP])
+  return {
+      "latitude": latitude,
+      "longitude": longitude,
+      "altitude": altitude,
+      "datestamp": datestamp,
+      "timestamp": timestamp
+  }
+
+
+def read_gps(photo_file):
+  """Reads the GPS tags of one photo through a memory map.
+
+  Args:
+    photo_file: Full path of the photo.
+  Returns:
+    Dict of GPS tags, see parse_gps, or None if the photo has no GPS position.
+  Raises:
+    ExifError: If the photo can't be read or parsed.
+  """
+  try:
+    with open(photo_file, "rb") as fh:
+      data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        return parse_gps(data)
+      finally:
+        data.close()
+  except (IOError, OSError, ValueError, IndexError, struct.error,
+          UnicodeDecodeError, TypeError) as error:
+    raise ExifError("%s: %s" % (photo_file, error))
+
+
+def read_gps_tags(files, fallback=True):
+  """Reads the GPS tags of many photos.
+
+  Args:
+    files: List of full paths of photos.
+    fallback: Whether photos that can't be parsed are read with exiftool.
+  Returns:
+    Dict of file path to GPS tags, see parse_gps.  Photos without a GPS
+    position are left out.
+  """
+  tags = {}
+  unparsed = []
+  for photo_file in files:
+    try:
+      record = read_gps(photo_file)
+    except ExifError:
+      unparsed.append(photo_file)
+      continue
+    if record is not None:
+      tags[photo_file] = record
+  if fallback and unparsed:
+    try:
+      with exiftool_pool.ExifToolPool() as pool:
+        exiftool_tags = pool.read_gps_tags(unparsed)
+    except OSError:
+      sys.stderr.write("exiftool is not available, skipping %d photos\n" % len(unparsed))
+      exiftool_tags = {}
+    for photo_file, record in exiftool_tags.items():
+      if record["latitude"] is None or record["longitude"] is None:
+        continue
+      for name in ("latitude", "longitude", "altitude"):
+        if record[name] is not None:
+          record[name] = float(record[name])
+      tags[photo_file] = record
+  return tags
+
+
+def gps_epoch(record):
+  """Returns the GPS time of a record in seconds since epoch.
+
+  Raises:
+    ValueError: If the record has no GPS date or time.
+  """
+  if not record.get("datestamp") or not record.get("timestamp"):
+    raise ValueError("No GPS date and time")
+  timestring = "%sT%s" % (record["datestamp"], record["timestamp"].split(".")[0])
+  return int(timegm(time.strptime(timestring, "%Y:%m:%dT%H:%M:%S")))
+
+
+def write_gpx(files, output):
+  """Writes the GPS positions of photos as a single GPX track.
+
+  Args:
+    files: List of full paths of photos, in track order.
+    output: File object to write to.
+  """
+  tags = read_gps_tags(files)
+  output.write(GPX_HEADER + "\n")
+  for photo_file in files:
+    record = tags.get(photo_file)
+    if record is None:
+      continue
+    date = (record["datestamp"] or "").replace(":", "-")
+    output.write('<trkpt lat="%r" lon="%r"><ele>%s</ele><time>%sT%sZ</time></trkpt>\n' % (
+        record["latitude"], record["longitude"],
+        "" if record["altitude"] is None else repr(record["altitude"]),
+        date, record["timestamp"] or ""))
+  output.write(GPX_FOOTER + "\n")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Writes the GPS EXIF tags of photos as GPX")
+  parser.add_argument("photos", nargs="+", help="Photos to read, in track order")
+  args = parser.parse_args()
+  write_gpx(args.photos, sys.stdout)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,191 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Long-lived exiftool workers for reading GPS tags from many photos.
+#
+# Starting exiftool once per tag per photo means one Perl interpreter startup
+# per value, which dominates the run time for large timelapse folders.  Each
+# worker here keeps a single exiftool process open with -stay_open and feeds
+# it batches of files through its argfile (stdin), so a whole batch of photos
+# costs one round trip.  A pool of workers spreads the batches across cores.
+#
+# Exiftool is required, get it here:
+# https://www.sno.phy.queensu.ca/~phil/exiftool/install.html
+
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import os
+import subprocess
+
+EXIFTOOL = "exiftool"
+BATCH_SIZE = 250
+
+# Tags are requested in this order.  The "#" suffix disables print conversion
+# for that tag only, which matches "exiftool -n -<tag>" for the coordinates
+# while keeping the usual formatting for the date and time stamps.
+GPS_TAGS = [
+    ("datestamp", "GPSDateStamp"),
+    ("timestamp", "GPSTimeStamp"),
+    ("latitude", "GPSLatitude#"),
+    ("longitude", "GPSLongitude#"),
+    ("altitude", "GPSAltitude#"),
+]
+
+
+class ExifToolWorker(object):
+  """A single exiftool process kept open with -stay_open."""
+
+  def __init__(self, executable=EXIFTOOL):
+    self.process = subprocess.Popen(
+        [executable, "-stay_open", "True", "-@", "-"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        universal_newlines=True)
+    self.sequence = 0
+
+  def execute(self, args):
+    """Runs one exiftool command and returns its output lines.
+
+    Args:
+      args: List of command line arguments for this command.
+    Returns:
+      List of output lines, without the trailing {ready} marker.
+    """
+    self.sequence += 1
+    ready = "{ready%d}" % self.sequence
+    for arg in args:
+      self.process.stdin.write(arg + "\n")
+    self.process.stdin.write("-execute%d\n" % self.sequence)
+    self.process.stdin.flush()
+    lines = []
+    while True:
+      line = self.process.stdout.readline()
+      if not line:
+        raise IOError("exiftool exited unexpectedly")
+      line = line.rstrip("\n")
+      if line == ready:
+        return lines
+      lines.append(line)
+
+  def read_gps_tags(self, files):
+    """Reads the GPS tags of a batch of files in one round trip.
+
+    Args:
+      files: List of full paths of photos.
+    Returns:
+      Dict of file path to a dict keyed by the names in GPS_TAGS.  Tags that
+      are not present in a file are None.  Unreadable files are left out.
+    """
+    args = ["-T", "-fast2", "-Directory", "-FileName"]
+    args += ["-" + tag for (_, tag) in GPS_TAGS]
+    lines = self.execute(args + list(files))
+    by_path = {}
+    for line in lines:
+      values = line.split("\t")
+      if len(values) != len(GPS_TAGS) + 2:
+        continue
+      record = {}
+      for (name, _), value in zip(GPS_TAGS, values[2:]):
+        record[name] = None if value == "-" else value
+      by_path[os.path.abspath(os.path.join(values[0], values[1]))] = record
+    tags = {}
+    for path in files:
+      record = by_path.get(os.path.abspath(path))
+      if record is not None:
+        tags[path] = record
+    return tags
+
+  def close(self):
+    """Asks exiftool to exit and waits for it."""
+    if self.process.poll() is None:
+      self.process.stdin.write("-stay_open\nFalse\n")
+      self.process.stdin.flush()
+      self.process.wait()
+
+
+class ExifToolPool(object):
+  """A pool of ExifToolWorkers, one per core by default.
+
+  Usage:
+    with ExifToolPool() as pool:
+      tags = pool.read_gps_tags(files)
+  """
+
+  def __init__(self, workers=None, batch_size=BATCH_SIZE, executable=EXIFTOOL):
+    self.size = workers or cpu_count()
+    self.batch_size = batch_size
+    self.executable = executable
+    self.workers = []
+    self.threads = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+
+  def _start(self):
+    if self.threads is None:
+      self.workers = [ExifToolWorker(self.executable) for _ in range(self.size)]
+      self.threads = ThreadPool(self.size)
+
+  def read_gps_tags(self, files):
+    """Reads the GPS tags of all files, spread across the workers.
+
+    Each worker thread only talks to its own exiftool process, so batches run
+    concurrently while the actual parsing happens in the exiftool processes.
+
+    Args:
+      files: List of full paths of photos.
+    Returns:
+      Dict of file path to tag dict, see ExifToolWorker.read_gps_tags.
+    """
+    files = list(files)
+    if not files:
+      return {}
+    self._start()
+    # Small folders are split evenly so that every worker gets some files.
+    batch_size = min(self.batch_size, -(-len(files) // self.size))
+    batches = [files[i:i + batch_size]
+               for i in range(0, len(files), batch_size)]
+    # Batches that share a worker must not be interleaved on its pipe, so each
+    # thread runs all of the batches of one worker in order.
+    per_worker = [batches[i::self.size] for i in range(self.size)]
+    results = self.threads.map(_read_batches,
+                               zip(self.workers, per_worker))
+    tags = {}
+    for result in results:
+      tags.update(result)
+    return tags
+
+  def close(self):
+    """Stops all exiftool processes."""
+    if self.threads is not None:
+      self.threads.close()
+      self.threads.join()
+      self.threads = None
+    for worker in self.workers:
+      worker.close()
+    self.workers = []
+
+
+def _read_batches(worker_batches):
+  worker, batches = worker_batches
+  tags = {}
+  for batch in batches:
+    tags.update(worker.read_gps_tags(batch))
+  return tags
@@ -0,0 +1,111 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Picks video frames by distance travelled instead of by time.
+#
+# At a fixed frame rate, a vehicle that crawls or stands still produces many
+# nearly identical frames that cost encode time and upload bytes.  Here a
+# GPS point is kept once it is at least a given distance away from the last
+# point kept, and only the frames at the kept points are encoded.  The
+# distance is measured from the last kept point rather than summed along the
+# track, so GPS jitter while standing still doesn't add up to a new frame.
+#
+# For a video, the kept frames are selected with ffmpeg's select filter and
+# keep their original timestamps, so the GPS timeline still matches the
+# video.  For timelapse photos, the kept photos are linked into a new folder
+# and the GPS timeline is reduced to the same photos.
+
+
+import os
+import numpy
+
+
+def distance_indices(timeline, spacing):
+  """Returns the indices of the points to keep, one every spacing metres.
+
+  Args:
+    timeline: A sorted GpsTimeline.
+    spacing: Minimum distance in metres between kept points.
+  Returns:
+    Sorted array of point indices, starting with the first point.
+  """
+  if len(timeline) == 0:
+    return numpy.zeros(0, dtype=numpy.int64)
+  x, y = timeline.metres()
+  kept = [0]
+  last_x, last_y = x[0], y[0]
+  limit = spacing * spacing
+  for i in range(1, len(x)):
+    if (x[i] - last_x) ** 2 + (y[i] - last_y) ** 2 >= limit:
+      kept.append(i)
+      last_x, last_y = x[i], y[i]
+  return numpy.array(kept, dtype=numpy.int64)
+
+
+def frame_numbers(timeline, spacing, rate):
+  """Returns the numbers of the video frames to keep, one every spacing metres.
+
+  Args:
+    timeline: A sorted GpsTimeline whose first point is at the start of the
+      video.
+    spacing: Minimum distance in metres between kept frames.
+    rate: Frame rate of the video.
+  Returns:
+    Sorted array of unique frame numbers.
+  """
+  times = timeline.times()
+  if len(times) == 0:
+    return numpy.zeros(0, dtype=numpy.int64)
+  kept = times[distance_indices(timeline, spacing)] - times[0]
+  return numpy.unique(numpy.round(kept * rate).astype(numpy.int64))
+
+
+def select_filter(frames, rate):
+  """Returns an ffmpeg filter that keeps only the given frames.
+
+  The expression can get too long for a command line argument, so it is
+  meant to be written to a file for -filter_script:v.
+
+  Args:
+    frames: Sorted frame numbers at the given rate.
+    rate: Frame rate the video is resampled to before selecting.
+  Returns:
+    The filter graph as a string.
+  """
+  ranges = []
+  for frame in frames:
+    if ranges and ranges[-1][1] == frame - 1:
+      ranges[-1][1] = frame
+    else:
+      ranges.append([frame, frame])
+  terms = "+".join("between(n,%d,%d)" % (start, end) for start, end in ranges)
+  return "fps=%s,select='%s'" % (rate, terms or "0")
+
+
+def link_photos(photos, directory, prefix="frame_select"):
+  """Links photos into a folder, numbered consecutively from 1.
+
+  Args:
+    photos: Full paths of the photos, in order.
+    directory: An empty folder to link them into.
+    prefix: Start of the new file names, which are <prefix>_<number>.jpg.
+  """
+  for number, photo in enumerate(photos, 1):
+    target = os.path.join(directory, "%s_%06d.jpg" % (prefix, number))
+    try:
+      os.symlink(os.path.abspath(photo), target)
+    except (OSError, AttributeError):
+      os.link(photo, target)
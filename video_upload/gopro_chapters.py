@@ -0,0 +1,161 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Finds and joins the chapters of a GoPro recording.
+#
+# GoPro cameras split long recordings into chapters of about 4 GB.  The first
+# chapter is named like GPFR0001.MP4 and the following ones GF010001.MP4,
+# GF020001.MP4 and so on: the last four digits are the recording and the two
+# digits after the prefix are the chapter.  Chapters of one recording have
+# the same encoding settings, so they are joined with the concat demuxer
+# without re-encoding.  The GPMF track of every chapter is read in its own
+# process, and the points of all chapters form one GPS track.
+
+
+import multiprocessing
+import os
+import re
+import tempfile
+import gpmf
+import segmented_encode
+
+# Prefix of the first chapter, and of the following chapters.
+FIRST_CHAPTER_PREFIXES = {
+    "GPFR": "GF",  # Fusion, front camera.
+    "GPBK": "GB",  # Fusion, back camera.
+    "GOPR": "GP",  # HERO5 and older.
+}
+# Cameras that number the first chapter 01 as well.
+NUMBERED_PREFIXES = ("GH", "GX")
+
+FIRST_CHAPTER = re.compile(r"^(%s)(\d{4})(\.\w+)$" % "|".join(FIRST_CHAPTER_PREFIXES),
+                           re.IGNORECASE)
+CHAPTER = re.compile(r"^(%s)(\d{2})(\d{4})(\.\w+)$" % "|".join(
+    set(FIRST_CHAPTER_PREFIXES.values()) | set(NUMBERED_PREFIXES)), re.IGNORECASE)
+
+
+def _parse(file_name):
+  """Returns (first chapter prefix, chapter prefix, chapter, recording), or None."""
+  match = FIRST_CHAPTER.match(file_name)
+  if match:
+    prefix = match.group(1).upper()
+    return prefix, FIRST_CHAPTER_PREFIXES[prefix], 0, match.group(2)
+  match = CHAPTER.match(file_name)
+  if match:
+    prefix = match.group(1).upper()
+    first = [k for k, v in FIRST_CHAPTER_PREFIXES.items() if v == prefix]
+    return (first[0] if first else None), prefix, int(match.group(2)), match.group(3)
+  return None
+
+
+def chapters(video_file):
+  """Returns all chapters of the recording a video belongs to.
+
+  Args:
+    video_file: Full path of any chapter of the recording.
+  Returns:
+    Full paths of the chapters in order, or just video_file if it isn't
+    named like a GoPro chapter.
+  """
+  directory, file_name = os.path.split(video_file)
+  parsed = _parse(file_name)
+  if parsed is None:
+    return [video_file]
+  first_prefix, prefix, _, recording = parsed
+  found = []
+  for name in os.listdir(directory or "."):
+    other = _parse(name)
+    if (other is not None and other[3] == recording and other[1] == prefix and
+        other[0] == first_prefix and
+        os.path.splitext(name)[1].lower() == os.path.splitext(file_name)[1].lower()):
+      found.append((other[2], os.path.join(directory, name)))
+  return [path for _, path in sorted(found)] or [video_file]
+
+
+def stitched_file(video_file):
+  """Returns the file name the chapters of a recording are joined into."""
+  base, extension = os.path.splitext(video_file)
+  return "%s.chapters%s" % (base, extension)
+
+
+def stitch(chapter_files, output):
+  """Joins the chapters of a recording into one file, without re-encoding.
+
+  A joined file that is newer than all chapters is reused.  The chapters are
+  joined into a temp file next to the output, which is only renamed to the
+  output once ffmpeg succeeds, so an interrupted join is never reused.
+
+  Args:
+    chapter_files: Full paths of the chapters, in order.
+    output: The file the chapters are joined into.
+  Returns:
+    The output file.
+  Raises:
+    OSError: If ffmpeg fails.
+  """
+  if (os.path.exists(output) and os.path.getmtime(output) >=
+      max(os.path.getmtime(chapter) for chapter in chapter_files)):
+    print("Using chapters joined before: %s" % output)
+    return output
+  print("Joining %d chapters into %s" % (len(chapter_files), output))
+  directory, file_name = os.path.split(output)
+  # ffmpeg picks the container from the extension, so the temp file keeps it.
+  handle, joining = tempfile.mkstemp(prefix="%s." % file_name,
+                                     suffix=os.path.splitext(output)[1], dir=directory or ".")
+  os.close(handle)
+  # The concat list goes to the temp folder, not next to the chapters.
+  handle, list_file = tempfile.mkstemp(prefix="chapters", suffix=".txt")
+  os.close(handle)
+  try:
+    returncode = segmented_encode.concat(
+        [os.path.abspath(chapter) for chapter in chapter_files], joining, list_file)
+    if returncode != 0:
+      raise OSError("Could not join the chapters into %s" % output)
+    if os.path.exists(output):
+      os.remove(output)
+    os.rename(joining, output)
+  finally:
+    os.remove(list_file)
+    if os.path.exists(joining):
+      os.remove(joining)
+  return output
+
+
+def read_chapter_gps(video_file):
+  """Returns the GPS points of the GPMF track of one chapter, or None."""
+  try:
+    return gpmf.read_gps_points(video_file)
+  except gpmf.GpmfError as error:
+    print("%s: %s" % (video_file, error))
+    return None
+
+
+def read_gps(chapter_files, jobs):
+  """Reads the GPMF tracks of several chapters in parallel processes.
+
+  Args:
+    chapter_files: Full paths of the chapters.
+    jobs: Maximum number of processes.
+  Returns:
+    List with the points of each chapter, None for the chapters whose GPMF
+    track couldn't be read.
+  """
+  pool = multiprocessing.Pool(max(1, min(jobs, len(chapter_files))))
+  try:
+    return pool.map(read_chapter_gps, chapter_files)
+  finally:
+    pool.close()
+    pool.join()
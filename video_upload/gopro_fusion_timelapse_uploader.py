@@ -20,7 +20,9 @@
 # also supports auto-connections and blurring.
 #
 # Because the script packages all the photos into a single file for uploading, it
-# requires that you have as much free space as you have photos to upload.
+# requires that you have as much free space as you have photos to upload.  Pass
+# --stream to upload the video while it is being packaged instead; this needs no
+# free space for the video but can't be combined with --resumable or --exif.
 
 # Usage:
 #
@@ -28,7 +30,12 @@
 #   --folder=<folder containing stitched photos> \
 #   --blur (optional) \
 #   --compress (optional) \
+#   --resumable (optional) \
+#   --stream (optional) \
 #   --key=<your developer key>
+#
+# Pass --resumable to upload the video in chunks.  If the upload is interrupted,
+# running the same command again skips the packaging and continues from the last acknowledged byte.
 
 # Enabling compression will reduce the size of the uploaded file by 5-10x but
 # the compression itself may take a long time to run.  To decide whether to use
@@ -43,11 +50,38 @@
 #
 # Only one compression flag can be used at a time.  Additional compression flags
 # will be ignored.
+#
+# Compression runs in segments on all CPU cores, which are joined afterwards.
+# Pass --jobs to limit the number of segments compressed at once.
+#
+# Pass --compress=auto to let the script decide.  It encodes a few photos with
+# each mode, measures the upload throughput by uploading a sample (or takes it
+# from --upload_mbps) and picks the mode with the shortest predicted time to
+# encode and upload all photos.  If that can't be measured, it compresses as
+# with plain --compress.
+#
+# Pass --frame_spacing to keep one photo every so many metres, based on the GPS
+# positions of the photos.  Photos taken while standing still or moving slowly
+# are left out of the video and the GPS timeline.
+#
+# Photos without GPS data are left out of the video as well, so that every
+# frame of the video keeps its own point of the GPS timeline.
+#
+# Pass --split_minutes or --split_mb to publish a long timelapse as several
+# sequences.  The packaged video is cut at keyframes without encoding it again,
+# and up to --split_jobs parts are uploaded and published at the same time.
+# With --metadata_json, the request of each part goes to its own file, e.g.
+# metadata.part000.json.
+# This needs ffprobe, which comes with FFmpeg.
+#
+# Pass --gpx_archive to also add the GPS positions of the photos to a local GPS
+# archive, which standalone_uploader.py can read tracks from.
 
 # Requirements:
 # This script requires the following libraries:
 #
 # - google-api-python-client
+# - numpy
 # - pycurl
 #
 # The libraries can be installed by running:
@@ -55,12 +89,14 @@
 # $ pip install <library name>
 #
 # FFmpeg is required, follow instructions at https://trac.ffmpeg.org/wiki/CompilationGuide
+#
+# Exiftool is only needed for photos whose GPS data can't be read directly,
+# and for --exif.  Get it here:
+# https://www.sno.phy.queensu.ca/~phil/exiftool/install.html
 
 
 import argparse
 from datetime import datetime
-from calendar import timegm
-import time
 import json
 import os
 import re
@@ -68,14 +104,29 @@ import sys
 import urlparse
 import gpxpy
 import gpxpy.gpx
-from apiclient import discovery
 from apiclient import errors
 import httplib2
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
+import shutil
 import subprocess
+import tempfile
+import threading
 import pycurl
+import discovery_cache
+import encode_planner
+import resumable_upload
+import segmented_encode
+import sequence_split
+import stream_upload
+import token_manager
+import video_probe
+import exif_gps
+import frame_select
+import gps_archive
+import gps_timeline
+import publish_json
 
 
 API_NAME = "streetviewpublish"
@@ -90,13 +141,34 @@ REDIRECT_URI = "http://localhost:8080"
 parser = argparse.ArgumentParser(parents=[tools.argparser])
 parser.add_argument("--folder", help="The folder you want to upload")
 parser.add_argument("--blur", default=False, action='store_true', help="Enable auto-blurring")
-parser.add_argument("--compress", default=False, action='store_true', help="Enable compression")
+parser.add_argument("--compress", nargs="?", const=True, default=False, choices=["auto"], help="Enable compression, or with --compress=auto pick the fastest mode")
 parser.add_argument("--compressmore", default=False, action='store_true', help="Enable higher level of compression")
 parser.add_argument("--compressfast", default=False, action='store_true', help="Enable faster compression")
 parser.add_argument("--exif", default=False, action='store_true', help="Write make/model to metadata")
 parser.add_argument("--key", help="Your developer key")
+parser.add_argument("--resumable", default=False, action='store_true', help="Upload in chunks and resume interrupted uploads")
+parser.add_argument("--stream", default=False, action='store_true', help="Upload the video while it is being converted, without a temporary file")
+parser.add_argument("--metadata_json", help="Also write the publish request to this JSON file, for debugging")
+parser.add_argument("--simplify", type=float, help="Drop GPS points that are within this many metres of the simplified track")
+parser.add_argument("--max_gap", type=float, default=5, help="With --simplify, maximum seconds between GPS points kept")
+parser.add_argument("--gpx_archive", help="Also add the GPS positions of the photos to this GPS archive")
+parser.add_argument("--upload_mbps", type=float, help="With --compress=auto, upload throughput in Mbit/s instead of measuring it")
+parser.add_argument("--frame_spacing", type=float, help="Keep one photo every this many metres instead of every photo")
+parser.add_argument("--jobs", type=int, default=segmented_encode.default_jobs(), help="Number of video segments to compress in parallel")
+parser.add_argument("--split_minutes", type=float, help="Split the video into sequences of at most this many minutes, one photo per second")
+parser.add_argument("--split_mb", type=float, help="Split the video into sequences of at most this many MB")
+parser.add_argument("--split_jobs", type=int, default=sequence_split.MAX_JOBS, help="Number of parts to upload and publish at the same time")
+parser.add_argument("--chunk_size", type=int, default=8, help="Chunk size in MB for resumable uploads")
 flags = parser.parse_args()
 
+COMPRESSION_MODES = ["copy", "compressfast", "compress", "compressmore"]
+
+api_service = threading.local()
+service_lock = threading.Lock()
+tokens = None
+# The mode picked by --compress=auto.
+compression = None
+
 
 def get_discovery_service_url():
   """Returns the discovery service url."""
@@ -108,15 +180,46 @@ def get_discovery_service_url():
   return discovery_service_url
 
 
+def get_service():
+  """Returns the API service object of the calling thread.
+
+  The service is built once per thread from a cached copy of the discovery
+  document, and reused by every step on that thread.  httplib2 connections
+  aren't thread-safe, so the threads that publish parts of a split video
+  each get their own service.
+
+  Returns:
+    The Street View Publish API service object.
+  """
+  service = getattr(api_service, "service", None)
+  if service is None:
+    with service_lock:
+      credentials = get_credentials()
+      http = credentials.authorize(httplib2.Http())
+      service = discovery_cache.build(
+          API_NAME,
+          API_VERSION,
+          developerKey=flags.key,
+          discoveryServiceUrl=get_discovery_service_url(),
+          http=http)
+    api_service.service = service
+  return service
+
+
 def get_credentials():
   """Gets valid user credentials from storage.
 
   If nothing has been stored, or if the stored credentials are invalid,
   the OAuth2 flow is completed to obtain the new credentials.
+  The credentials are only loaded once per run.  After that, a TokenManager
+  keeps the access token valid and the same credentials are returned.
 
   Returns:
       Credentials, the obtained credential.
   """
+  global tokens
+  if tokens is not None:
+    return tokens.get_credentials()
   home_dir = os.path.expanduser("~")
   credential_dir = os.path.join(home_dir, ".credentials")
   if not os.path.exists(credential_dir):
@@ -134,7 +237,9 @@ def get_credentials():
     else:
       credentials = tools.run(flow, store)
     print "Storing credentials to " + credential_path
-  return credentials
+  tokens = token_manager.TokenManager(credential_path, credentials)
+  tokens.start()
+  return tokens.get_credentials()
 
 
 def get_file_size(file_name):
@@ -195,14 +300,7 @@ def request_upload_url():
   Returns:
     The Upload URL.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   start_upload_response = service.photoSequence().startUpload(body={}).execute()
   upload_url = str(start_upload_response["uploadUrl"])
   return upload_url
@@ -219,6 +317,14 @@ def upload_video(video_file, upload_url):
   """
   credentials = get_credentials()
   credentials.authorize(httplib2.Http())
+  if flags.resumable:
+    try:
+      resumable_upload.upload(str(video_file), upload_url, credentials,
+                              chunk_size=flags.chunk_size * 1024 * 1024,
+                              progress=xfer_progress)
+    except resumable_upload.UploadError as error:
+      print("Error uploading file %s: %s" % (video_file, error))
+    return
   file_size = get_file_size(str(video_file))
   try:
     curl = pycurl.Curl()
@@ -240,31 +346,31 @@ def upload_video(video_file, upload_url):
     print("Error uploading file %s" % video_file)
 
 
-def publish_video(upload_url, geodata, create_time):
+def publish_video(upload_url, geodata, create_time, debug_file=None):
   """Publishes the content on Street View (step 3/3).
 
   Args:
     upload_url: The upload URL returned by step 1.
-    geodata: the rawGpsTimelines from extract_geodata
+    geodata: the GpsTimeline from extract_geodata
     create_time: the GPS timestamp of the first photo
+    debug_file: File to write the publish request to, defaults to
+      --metadata_json.
   Returns:
     The id if the upload was successful, otherwise None.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   publish_request = {"uploadReference": {"uploadUrl": upload_url}}
   publish_request["captureTimeOverride"] = {"seconds": create_time}
   if flags.blur:
     publish_request["blurringOptions"] = {"blurFaces":"true","blurLicensePlates":"true"}
-  publish_request.update({"rawGpsTimeline": geodata})
+  if flags.simplify is not None:
+    simplified = geodata.simplify(flags.simplify, flags.max_gap)
+    saved = publish_json.timeline_size(geodata) - publish_json.timeline_size(simplified)
+    print("Kept %d of %d GPS points, %d bytes saved" % (len(simplified), len(geodata), saved))
+    geodata = simplified
   try:
-    publish_response = service.photoSequence().create(body=publish_request, inputType="VIDEO").execute()
+    publish_response = publish_json.create_sequence(
+        service, publish_request, geodata, debug_file or flags.metadata_json)
     return publish_response["name"]
   except errors.HttpError as error:
     response_error = json.loads(error.content)
@@ -273,69 +379,281 @@ def publish_video(upload_url, geodata, create_time):
 
 
 def extract_geodata(directory):
-  rawGpsTimelines = []
+  """Reads the GPS EXIF tags of every photo in the folder.
+
+  The tags are parsed directly from the Exif header of each photo, only
+  photos that can't be parsed that way are read with exiftool.
+
+  Args:
+    directory: The folder containing the stitched photos.
+  Returns:
+    Tuple of the GpsTimeline, the GPS timestamp of the first photo and the
+    photos the points of the timeline belong to.
+  """
+  points = []
+  photos = []
+  # Unlike the timeline, the archive gets the GPS time of every photo.
+  archive_points = []
   timestamp = 0
   createTime = 0
-  for filename in sorted(os.listdir(directory)):
-      if filename.endswith(".jpg"):
-          rawGpsTimeline = {}
-          current_file = os.path.join(directory, filename)
-          print "Extracting EXIF from %s" % current_file
-          if timestamp == 0:
-              t = subprocess.check_output(["exiftool", "-gpstimestamp", current_file])
-              t = t.split(":")
-              t = t[1].strip() + ":" + t[2].strip() + ":" + t[3].strip()
-              d = subprocess.check_output(["exiftool", "-gpsdatestamp", current_file])
-              d = d.split(":")
-              d = d[1].strip() + ":" + d[2].strip() + ":" + d[3].strip()
-              p = '%Y:%m:%dT%H:%M:%S'
-              timestring = str(d) + 'T' + str(t)
-              timestamp = int(timegm(time.strptime(timestring, p)))
-              createTime = timestamp
-          else:
-              # For simplicity, we just increment each photo by one second so we don't
-              # actually need to determine the original framerate.  As long as we also
-              # encode the video at 1fps, this is completely fine.
-              timestamp = timestamp + 1
-          lon = subprocess.check_output(["exiftool", "-gpslongitude", "-n", current_file])
-          lon = lon.split(":")
-          lon = lon[1].strip()
-          lat = subprocess.check_output(["exiftool", "-gpslatitude", "-n", current_file])
-          lat = lat.split(":")
-          lat = lat[1].strip()
-          alt = subprocess.check_output(["exiftool", "-gpsaltitude", "-n", current_file])
-          alt = alt.split(":")
-          alt = alt[1].strip()
-          rawGpsTimeline["latLngPair"] = {
-              "latitude": lat,
-              "longitude": lon
-          }
-          rawGpsTimeline["altitude"] = alt
-          rawGpsTimeline["gpsRecordTimestampUnixEpoch"] = {
-              "seconds": timestamp
-          }
-          print rawGpsTimeline
-          rawGpsTimelines.append(rawGpsTimeline)
-  return (rawGpsTimelines, createTime)
+  files = [os.path.join(directory, filename)
+           for filename in sorted(os.listdir(directory))
+           if filename.endswith(".jpg")]
+  print "Extracting EXIF from %d photos in %s" % (len(files), directory)
+  gps_tags = exif_gps.read_gps_tags(files)
+  for current_file in files:
+      tags = gps_tags.get(current_file)
+      if tags is None:
+          print "No GPS data in %s, skipping" % current_file
+          continue
+      if timestamp == 0:
+          try:
+              timestamp = exif_gps.gps_epoch(tags)
+          except ValueError:
+              print "No GPS time in %s, skipping" % current_file
+              continue
+          createTime = timestamp
+      else:
+          # For simplicity, we just increment each photo by one second so we don't
+          # actually need to determine the original framerate.  As long as we also
+          # encode the video at 1fps, this is completely fine.
+          timestamp = timestamp + 1
+      points.append((timestamp, 0, tags["latitude"], tags["longitude"],
+                     tags["altitude"]))
+      photos.append(current_file)
+      if flags.gpx_archive:
+        try:
+          archive_points.append((exif_gps.gps_epoch(tags), 0, tags["latitude"],
+                                 tags["longitude"], tags["altitude"]))
+        except (AttributeError, KeyError, ValueError):
+          pass
+  if flags.gpx_archive:
+    archive = gps_archive.GpsArchive(flags.gpx_archive)
+    try:
+      added = archive.add_timeline(gps_timeline.GpsTimeline.from_points(archive_points))
+    finally:
+      archive.close()
+    print "Added %d GPS points to the archive" % added
+  return (gps_timeline.GpsTimeline.from_points(points), createTime, photos)
+
+
+def select_photos(photos, geodata, create_time):
+  """Keeps one photo every --frame_spacing metres.
 
-def convert_video(directory):
-  output_mp4 = "gopro_temp_video.mp4"
-  first_file = os.listdir(directory)[1]
-  split_file = first_file.split("_")
-  file_pattern = directory + "/" + split_file[0] + "_" + split_file[1] + '_%06d.jpg'
+  Args:
+    photos: The photos returned by extract_geodata().
+    geodata: The GpsTimeline returned by extract_geodata().
+    create_time: The GPS timestamp of the first photo.
+  Returns:
+    Tuple of a new folder with links to the kept photos and their GpsTimeline.
+  """
+  indices = frame_select.distance_indices(geodata, flags.frame_spacing)
+  print "Keeping %d of %d photos, one every %s metres" % (len(indices), len(photos), flags.frame_spacing)
+  # The kept photos are packaged at one per second too, so their points get
+  # consecutive timestamps again.
+  points = [(create_time + i, 0, latitude, longitude, altitude)
+            for i, (_, _, latitude, longitude, altitude) in enumerate(geodata.take(indices))]
+  directory = tempfile.mkdtemp(prefix="frame_select")
+  frame_select.link_photos([photos[i] for i in indices], directory)
+  return directory, gps_timeline.GpsTimeline.from_points(points)
+
+
+def link_gps_photos(photos):
+  """Links the photos with GPS data into a new folder.
+
+  Packaging the folder with the photos without GPS data would shift every
+  later photo against its point of the GPS timeline.
+
+  Args:
+    photos: The photos returned by extract_geodata().
+  Returns:
+    The new folder.
+  """
+  directory = tempfile.mkdtemp(prefix="gps_photos")
+  frame_select.link_photos(photos, directory, prefix="gps_photos")
+  return directory
+
+def get_compression():
+  """Returns the name of the compression mode selected by the flags."""
+  if compression is not None:
+    return compression
   if flags.compressmore:
-    subprocess.call(["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "slower", "-crf", "30", "-r", "1", "-y", output_mp4])
+    return "compressmore"
   elif flags.compressfast:
-    subprocess.call(["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "fast", "-crf", "18", "-r", "1", "-y", output_mp4])
+    return "compressfast"
   elif flags.compress:
-    subprocess.call(["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "slower", "-crf", "18", "-r", "1", "-y", output_mp4])
+    return "compress"
+  else:
+    return "copy"
+
+
+def get_convert_command(directory, output_mp4, mode=None):
+  """Returns the ffmpeg command that packages the photos into a video.
+
+  Args:
+    directory: The folder containing the stitched photos.
+    output_mp4: The file the video is written to.
+    mode: "copy", "compressfast", "compress" or "compressmore".  Defaults to
+      the mode selected by the flags.
+  Returns:
+    The ffmpeg command line as a list.
+  """
+  if mode is None:
+    mode = get_compression()
+  first_file = os.listdir(directory)[1]
+  split_file = first_file.split("_")
+  file_pattern = directory + "/" + split_file[0] + "_" + split_file[1] + '_%06d.jpg'
+  if mode == "compressmore":
+    return ["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "slower", "-crf", "30", "-r", "1", "-y", output_mp4]
+  elif mode == "compressfast":
+    return ["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "fast", "-crf", "18", "-r", "1", "-y", output_mp4]
+  elif mode == "compress":
+    return ["ffmpeg", "-r", "1", "-i", file_pattern, "-c:v", "libx264", "-preset", "slower", "-crf", "18", "-r", "1", "-y", output_mp4]
+  else:
+    return ["ffmpeg", "-framerate", "1", "-i", file_pattern, "-codec", "copy", "-y", output_mp4]
+
+
+def choose_compression(directory):
+  """Picks the compression mode with the shortest predicted encode and upload.
+
+  Every mode is tried on the first photos of the folder.  The upload
+  throughput is taken from --upload_mbps, or measured by uploading the
+  uncompressed sample to an Upload URL that is never published.  The encode
+  time of the compressed modes is predicted for the segments convert_video()
+  encodes in parallel.  With --stream, the photos are encoded in one pass.
+
+  Modes whose sample fails to encode are left out.  If no mode could be
+  sampled or the throughput is unknown, the mode of plain --compress is used.
+
+  Args:
+    directory: The folder containing the stitched photos.
+  Returns:
+    The name of the compression mode.
+  """
+  total_frames = len([f for f in os.listdir(directory) if f.endswith(".jpg")])
+  frames = min(encode_planner.SAMPLE_FRAMES, total_frames)
+  sample_dir = tempfile.mkdtemp()
+  sample_mp4 = os.path.join(sample_dir, "sample.mp4")
+  samples = {}
+  throughput = None
+  try:
+    for mode in COMPRESSION_MODES:
+      print "Encoding %d photos with %s" % (frames, mode)
+      try:
+        samples[mode] = encode_planner.sample_encode(
+            get_convert_command(directory, sample_mp4, mode), frames)
+      except OSError as error:
+        print "Leaving out %s: %s" % (mode, error)
+    if flags.upload_mbps is not None:
+      throughput = flags.upload_mbps * 1e6 / 8
+    elif samples:
+      print "Measuring upload throughput"
+      try:
+        if subprocess.call(encode_planner.sample_command(
+            get_convert_command(directory, sample_mp4, "copy"), frames)) != 0:
+          raise OSError("Could not package the sample to upload")
+        throughput = encode_planner.measure_upload(
+            request_upload_url(), get_credentials().access_token, sample_mp4)
+      except (OSError, IOError, pycurl.error, errors.HttpError) as error:
+        print "Could not measure the upload throughput: %s" % error
+  finally:
+    if os.path.exists(sample_mp4):
+      os.remove(sample_mp4)
+    os.rmdir(sample_dir)
+  if not samples or not throughput or throughput <= 0:
+    fallback = get_compression()
+    print "Can't predict the upload time, using %s" % fallback
+    return fallback
+  # The photos are packaged at one per second.
+  parallelism = 1 if flags.stream else segmented_encode.parallelism(total_frames, flags.jobs)
+  estimates = [encode_planner.estimate(mode, samples[mode][0], samples[mode][1],
+                                       frames, total_frames, throughput, flags.stream,
+                                       1 if mode == "copy" else parallelism)
+               for mode in COMPRESSION_MODES if mode in samples]
+  encode_planner.report(estimates, throughput)
+  best = min(estimates, key=lambda e: e.total_seconds)
+  print "Using %s, predicted time to upload: %.0fs" % (best.name, best.total_seconds)
+  return best.name
+
+
+def convert_video(directory):
+  output_mp4 = "gopro_temp_video.mp4"
+  if flags.resumable and resumable_upload.load_journal(output_mp4) is not None:
+    print "Resuming unfinished upload of %s" % output_mp4
+    return output_mp4
+  command = get_convert_command(directory, output_mp4)
+  if get_compression() == "copy":
+    subprocess.call(command)
   else:
-    subprocess.call(["ffmpeg", "-framerate", "1", "-i", file_pattern, "-codec", "copy", "-y", output_mp4])
+    # The photos are packaged at one per second, so a segment starting at
+    # second n starts at the nth photo.
+    numbers = sorted(int(f[:-len(".jpg")].split("_")[-1]) for f in os.listdir(directory) if f.endswith(".jpg"))
+    segmented_encode.encode(command, len(numbers), 1, flags.jobs,
+                            seek=lambda start: ["-start_number", str(numbers[0] + start)])
   if flags.exif:
     subprocess.call(["exiftool", '-make="GoPro"', '-model="GoPro Fusion"', "-overwrite_original", output_mp4])
   return output_mp4
 
+
+def stream_video(directory, upload_url):
+  """Packages the photos and uploads the video while it is being packaged.
+
+  Args:
+    directory: The folder containing the stitched photos.
+    upload_url: The upload URL returned by step 1.
+  Returns:
+    None.
+  """
+  credentials = get_credentials()
+  response_code, uploaded = stream_upload.encode_and_upload(
+      get_convert_command(directory, "gopro_temp_video.mp4"),
+      upload_url, credentials.access_token)
+  if response_code != 200:
+    print("Error uploading folder %s" % directory)
+  else:
+    print("Uploaded %s MB" % round(uploaded / 1000000.0, 2))
+
+
+def publish_split(video_file, geodata, create_time):
+  """Splits the packaged video into parts and publishes each as a sequence.
+
+  Args:
+    video_file: Full path of the packaged video.
+    geodata: The GpsTimeline from extract_geodata.
+    create_time: The GPS timestamp of the first photo.
+  Returns:
+    The ids of the sequences if all parts were published, otherwise None.
+  """
+  # The photos are packaged at one per second.
+  duration = video_probe.duration(video_file) or len(geodata)
+  parts = sequence_split.plan_parts(
+      duration, video_probe.keyframe_times(video_file),
+      sequence_split.max_part_seconds(video_file, duration, flags.split_minutes, flags.split_mb))
+  print "Splitting %s into %d parts" % (video_file, len(parts))
+
+  def publish_part(index, part_file, start, end):
+    upload_url = None
+    if flags.resumable:
+      upload_url = resumable_upload.journaled_upload_url(part_file)
+    if upload_url is None:
+      upload_url = request_upload_url()
+    upload_video(part_file, upload_url)
+    part_start = create_time + int(round(start))
+    part_end = create_time + int(round(end))
+    publish_response = publish_video(upload_url, geodata.clip(part_start, part_end - 1), part_start,
+                                     sequence_split.part_name(flags.metadata_json, index))
+    if publish_response is not None:
+      resumable_upload.clear_journal(part_file)
+    return publish_response
+
+  sequence_ids = sequence_split.publish_parts(
+      video_file, parts, publish_part, flags.split_jobs,
+      keep=lambda part_file: flags.resumable and resumable_upload.load_journal(part_file) is not None)
+  return sequence_split.summarize(parts, sequence_ids)
+
+
 def main():
+  global compression
   print "Configuration:"
   print "Folder: %s" % flags.folder
   print "Auto-blur: %s" % flags.blur
@@ -352,15 +670,63 @@ def main():
     print "You must specify a folder."
     exit(1)
 
+  if flags.stream and flags.resumable:
+    print "--stream can't be combined with --resumable."
+    exit(1)
+
+  if flags.stream and flags.exif:
+    print "--stream can't be combined with --exif."
+    exit(1)
+
+  if flags.stream and (flags.split_minutes or flags.split_mb):
+    print "--split_minutes and --split_mb can't be combined with --stream."
+    exit(1)
+
   if flags.folder is not None:
     print "Extracting GPS data from photos"
-    geodata,create_time = extract_geodata(flags.folder)
+    geodata,create_time,photos = extract_geodata(flags.folder)
     print "GPS extracted"
+    folder = flags.folder
+    if not photos:
+      print "No photos with GPS data in %s." % flags.folder
+      exit(1)
+    if flags.frame_spacing:
+      folder, geodata = select_photos(photos, geodata, create_time)
+    elif len(photos) < len([name for name in os.listdir(flags.folder) if name.endswith(".jpg")]):
+      print "Packaging only the %d photos with GPS data" % len(photos)
+      folder = link_gps_photos(photos)
+    if flags.compress == "auto":
+      compression = choose_compression(folder)
+    if flags.stream:
+      upload_url = request_upload_url()
+      print "Upload target: %s" % upload_url
+      print "Packaging and uploading to Street View"
+      stream_video(folder, upload_url)
+      if folder != flags.folder:
+        shutil.rmtree(folder)
+      print "Publishing..."
+      sequence_id = publish_video(upload_url, geodata, create_time)
+      print "Sequence published! Sequence id: %s" % sequence_id
+      return
     print "Packaging photos into sequence"
-    video_file = convert_video(flags.folder)
+    video_file = convert_video(folder)
+    if folder != flags.folder:
+      shutil.rmtree(folder)
     print "Packaging complete"
+    if flags.split_minutes or flags.split_mb:
+      sequence_id = publish_split(video_file, geodata, create_time)
+      if sequence_id is None:
+        print "Publishing failed for some parts, keeping %s" % video_file
+        exit(1)
+      subprocess.call(["rm", video_file])
+      print "Sequences published! Sequence ids: %s" % sequence_id
+      return
     print "Preparing upload"
-    upload_url = request_upload_url()
+    upload_url = None
+    if flags.resumable:
+      upload_url = resumable_upload.journaled_upload_url(video_file)
+    if upload_url is None:
+      upload_url = request_upload_url()
     print "Upload target: %s" % upload_url
     print "Ready to upload"
     print "Uploading to Street View"
@@ -368,7 +734,11 @@ def main():
     print "\nUpload complete"
     print "Publishing..."
     sequence_id = publish_video(upload_url, geodata, create_time)
+    if sequence_id is None and flags.resumable:
+      print "Publishing failed, keeping %s to retry" % video_file
+      exit(1)
     print "Cleaning up temporary files..."
+    resumable_upload.clear_journal(video_file)
     subprocess.call(["rm", video_file])
     output = "Sequence published! Sequence id: %s" % sequence_id
     print output
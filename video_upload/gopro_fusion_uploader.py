@@ -22,13 +22,22 @@
 #  --video=<stitched video file> \
 #  --front=<front cam unstitched video file> \
 #  --blur (optional) \
+#  --resumable (optional) \
+#  --stream (optional) \
+#  --metadata_json=<file> (optional) \
 #  --key=<your developer key>
+#
+# Pass --metadata_json to keep a copy of the publish request, including the
+# GPS timeline, for debugging.
+#
+# Pass --resumable to upload the video in chunks.  If the upload is interrupted,
+# running the same command again skips the conversion and continues from the last acknowledged byte.
 
 # Requirements:
 # This script requires the following libraries:
 #
 # - google-api-python-client
-# - gpxpy
+# - numpy
 # - pycurl
 #
 # The libraries can be installed by running:
@@ -37,31 +46,86 @@
 #
 # FFmpeg is required, follow https://trac.ffmpeg.org/wiki/CompilationGuide
 #
-# This script also expects gopro2gpx to be in the same folder, which you can get
-# from here and build: https://github.com/stilldavid/gopro-utils
+# GPS data is read directly from the GPMF track of the front video.  Only if
+# that fails, the script falls back to gopro2gpx, which it expects in the same
+# folder.  You can get it from here and build: https://github.com/stilldavid/gopro-utils
+#
+# The video is converted in segments on all CPU cores, which are joined
+# afterwards.  Pass --jobs to limit the number of segments converted at once.
+# This needs ffprobe, which comes with FFmpeg, to read the video duration.
+#
+# Videos that are already H.264 or H.265, e.g. exported that way from Fusion
+# Studio, aren't encoded again: the video stream is only copied into an MP4.
+# CFHD and ProRes videos are encoded to H.264 at 5 frames per second.
+#
+# Converted videos are kept in --cache_dir, so that running the script again
+# for the same video, e.g. after a failed upload or publish, doesn't convert it
+# again.  The least recently used videos are removed when the cache exceeds
+# --cache_size GB.
+#
+# Pass --frame_spacing to keep one frame every so many metres, based on the GPS
+# track, instead of 5 frames per second.  Fewer frames are encoded and uploaded
+# while the camera moves slowly or stands still.  The kept frames keep their
+# timestamps, so the GPS track still matches the video.
+#
+# Pass --trim_stops to cut stops, like traffic lights, that are longer than the
+# given number of seconds out of the video before it is converted.  The GPS
+# track is moved to match the shorter video.  --stop_speed sets the speed in
+# metres per second below which the camera counts as standing still.
+#
+# Pass --split_minutes or --split_mb to publish a long recording as several
+# sequences.  The converted video is cut at keyframes, and at gaps of more
+# than --split_gap seconds in the GPMF track, without encoding it again.  Up
+# to --split_jobs parts are uploaded and published at the same time.  With
+# --metadata_json, the request of each part goes to its own file, e.g.
+# metadata.part000.json.
+#
+# Long recordings are split into chapters by the camera, e.g. GPFR0001.MP4,
+# GF010001.MP4, GF020001.MP4.  Pass the first chapter of --video and --front;
+# the other chapters are found in the same folder.  The chapters of the video
+# are joined without re-encoding into one file, which is converted once, and
+# the GPMF tracks of the front chapters are read in parallel and merged.  Pass
+# --single_chapter to only upload the given files.
+#
+# Pass --stream to upload the video while it is being converted.  No converted
+# copy is written to disk, but --resumable and --exif can't be used with it.
 #
 # DO NOT TRIM THE START OF YOUR VIDEO OR IT WILL GET OUT OF SYNC!!!
 
 
 import argparse
-from calendar import timegm
 import json
 import os
 from subprocess import call
-import time
+import threading
 import urlparse
-from apiclient import discovery
 from apiclient import errors
-import gpxpy
-import gpxpy.gpx
 import httplib2
 from oauth2client import client
 from oauth2client import file as googleapis_file
 from oauth2client import tools
 import pycurl
+import discovery_cache
+import frame_select
+import gopro_chapters
+import gpmf
+import gps_timeline
+import gpx_stream
+import publish_json
+import resumable_upload
+import segmented_encode
+import sequence_split
+import stage_scheduler
+import stop_trim
+import stream_upload
+import token_manager
+import transcode_cache
+import video_probe
 
 API_NAME = "streetviewpublish"
 API_VERSION = "v1"
+# Frame rate of the converted video.
+FRAME_RATE = 5
 SCOPES = "https://www.googleapis.com/auth/streetviewpublish"
 APPLICATION_NAME = "Street View Publish API Python"
 LABEL = "ALPHA_TESTER"
@@ -74,8 +138,29 @@ parser.add_argument("--front", help="Full path to front-facing unstitched video
 parser.add_argument("--blur", default=False, action='store_true', help="Enable auto-blurring")
 parser.add_argument("--exif", default=False, action='store_true', help="Write make/model to metadata")
 parser.add_argument("--key", help="Your developer key")
+parser.add_argument("--resumable", default=False, action='store_true', help="Upload in chunks and resume interrupted uploads")
+parser.add_argument("--stream", default=False, action='store_true', help="Upload the video while it is being converted, without a temporary file")
+parser.add_argument("--metadata_json", help="Also write the publish request to this JSON file, for debugging")
+parser.add_argument("--simplify", type=float, help="Drop GPS points that are within this many metres of the simplified track")
+parser.add_argument("--max_gap", type=float, default=5, help="With --simplify, maximum seconds between GPS points kept")
+parser.add_argument("--jobs", type=int, default=segmented_encode.default_jobs(), help="Number of video segments to convert in parallel")
+parser.add_argument("--frame_spacing", type=float, help="Keep one frame every this many metres instead of 5 frames per second")
+parser.add_argument("--trim_stops", type=float, help="Cut stops longer than this many seconds out of the video")
+parser.add_argument("--stop_speed", type=float, default=stop_trim.MIN_SPEED, help="With --trim_stops, speed in m/s below which the camera stands still")
+parser.add_argument("--cache_dir", default=os.path.expanduser("~/.cache/svpublish/transcodes"), help="Directory to keep converted videos in, for reruns")
+parser.add_argument("--cache_size", type=float, default=50, help="Size budget of --cache_dir in GB, 0 to disable the cache")
+parser.add_argument("--split_minutes", type=float, help="Split the video into sequences of at most this many minutes")
+parser.add_argument("--split_mb", type=float, help="Split the video into sequences of at most this many MB")
+parser.add_argument("--split_gap", type=float, default=sequence_split.MAX_GPS_GAP, help="When splitting, also split where the GPS track has a gap of more than this many seconds")
+parser.add_argument("--split_jobs", type=int, default=sequence_split.MAX_JOBS, help="Number of parts to upload and publish at the same time")
+parser.add_argument("--single_chapter", default=False, action='store_true', help="Only upload the given files, not the other chapters of their recording")
+parser.add_argument("--chunk_size", type=int, default=8, help="Chunk size in MB for resumable uploads")
 flags = parser.parse_args()
 
+api_service = threading.local()
+service_lock = threading.Lock()
+tokens = None
+
 
 def get_discovery_service_url():
   """Returns the discovery service url."""
@@ -87,15 +172,46 @@ def get_discovery_service_url():
   return discovery_service_url
 
 
+def get_service():
+  """Returns the API service object of the calling thread.
+
+  The service is built once per thread from a cached copy of the discovery
+  document, and reused by every step on that thread.  httplib2 connections
+  aren't thread-safe, so the threads that publish parts of a split video
+  each get their own service.
+
+  Returns:
+    The Street View Publish API service object.
+  """
+  service = getattr(api_service, "service", None)
+  if service is None:
+    with service_lock:
+      credentials = get_credentials()
+      http = credentials.authorize(httplib2.Http())
+      service = discovery_cache.build(
+          API_NAME,
+          API_VERSION,
+          developerKey=flags.key,
+          discoveryServiceUrl=get_discovery_service_url(),
+          http=http)
+    api_service.service = service
+  return service
+
+
 def get_credentials():
   """Gets valid user credentials from storage.
 
   If nothing has been stored, or if the stored credentials are invalid,
   the OAuth2 flow is completed to obtain the new credentials.
+  The credentials are only loaded once per run.  After that, a TokenManager
+  keeps the access token valid and the same credentials are returned.
 
   Returns:
       Credentials, the obtained credential.
   """
+  global tokens
+  if tokens is not None:
+    return tokens.get_credentials()
   home_dir = os.path.expanduser("~")
   credential_dir = os.path.join(home_dir, ".credentials")
   if not os.path.exists(credential_dir):
@@ -109,7 +225,9 @@ def get_credentials():
     flow.user_agent = APPLICATION_NAME
     credentials = tools.run_flow(flow, store, flags)
     print("Storing credentials to %s", credential_path)
-  return credentials
+  tokens = token_manager.TokenManager(credential_path, credentials)
+  tokens.start()
+  return tokens.get_credentials()
 
 
 def get_file_size(file_name):
@@ -153,19 +271,29 @@ def request_upload_url():
   Returns:
     Upload URL.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   start_upload_response = service.photoSequence().startUpload(body={}).execute()
   upload_url = str(start_upload_response["uploadUrl"])
   return upload_url
 
 
+def get_upload_url(video_file):
+  """Returns the Upload URL of an unfinished upload of the video, or a new one.
+
+  Args:
+    video_file: The video file to upload.
+
+  Returns:
+    Upload URL.
+  """
+  upload_url = None
+  if flags.resumable:
+    upload_url = resumable_upload.journaled_upload_url(video_file)
+  if upload_url is None:
+    upload_url = request_upload_url()
+  return upload_url
+
+
 def upload_video(video_file, upload_url):
   """Uploads video file to Street View via Upload URL.
 
@@ -178,6 +306,13 @@ def upload_video(video_file, upload_url):
   """
   credentials = get_credentials()
   http = credentials.authorize(httplib2.Http())
+  if flags.resumable:
+    try:
+      resumable_upload.upload(str(video_file), upload_url, credentials,
+                              chunk_size=flags.chunk_size * 1024 * 1024)
+    except resumable_upload.UploadError as error:
+      print "Error uploading file %s: %s" % (video_file, error)
+    return
   file_size = get_file_size(str(video_file))
   try:
     curl = pycurl.Curl()
@@ -195,102 +330,36 @@ def upload_video(video_file, upload_url):
     print "Error uploading file %s", video_file
 
 
-def publish_sequence(upload_url, gpx_file):
+def publish_sequence(upload_url, timeline, capture_time=None, debug_file=None):
   """Publishes sequence live on Street View.
 
   Args:
     upload_url: The upload URL, provided by SV Publish API in step 1.
-    gpx_file: The GPX file, converted from GPMF by extract_gpmf().
+    timeline: The GpsTimeline returned by extract_gpmf().
+    capture_time: Start time of the video in seconds since epoch, defaults
+      to the time of the first point of the timeline.
+    debug_file: File to write the publish request to, defaults to
+      --metadata_json.
 
   Returns:
     ID of published sequence, or None if unsuccessful.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   publish_request = {"uploadReference": {"uploadUrl": upload_url}}
-  debug_output = '{"uploadReference": {"uploadUrl":"'
-  debug_output += upload_url
-  gpx_file = open(gpx_file, "r")
-  gpx = gpxpy.parse(gpx_file)
-
-  raw_gps_timelines = []
-  create_time = 0
-  repeated_timestamps = {}
-  last_timestamp = 0
-  # When GPMF is converted to GPX, subsecond precision is lost.  We should probably use a
-  # different method of parsing GPMF, but for now we can just estimate the subsecond interval
-  # by looking at repeated seconds.
-  for track in gpx.tracks:
-    for segment in track.segments:
-      for point in segment.points:
-        time_epoch = int(time.mktime(time.strptime(str(point.time), '%Y-%m-%d %H:%M:%S')))
-        if time_epoch in repeated_timestamps:
-          repeated_timestamps[time_epoch] = int(repeated_timestamps[time_epoch]) + 1
-        else:
-          repeated_timestamps[time_epoch] = 1
-  
-  counter = 0 
-  for track in gpx.tracks:
-    for segment in track.segments:
-      for point in segment.points:
-        time_epoch = int(time.mktime(time.strptime(str(point.time), '%Y-%m-%d %H:%M:%S')))
-        if create_time == 0:
-          create_time = time_epoch
-        raw_gps_timeline = {}
-        if int(time_epoch) == int(last_timestamp):
-          # If a second has multiple entries, add nanoseconds
-          counter = counter + 1
-          nanos = int((float(counter) / float(repeated_timestamps[time_epoch])) * 1000000000)
-        elif int(time_epoch) < int(last_timestamp):
-          # Ignore entries where timestamps are out of order, as these may be erroneous
-          continue
-        else:
-          counter = 0
-          nanos = 0
-        debug_output += '"rawGpsTimeline":{"latLngPair":{"latitude":'
-        debug_output += str(point.latitude)
-        debug_output += ',"longitude":'
-        debug_output += str(point.longitude)
-        debug_output += '},'
-        raw_gps_timeline["latLngPair"] = {
-            "latitude": point.latitude,
-            "longitude": point.longitude
-        }
-        debug_output += '"altitude":'
-        debug_output += str(point.elevation)
-        debug_output += ','
-        raw_gps_timeline["altitude"] = point.elevation
-        
-        raw_gps_timeline["gpsRecordTimestampUnixEpoch"] = {
-            "seconds": time_epoch,
-            "nanos" : nanos
-        }
-        debug_output += '"gpsRecordTimestampUnixEpoch":{"seconds":"'
-        debug_output += str(time_epoch)
-        debug_output += '","nanos":"'
-        debug_output += str(nanos)
-        debug_output += '"}}, '
-        raw_gps_timelines.append(raw_gps_timeline)
-        last_timestamp = time_epoch
-  publish_request["captureTimeOverride"] = {"seconds": create_time}
+  if capture_time is None:
+    capture_time = timeline.create_time()
+  publish_request["captureTimeOverride"] = {"seconds": int(capture_time)}
   publish_request["gpsSource"] = "PHOTO_SEQUENCE"
   if flags.blur:
     publish_request["blurringOptions"] = {"blurFaces":"true","blurLicensePlates":"true"}
-  debug_output += '"}, "captureTimeOverride":{"seconds":"'
-  debug_output += str(create_time)
-  debug_output += '"},'
-  publish_request.update({"rawGpsTimeline": raw_gps_timelines})
-  debug_output += '}'
-  with open("metadata.json", "w") as json_file:
-    json_file.write(debug_output)
+  if flags.simplify is not None:
+    simplified = timeline.simplify(flags.simplify, flags.max_gap)
+    saved = publish_json.timeline_size(timeline) - publish_json.timeline_size(simplified)
+    print("Kept %d of %d GPS points, %d bytes saved" % (len(simplified), len(timeline), saved))
+    timeline = simplified
   try:
-    publish_response = service.photoSequence().create(body=publish_request, inputType="VIDEO").execute()
+    publish_response = publish_json.create_sequence(
+        service, publish_request, timeline, debug_file or flags.metadata_json)
     return publish_response["name"]
   except errors.HttpError as error:
     photo_response_error = json.loads(error.content)
@@ -298,50 +367,273 @@ def publish_sequence(upload_url, gpx_file):
     return None
 
 
+def read_gpx_points(gpx_file):
+  """Reads the points of a GPX file written by gopro2gpx.
+
+  Args:
+    gpx_file: Full path of the GPX file.
+  Returns:
+    A GpsTimeline.
+  """
+  # When GPMF is converted to GPX, subsecond precision is lost.  We can only
+  # estimate the subsecond interval by looking at repeated seconds.
+  points = gpx_stream.read_points(gpx_file)
+  return gps_timeline.GpsTimeline.from_points(points).spread_subseconds()
+
+
 def extract_gpmf(video_file):
-  """Extracts GPMF data, converts to GPX, and saves a GPX file.
+  """Reads the GPS points from the GPMF track of the video.
+
+  The GPMF track is parsed directly, which keeps the exact time of every
+  point.  If that fails, the track is extracted with ffmpeg and converted to
+  GPX with gopro2gpx instead.
 
   Args:
-    video_file: Full path of the video to upload.
+    video_file: Full path of the unstitched front video.
+  Returns:
+    A GpsTimeline, without points that go back in time.
+  """
+  try:
+    points = gpmf.read_gps_points(video_file)
+    return gps_timeline.GpsTimeline.from_points(points).monotonic()
+  except gpmf.GpmfError as error:
+    print "%s, falling back to gopro2gpx" % error
+  return extract_gopro2gpx(video_file)
+
+
+def extract_gopro2gpx(video_file):
+  """Reads the GPS points of the video with ffmpeg and gopro2gpx.
+
+  Args:
+    video_file: Full path of the unstitched front video.
   Returns:
-    Filename of saved GPX file.
+    A GpsTimeline.
   """
   output_bin = "%s.bin" % video_file
   output_gpx = "%s.gpx" % video_file
   call(["ffmpeg", "-y", "-i", video_file, "-codec", "copy", "-map", "0:3", "-f", "rawvideo", output_bin])
   call(["./gopro2gpx", "-i", output_bin, "-o", output_gpx])
   call(["rm", output_bin])
-  return output_gpx
+  return read_gpx_points(output_gpx)
+
+
+def extract_chapters_gpmf(front_files):
+  """Reads the GPS points of all chapters of the front video.
+
+  The GPMF tracks of the chapters are parsed in parallel processes.  Chapters
+  whose track can't be parsed are read with gopro2gpx.
+
+  Args:
+    front_files: Full paths of the chapters of the unstitched front video.
+  Returns:
+    One GpsTimeline for all chapters, without points that go back in time.
+  """
+  print "Reading GPS from %d chapters" % len(front_files)
+  points = []
+  for front_file, chapter_points in zip(front_files, gopro_chapters.read_gps(front_files, flags.jobs)):
+    if chapter_points is None:
+      print "Falling back to gopro2gpx for %s" % front_file
+      chapter_points = list(extract_gopro2gpx(front_file))
+    points.extend(chapter_points)
+  return gps_timeline.GpsTimeline.from_points(points).monotonic()
 
 
-def convert_video(video_file):
+def get_convert_command(video_file, output_mp4, remux=False, filter_script=None):
+  """Returns the ffmpeg command that converts the video to MP4.
+
+  Args:
+    video_file: Full path of the stitched video.
+    output_mp4: The file the converted video is written to.
+    remux: True to copy the video stream instead of encoding it, for videos
+      that are already H.264 or H.265.
+    filter_script: Optional file with the filter that selects the frames to
+      keep, written by write_frame_filter().
+  Returns:
+    The ffmpeg command line as a list.
+  """
+  if filter_script is not None:
+    return ["ffmpeg", "-i", video_file, "-filter_script:v", filter_script, "-vsync", "vfr",
+            "-c:v", "libx264", "-preset", "slower", "-crf", "18", output_mp4]
+  if remux:
+    return ["ffmpeg", "-i", video_file, "-c", "copy", output_mp4]
+  return ["ffmpeg", "-i", video_file, "-c:v", "libx264", "-preset", "slower", "-crf", "18", "-r", str(FRAME_RATE), output_mp4]
+
+
+def write_frame_filter(timeline, output_mp4):
+  """Writes the filter that keeps one frame every --frame_spacing metres.
+
+  Args:
+    timeline: The GpsTimeline returned by extract_gpmf().
+    output_mp4: The file the converted video is written to.
+  Returns:
+    Tuple of the filter script file and the filter.
+  """
+  frames = frame_select.frame_numbers(timeline, flags.frame_spacing, FRAME_RATE)
+  print "Keeping %d frames, one every %s metres" % (len(frames), flags.frame_spacing)
+  frame_filter = frame_select.select_filter(frames, FRAME_RATE)
+  filter_script = "%s.select" % output_mp4
+  with open(filter_script, "w") as fh:
+    fh.write(frame_filter)
+  return filter_script, frame_filter
+
+
+def stream_video(video_file, upload_url, timeline=None):
+  """Converts the video and uploads it while it is being converted.
+
+  Args:
+    video_file: Full path of the stitched video.
+    upload_url: The upload URL, provided by SV Publish API in step 1.
+    timeline: The GpsTimeline returned by extract_gpmf(), needed for
+      --frame_spacing.
+  Returns:
+    None.
+  """
+  credentials = get_credentials()
+  output_mp4 = "%s.mp4" % video_file
+  if flags.frame_spacing:
+    command = get_convert_command(video_file, output_mp4,
+                                  filter_script=write_frame_filter(timeline, output_mp4)[0])
+  else:
+    command = get_convert_command(video_file, output_mp4, video_probe.can_remux(video_file))
+  response_code, _ = stream_upload.encode_and_upload(
+      command, upload_url, credentials.access_token)
+  if response_code != 200:
+    print "Error uploading file %s" % video_file
+
+
+def find_stops(video_file, timeline):
+  """Returns the parts of the video to keep with --trim_stops.
+
+  Args:
+    video_file: Full path of the stitched video.
+    timeline: The GpsTimeline returned by extract_gpmf().
+  Returns:
+    List of (start, end) tuples in seconds after the start of the video.
+  """
+  return stop_trim.keep_intervals(timeline, flags.trim_stops, flags.stop_speed,
+                                  video_probe.duration(video_file))
+
+
+def report_trim(intervals, video_file, output_mp4):
+  """Prints how much the cut stops saved."""
+  kept = sum(end - start for start, end in intervals)
+  duration = video_probe.duration(video_file) or intervals[-1][1]
+  removed = duration - kept
+  print "Cut out %.0f of %.0f seconds of stops" % (removed, duration)
+  if kept > 0 and os.path.exists(output_mp4):
+    saved = os.path.getsize(output_mp4) / kept * removed
+    print "That is about %.1f MB less to upload" % (saved / 1e6)
+
+
+def convert_video(video_file, timeline=None, intervals=None):
   """Converts video file to MP4, because Street View can't handle CFHD video format.
 
+  H.264 and H.265 videos are only copied into an MP4 container, unless frames
+  are selected with --frame_spacing.
+
   Args:
     video_file: Full path of the video to upload.
+    timeline: The GpsTimeline returned by extract_gpmf(), needed for
+      --frame_spacing.
+    intervals: The parts of the video returned by find_stops(), needed for
+      --trim_stops.
   Returns:
     Filename of converted video file.
+  Raises:
+    ValueError: If --trim_stops leaves nothing of the video.
   """
+  if intervals is not None and not intervals:
+    raise ValueError("The whole video is stops longer than %s seconds, nothing is left to "
+                     "upload.  Raise --trim_stops or lower --stop_speed." % flags.trim_stops)
   output_mp4 = "%s.mp4" % video_file
-  call(["ffmpeg", "-i", video_file, "-c:v", "libx264", "-preset", "slower", "-crf", "18", "-r", "5", output_mp4])
+  if flags.resumable and resumable_upload.load_journal(output_mp4) is not None:
+    print "Resuming unfinished upload of %s" % output_mp4
+    return output_mp4
+  frame_filter = None
+  if intervals is not None:
+    remux = False
+    command = get_convert_command(video_file, output_mp4)
+  elif flags.frame_spacing:
+    filter_script, frame_filter = write_frame_filter(timeline, output_mp4)
+    remux = False
+    command = get_convert_command(video_file, output_mp4, filter_script=filter_script)
+  else:
+    remux = video_probe.can_remux(video_file)
+    command = get_convert_command(video_file, output_mp4, remux)
+  cache = None
+  # Copying the video stream is quick, it isn't worth the cache space.
+  if flags.cache_size > 0 and not remux:
+    cache = transcode_cache.TranscodeCache(flags.cache_dir, int(flags.cache_size * 1e9))
+    # --exif and the kept intervals change the converted file, so they are
+    # part of the key.
+    kept = None
+    if intervals is not None:
+      kept = json.dumps([[float(start), float(end)] for start, end in intervals])
+    key = cache.key(video_file, command + ["exif=%s" % flags.exif, frame_filter,
+                                           "intervals=%s" % kept], output_mp4)
+    if cache.fetch(key, output_mp4):
+      print "Using converted video from cache: %s" % output_mp4
+      return output_mp4
+  # An earlier output may be hard linked to a cache entry.  ffmpeg would
+  # truncate and rewrite it in place, and with it the cache entry.
+  if os.path.exists(output_mp4):
+    os.remove(output_mp4)
+  if intervals is not None:
+    returncode = segmented_encode.encode_ranges(command, intervals, FRAME_RATE, flags.jobs)
+    report_trim(intervals, video_file, output_mp4)
+  elif remux:
+    print "Copying the %s video stream without re-encoding" % video_probe.video_codec(video_file)
+    returncode = call(command)
+  else:
+    duration = video_probe.duration(video_file)
+    # Segments are cut at a fixed frame rate, selected frames aren't.
+    if duration is None or frame_filter is not None:
+      returncode = call(command)
+    else:
+      returncode = segmented_encode.encode(command, duration, FRAME_RATE, flags.jobs)
   if flags.exif:
     call(["exiftool", "-make=GoPro", "-model=Fusion", "-makernotes:all=", "-overwrite_original", output_mp4])
+  if cache is not None and returncode == 0:
+    cache.store(key, output_mp4)
   return output_mp4
 
 
-def publish(video_file, gpx_file):
-  """Uploads a photo and returns the photo id.
+def publish_split(video_file, timeline):
+  """Splits the converted video into parts and publishes each as a sequence.
 
   Args:
-    video_file: Full path of the video to upload.
-    gpx_file: Full path of GPX file to parse.
+    video_file: Full path of the converted video.
+    timeline: The GpsTimeline of the video, starting at the start of the video.
   Returns:
-    The id if the upload was successful, otherwise None.
+    The ids of the sequences if all parts were published, otherwise None.
   """
-  upload_url = request_upload_url()
-  upload_video(video_file, upload_url)
-  publish_response = publish_sequence(upload_url, gpx_file)
-  return publish_response
+  duration = video_probe.duration(video_file)
+  if duration is None:
+    print "Could not read the duration of %s, uploading it in one piece" % video_file
+    duration = 0
+  start_time = timeline.times()[0] if len(timeline) else 0
+  parts = sequence_split.plan_parts(
+      duration, video_probe.keyframe_times(video_file),
+      sequence_split.max_part_seconds(video_file, duration, flags.split_minutes, flags.split_mb),
+      sequence_split.gps_gaps(timeline, start_time, flags.split_gap))
+  print "Splitting %s into %d parts" % (video_file, len(parts))
+
+  def publish_part(index, part_file, start, end):
+    upload_url = get_upload_url(part_file)
+    upload_video(part_file, upload_url)
+    # The first point of the part can be well after its start, e.g. after a
+    # GPS gap, so the start time is passed on explicitly.
+    publish_response = publish_sequence(
+        upload_url, timeline.clip(start_time + start, start_time + end), start_time + start,
+        sequence_split.part_name(flags.metadata_json, index))
+    if publish_response is not None:
+      resumable_upload.clear_journal(part_file)
+    return publish_response
+
+  sequence_ids = sequence_split.publish_parts(
+      video_file, parts, publish_part, flags.split_jobs,
+      keep=lambda part_file: flags.resumable and resumable_upload.load_journal(part_file) is not None)
+  return sequence_split.summarize(parts, sequence_ids)
 
 
 def main():
@@ -358,15 +650,93 @@ def main():
   if flags.video is None:
     print "You must provide a video file."
     exit(1)
+  if flags.stream and flags.resumable:
+    print "--stream can't be combined with --resumable."
+    exit(1)
+  if flags.stream and flags.exif:
+    print "--stream can't be combined with --exif."
+    exit(1)
+  if flags.trim_stops is not None and (flags.stream or flags.frame_spacing):
+    print "--trim_stops can't be combined with --stream or --frame_spacing."
+    exit(1)
+  split = flags.split_minutes or flags.split_mb
+  if split and flags.stream:
+    print "--split_minutes and --split_mb can't be combined with --stream."
+    exit(1)
   if flags.video is not None and flags.front is not None:
-    gpx_file = extract_gpmf(flags.front)
-    video_file = convert_video(flags.video)
-    sequence_id = publish(video_file, gpx_file)
+    # Authenticate up front, so that a sign-in in the browser happens before
+    # the long stages start.  Each stage below builds its own service on its
+    # thread, from the credentials and discovery document loaded here.
+    get_service()
+    # GPMF extraction, conversion and the Upload URL request don't depend on
+    # each other and run concurrently.  The upload starts as soon as the video
+    # is converted and the Upload URL is known.
+    scheduler = stage_scheduler.StageScheduler()
+    front_files = [flags.front]
+    video_files = [flags.video]
+    if not flags.single_chapter:
+      front_files = gopro_chapters.chapters(flags.front)
+      video_files = gopro_chapters.chapters(flags.video)
+    source_video = flags.video
+    # Stages that read the video wait until its chapters are joined.
+    video_after = []
+    if len(video_files) > 1:
+      print "Found %d chapters of %s" % (len(video_files), flags.video)
+      source_video = gopro_chapters.stitched_file(flags.video)
+      scheduler.add("stitch_video", gopro_chapters.stitch, args=[video_files, source_video])
+      video_after = ["stitch_video"]
+    video_file = "%s.mp4" % source_video
+    if len(front_files) > 1:
+      scheduler.add("extract_gpmf", extract_chapters_gpmf, args=[front_files])
+    else:
+      scheduler.add("extract_gpmf", extract_gpmf, args=[flags.front])
+    if not split:
+      # Each part of a split video requests its own Upload URL.
+      scheduler.add("request_upload_url", get_upload_url, args=[video_file])
+    # Selecting frames by distance and cutting stops need the GPS track first.
+    timeline_deps = ["extract_gpmf"] if flags.frame_spacing else []
+    publish_timeline = "extract_gpmf"
+    if flags.trim_stops is not None:
+      scheduler.add("find_stops", find_stops, args=[source_video], deps=["extract_gpmf"],
+                    after=video_after)
+      scheduler.add("trim_timeline", stop_trim.trim_timeline,
+                    deps=["extract_gpmf", "find_stops"])
+      timeline_deps = ["extract_gpmf", "find_stops"]
+      publish_timeline = "trim_timeline"
+    if flags.stream:
+      scheduler.add("stream_video", stream_video, args=[source_video],
+                    deps=["request_upload_url"] + timeline_deps, after=video_after)
+      upload_stage = "stream_video"
+    else:
+      scheduler.add("convert_video", convert_video, args=[source_video],
+                    deps=timeline_deps, after=video_after)
+      if not split:
+        scheduler.add("upload_video", upload_video,
+                      deps=["convert_video", "request_upload_url"])
+        upload_stage = "upload_video"
+    if split:
+      scheduler.add("publish_split", publish_split,
+                    deps=["convert_video", publish_timeline])
+      publish_stage = "publish_split"
+    else:
+      scheduler.add("publish_sequence", publish_sequence,
+                    deps=["request_upload_url", publish_timeline], after=[upload_stage])
+      publish_stage = "publish_sequence"
+    try:
+      results = scheduler.run()
+    except stage_scheduler.StageError as error:
+      scheduler.report()
+      print error
+      exit(1)
+    scheduler.report()
+    sequence_id = results[publish_stage]
+    if sequence_id is None:
+      print "Publishing failed, run the same command again to retry."
+      exit(1)
+    resumable_upload.clear_journal(video_file)
     output = "Sequence uploaded! Sequence id: " + sequence_id
     # Clean up temp files. Comment these out if you want to see them.
     #call(["rm", video_file])
-    #call(["rm", gpx_file])
-    #call(["rm", "metadata.json"])
     print output
 
 
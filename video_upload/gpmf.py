@@ -0,0 +1,254 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Reads GPS data from the GPMF track of GoPro MP4/MOV files.
+#
+# The gpmd track is located through the MP4 sample tables (stsd, stts, stsc,
+# stsz, stco/co64), and only its samples are read from a memory map of the
+# file.  Each sample is a GPMF payload of KLV entries; the GPS5 entries are
+# scaled with SCAL and timed from GPSU.  The points of a payload are spread
+# evenly over the duration of its MP4 sample, so every point gets its own
+# sub-second timestamp.
+#
+# GPMF is documented at https://github.com/gopro/gpmf-parser
+
+
+from calendar import timegm
+import mmap
+import struct
+
+# Containers on the path from the top of the file to the sample tables.
+CONTAINER_BOXES = set([b"moov", b"trak", b"mdia", b"minf", b"stbl"])
+
+# struct format of each GPMF value type.
+GPMF_TYPES = {
+    b"b": "b", b"B": "B", b"c": "c", b"d": "d", b"f": "f", b"F": "4s",
+    b"j": "q", b"J": "Q", b"l": "i", b"L": "I", b"s": "h", b"S": "H"
+}
+
+
+class GpmfError(Exception):
+  """Raised when a file has no readable GPMF track."""
+
+
+def _boxes(data, start, end):
+  """Yields (type, payload start, payload end) for the boxes in a range."""
+  offset = start
+  while offset + 8 <= end:
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header = 8
+    if size == 1:
+      (size,) = struct.unpack_from(">Q", data, offset + 8)
+      header = 16
+    elif size == 0:
+      size = end - offset
+    if size < header:
+      return
+    yield box_type, offset + header, min(offset + size, end)
+    offset += size
+
+
+def _tracks(data, start, end):
+  """Yields a dict of box type to (start, end) for every track in the file."""
+  for box_type, box_start, box_end in _boxes(data, start, end):
+    if box_type == b"trak":
+      track = {}
+      _collect(data, box_start, box_end, track)
+      yield track
+    elif box_type in CONTAINER_BOXES:
+      for track in _tracks(data, box_start, box_end):
+        yield track
+
+
+def _collect(data, start, end, track):
+  for box_type, box_start, box_end in _boxes(data, start, end):
+    track[box_type] = (box_start, box_end)
+    if box_type in CONTAINER_BOXES:
+      _collect(data, box_start, box_end, track)
+
+
+def _sample_format(data, track):
+  start, _ = track[b"stsd"]
+  (count,) = struct.unpack_from(">I", data, start + 4)
+  if count < 1:
+    return None
+  return data[start + 12:start + 16]
+
+
+def _timescale(data, track):
+  start, _ = track[b"mdhd"]
+  version = ord(data[start:start + 1])
+  if version == 1:
+    return struct.unpack_from(">I", data, start + 20)[0]
+  return struct.unpack_from(">I", data, start + 12)[0]
+
+
+def _table(data, track, box_type, fmt):
+  start, _ = track[box_type]
+  (count,) = struct.unpack_from(">I", data, start + 4)
+  width = struct.calcsize(">" + fmt)
+  return [struct.unpack_from(">" + fmt, data, start + 8 + i * width)
+          for i in range(count)]
+
+
+def _samples(data, track):
+  """Returns a list of (offset, size, start time, duration) of a track."""
+  timescale = float(_timescale(data, track))
+
+  start, _ = track[b"stsz"]
+  sample_size, sample_count = struct.unpack_from(">II", data, start + 4)
+  if sample_size:
+    sizes = [sample_size] * sample_count
+  else:
+    sizes = list(struct.unpack_from(">%dI" % sample_count, data, start + 12))
+
+  if b"co64" in track:
+    chunk_offsets = [entry[0] for entry in _table(data, track, b"co64", "Q")]
+  else:
+    chunk_offsets = [entry[0] for entry in _table(data, track, b"stco", "I")]
+
+  # Expand the sample-to-chunk runs into one sample count per chunk.
+  stsc = _table(data, track, b"stsc", "III")
+  per_chunk = []
+  for i, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+    last_chunk = stsc[i + 1][0] if i + 1 < len(stsc) else len(chunk_offsets) + 1
+    per_chunk += [samples_per_chunk] * (last_chunk - first_chunk)
+
+  offsets = []
+  for chunk_offset, count in zip(chunk_offsets, per_chunk):
+    offset = chunk_offset
+    for size in sizes[len(offsets):len(offsets) + count]:
+      offsets.append(offset)
+      offset += size
+
+  durations = []
+  for count, delta in _table(data, track, b"stts", "II"):
+    durations += [delta / timescale] * count
+
+  samples = []
+  time = 0.0
+  for offset, size, duration in zip(offsets, sizes, durations):
+    samples.append((offset, size, time, duration))
+    time += duration
+  return samples
+
+
+def _klv(data, start, end):
+  """Yields (key, type, struct size, repeat, value start) of GPMF entries."""
+  offset = start
+  while offset + 8 <= end:
+    key, value_type, size, repeat = struct.unpack_from(">4scBH", data, offset)
+    length = size * repeat
+    yield key, value_type, size, repeat, offset + 8
+    offset += 8 + ((length + 3) & ~3)
+
+
+def _values(data, value_type, size, repeat, start):
+  fmt = GPMF_TYPES.get(value_type)
+  if fmt is None:
+    return []
+  count = size * repeat // struct.calcsize(">" + fmt)
+  return list(struct.unpack_from(">%d%s" % (count, fmt), data, start))
+
+
+def _gpsu_epoch(value):
+  """Converts a GPSU value ("yymmddhhmmss.sss") to seconds since epoch."""
+  text = value.decode("ascii")
+  seconds = timegm((2000 + int(text[0:2]), int(text[2:4]), int(text[4:6]),
+                    int(text[6:8]), int(text[8:10]), 0, 0, 0, 0))
+  return seconds + float(text[10:])
+
+
+def _payload_points(data, start, end, sample_duration):
+  """Returns the GPS points of one GPMF payload.
+
+  Args:
+    data: The memory map of the file.
+    start: Offset of the payload.
+    end: End offset of the payload.
+    sample_duration: Duration of the MP4 sample holding the payload.
+  Returns:
+    List of (seconds since epoch as float, latitude, longitude, altitude).
+  """
+  points = []
+  for key, value_type, size, repeat, value_start in _klv(data, start, end):
+    if key == b"DEVC" or key == b"STRM":
+      points += _payload_points(data, value_start,
+                                value_start + size * repeat, sample_duration)
+  scale = None
+  gps_time = None
+  fix = None
+  gps5 = None
+  for key, value_type, size, repeat, value_start in _klv(data, start, end):
+    if key == b"SCAL":
+      scale = _values(data, value_type, size, repeat, value_start)
+    elif key == b"GPSU":
+      gps_time = _gpsu_epoch(data[value_start:value_start + 16])
+    elif key == b"GPSF":
+      fix = _values(data, value_type, size, repeat, value_start)[0]
+    elif key == b"GPS5":
+      gps5 = (size, repeat, value_start)
+  if gps5 is None or gps_time is None or fix == 0:
+    return points
+  size, repeat, value_start = gps5
+  if not scale:
+    scale = [1] * 5
+  elif len(scale) == 1:
+    scale = scale * 5
+  values = struct.unpack_from(">%di" % (5 * repeat), data, value_start)
+  for i in range(repeat):
+    lat, lon, alt = values[5 * i:5 * i + 3]
+    points.append((gps_time + i * sample_duration / repeat,
+                   float(lat) / scale[0], float(lon) / scale[1],
+                   float(alt) / scale[2]))
+  return points
+
+
+def read_gps_points(video_file):
+  """Reads all GPS points from the GPMF track of a GoPro video.
+
+  Args:
+    video_file: Full path of the MP4/MOV file.
+  Returns:
+    List of (seconds, nanos, latitude, longitude, altitude) tuples, in
+    recording order.
+  Raises:
+    GpmfError: If the file has no gpmd track or it can't be parsed.
+  """
+  with open(video_file, "rb") as fh:
+    data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      try:
+        tracks = [track for track in _tracks(data, 0, len(data))
+                  if b"stsd" in track and _sample_format(data, track) == b"gpmd"]
+        if not tracks:
+          raise GpmfError("No gpmd track in %s" % video_file)
+        points = []
+        for offset, size, _, duration in _samples(data, tracks[0]):
+          points += _payload_points(data, offset, offset + size, duration)
+      except (struct.error, KeyError, ValueError, IndexError) as error:
+        raise GpmfError("Could not parse GPMF in %s: %s" % (video_file, error))
+    finally:
+      data.close()
+  timeline = []
+  for epoch, lat, lon, alt in points:
+    seconds = int(epoch)
+    nanos = int(round((epoch - seconds) * 1e9))
+    if nanos >= 1000000000:
+      seconds += 1
+      nanos -= 1000000000
+    timeline.append((seconds, nanos, lat, lon, alt))
+  return timeline
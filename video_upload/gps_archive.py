@@ -0,0 +1,125 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# A local archive of GPS points, indexed by time.
+#
+# Points from any number of GPX files and timelapse photos are stored in one
+# SQLite database.  The time of a point in nanoseconds since epoch is the
+# primary key of the table, so the points are stored in time order and the
+# points of any time window are read with a single index range scan, no
+# matter how many years the archive covers.  A point with the same time as a
+# stored point is ignored.
+#
+# Each GPX file is only read once: the archive remembers the size and
+# modification time of the files it has ingested.
+
+
+import os
+import sqlite3
+import gps_timeline
+import gpx_stream
+
+NANOS_PER_SECOND = gps_timeline.NANOS_PER_SECOND
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+  time_ns INTEGER PRIMARY KEY,
+  latitude REAL NOT NULL,
+  longitude REAL NOT NULL,
+  altitude REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+  path TEXT PRIMARY KEY,
+  size INTEGER NOT NULL,
+  mtime REAL NOT NULL
+);
+"""
+
+
+class GpsArchive(object):
+  """Stores GPS points and returns them by time window.
+
+  Usage:
+    archive = GpsArchive(archive_file)
+    archive.add_gpx(gpx_file)
+    timeline = archive.window(start, end)
+    archive.close()
+  """
+
+  def __init__(self, path):
+    """Opens the archive, creating it if it doesn't exist.
+
+    Args:
+      path: Full path of the SQLite database file.
+    """
+    self.db = sqlite3.connect(path)
+    self.db.executescript(SCHEMA)
+
+  def close(self):
+    self.db.close()
+
+  def add_timeline(self, timeline):
+    """Stores the points of a GpsTimeline.
+
+    Returns:
+      Number of points that were not in the archive yet.
+    """
+    rows = ((seconds * NANOS_PER_SECOND + nanos, latitude, longitude, altitude)
+            for seconds, nanos, latitude, longitude, altitude in timeline)
+    with self.db:
+      before = self.db.total_changes
+      self.db.executemany(
+          "INSERT OR IGNORE INTO points VALUES (?, ?, ?, ?)", rows)
+      return self.db.total_changes - before
+
+  def add_gpx(self, gpx_file):
+    """Stores the points of a GPX file, unless it was stored before.
+
+    Args:
+      gpx_file: Full path of the GPX file.
+    Returns:
+      Number of points that were not in the archive yet.
+    """
+    path = os.path.abspath(gpx_file)
+    stat = os.stat(path)
+    row = self.db.execute("SELECT size, mtime FROM sources WHERE path = ?",
+                          (path,)).fetchone()
+    if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+      return 0
+    timeline = gps_timeline.GpsTimeline.from_points(gpx_stream.read_points(path))
+    added = self.add_timeline(timeline)
+    with self.db:
+      self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                      (path, stat.st_size, stat.st_mtime))
+    return added
+
+  def window(self, start, end):
+    """Returns the points with start <= time <= end.
+
+    Args:
+      start: Start time in seconds since epoch, may be fractional.
+      end: End time in seconds since epoch, may be fractional.
+    Returns:
+      A sorted GpsTimeline.
+    """
+    rows = self.db.execute(
+        "SELECT time_ns, latitude, longitude, altitude FROM points "
+        "WHERE time_ns BETWEEN ? AND ? ORDER BY time_ns",
+        (int(start * NANOS_PER_SECOND), int(end * NANOS_PER_SECOND)))
+    return gps_timeline.GpsTimeline.from_points(
+        (time_ns // NANOS_PER_SECOND, time_ns % NANOS_PER_SECOND,
+         latitude, longitude, altitude)
+        for time_ns, latitude, longitude, altitude in rows)
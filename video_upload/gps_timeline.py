@@ -0,0 +1,280 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# A GPS timeline stored as columns.
+#
+# Points are kept in five NumPy arrays (seconds, nanos, latitude, longitude,
+# altitude) instead of one dict per point, which takes 40 bytes per point and
+# lets filters work on whole columns at once.  The rawGpsTimeline dicts of
+# the API are only built by to_api(), right before publishing.
+#
+# A missing altitude is stored as NaN and left out of the API output.
+
+
+import array
+import numpy
+
+NANOS_PER_SECOND = 1000000000
+EARTH_RADIUS = 6371000.0
+
+
+class GpsTimeline(object):
+  """GPS points with timestamps, in columns.
+
+  Usage:
+    timeline = GpsTimeline.from_points(gpx_stream.read_points(gpx_file))
+    timeline = timeline.sort().unique()
+    publish_request["rawGpsTimeline"] = timeline.to_api()
+  """
+
+  def __init__(self, seconds, nanos, latitude, longitude, altitude):
+    """Creates a timeline from columns of equal length.
+
+    Args:
+      seconds: Seconds since epoch of each point.
+      nanos: Nanoseconds of each point, added to seconds.
+      latitude: Latitude of each point in degrees.
+      longitude: Longitude of each point in degrees.
+      altitude: Altitude of each point in metres, NaN if unknown.
+    """
+    self.seconds = numpy.asarray(seconds, dtype=numpy.int64)
+    self.nanos = numpy.asarray(nanos, dtype=numpy.int64)
+    self.latitude = numpy.asarray(latitude, dtype=numpy.float64)
+    self.longitude = numpy.asarray(longitude, dtype=numpy.float64)
+    self.altitude = numpy.asarray(altitude, dtype=numpy.float64)
+
+  @classmethod
+  def from_points(cls, points):
+    """Builds a timeline from an iterable of point tuples.
+
+    The points are consumed one at a time, so a generator is never expanded
+    into a list.
+
+    Args:
+      points: Iterable of (seconds, nanos, latitude, longitude, altitude)
+        tuples.  altitude may be None.
+    Returns:
+      A GpsTimeline.
+    """
+    seconds = array.array("d")
+    nanos = array.array("d")
+    latitude = array.array("d")
+    longitude = array.array("d")
+    altitude = array.array("d")
+    nan = float("nan")
+    for point in points:
+      seconds.append(point[0])
+      nanos.append(point[1])
+      latitude.append(point[2])
+      longitude.append(point[3])
+      altitude.append(nan if point[4] is None else point[4])
+    return cls(*[numpy.frombuffer(column, dtype=numpy.float64) if len(column)
+                 else numpy.zeros(0)
+                 for column in (seconds, nanos, latitude, longitude, altitude)])
+
+  def __len__(self):
+    return len(self.seconds)
+
+  def __iter__(self):
+    """Yields (seconds, nanos, latitude, longitude, altitude) tuples."""
+    for i in range(len(self.seconds)):
+      altitude = self.altitude[i]
+      yield (int(self.seconds[i]), int(self.nanos[i]), float(self.latitude[i]),
+             float(self.longitude[i]), None if numpy.isnan(altitude) else float(altitude))
+
+  def take(self, index):
+    """Returns a timeline of the points selected by an index or mask array."""
+    return GpsTimeline(self.seconds[index], self.nanos[index], self.latitude[index],
+                       self.longitude[index], self.altitude[index])
+
+  def times(self):
+    """Returns the time of every point in seconds since epoch, as floats."""
+    return self.seconds + self.nanos / float(NANOS_PER_SECOND)
+
+  def _nanos_since_epoch(self):
+    return self.seconds * NANOS_PER_SECOND + self.nanos
+
+  def create_time(self):
+    """Returns the seconds since epoch of the first point, or 0 if empty."""
+    return int(self.seconds[0]) if len(self.seconds) else 0
+
+  def time_range(self, start, end):
+    """Returns the points with start <= time <= end.
+
+    Args:
+      start: Start time in seconds since epoch, may be fractional.
+      end: End time in seconds since epoch, may be fractional.
+    """
+    times = self.times()
+    return self.take((times >= start) & (times <= end))
+
+  def clip(self, start, end):
+    """Returns the points with start <= time <= end of a sorted timeline.
+
+    Unlike time_range(), this finds the ends of the range by binary search
+    and returns views of the columns instead of copies.
+
+    Args:
+      start: Start time in seconds since epoch, may be fractional.
+      end: End time in seconds since epoch, may be fractional.
+    """
+    stamps = self._nanos_since_epoch()
+    first = numpy.searchsorted(stamps, int(numpy.floor(start * NANOS_PER_SECOND)), "left")
+    last = numpy.searchsorted(stamps, int(numpy.floor(end * NANOS_PER_SECOND)), "right")
+    return self.take(slice(first, last))
+
+  def sort(self):
+    """Returns the points sorted by time, keeping the order of equal times."""
+    return self.take(numpy.argsort(self._nanos_since_epoch(), kind="mergesort"))
+
+  def unique(self):
+    """Returns the points without repeated timestamps.
+
+    Only the first point of each timestamp is kept.  The timeline must be
+    sorted.
+    """
+    stamps = self._nanos_since_epoch()
+    keep = numpy.ones(len(stamps), dtype=bool)
+    keep[1:] = stamps[1:] != stamps[:-1]
+    return self.take(keep)
+
+  def monotonic(self):
+    """Returns the points without the ones that go back in time.
+
+    A point is dropped if it is earlier than any point before it, as such
+    points are usually erroneous.
+    """
+    stamps = self._nanos_since_epoch()
+    keep = numpy.ones(len(stamps), dtype=bool)
+    if len(stamps) > 1:
+      keep[1:] = stamps[1:] >= numpy.maximum.accumulate(stamps)[:-1]
+    return self.take(keep)
+
+  def spread_subseconds(self):
+    """Returns the points with timestamps spread evenly within each second.
+
+    For sources that only record whole seconds, such as GPX files written by
+    gopro2gpx.  The n points of a second get nanos 0, 1/n, 2/n, ... of a
+    second, where n counts all points of that second in the timeline.
+    Points that go back in time are dropped, as in monotonic().  The
+    existing nanos are ignored.
+    """
+    seconds = self.seconds
+    if not len(seconds):
+      return self
+    _, inverse, counts = numpy.unique(seconds, return_inverse=True,
+                                      return_counts=True)
+    keep = numpy.ones(len(seconds), dtype=bool)
+    keep[1:] = seconds[1:] >= numpy.maximum.accumulate(seconds)[:-1]
+    keep &= seconds >= 0
+    timeline = self.take(keep)
+    kept = timeline.seconds
+    # Index of each point within its run of equal seconds.
+    index = numpy.arange(len(kept))
+    run_start = numpy.zeros(len(kept), dtype=numpy.int64)
+    run_start[1:] = numpy.where(kept[1:] != kept[:-1], index[1:], 0)
+    position = index - numpy.maximum.accumulate(run_start)
+    timeline.nanos = (position / counts[inverse][keep].astype(numpy.float64) *
+                      NANOS_PER_SECOND).astype(numpy.int64)
+    return timeline
+
+  def metres(self):
+    """Returns x and y of every point in metres, in a local flat projection."""
+    if not len(self.latitude):
+      return numpy.zeros(0), numpy.zeros(0)
+    scale = numpy.radians(1.0) * EARTH_RADIUS
+    mean_latitude = numpy.radians(numpy.mean(self.latitude))
+    return (self.longitude * scale * numpy.cos(mean_latitude),
+            self.latitude * scale)
+
+  def simplify(self, max_error, max_gap=None):
+    """Returns the points needed to follow the track within max_error.
+
+    Uses Douglas-Peucker: the first and last points are kept, and a segment
+    is split at its farthest point as long as that point is more than
+    max_error away from it.  The timeline must be sorted.
+
+    Args:
+      max_error: Maximum distance in metres of a dropped point to the line
+        between the points kept around it.
+      max_gap: If set, points are also kept so that no two consecutive points
+        are more than max_gap seconds apart, where the track allows it.
+    Returns:
+      A GpsTimeline.
+    """
+    count = len(self.seconds)
+    if count < 3:
+      return self
+    x, y = self.metres()
+    keep = numpy.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, count - 1)]
+    while segments:
+      first, last = segments.pop()
+      if last - first < 2:
+        continue
+      dx = x[last] - x[first]
+      dy = y[last] - y[first]
+      px = x[first + 1:last] - x[first]
+      py = y[first + 1:last] - y[first]
+      length = dx * dx + dy * dy
+      if length > 0:
+        # Distance to the segment, not the infinite line through it.
+        t = numpy.clip((px * dx + py * dy) / length, 0, 1)
+        distance = numpy.hypot(px - t * dx, py - t * dy)
+      else:
+        distance = numpy.hypot(px, py)
+      farthest = int(numpy.argmax(distance))
+      if distance[farthest] > max_error:
+        split = first + 1 + farthest
+        keep[split] = True
+        segments.append((first, split))
+        segments.append((split, last))
+    if max_gap is not None:
+      times = self.times()
+      kept = numpy.flatnonzero(keep)
+      for first, last in zip(kept[:-1], kept[1:]):
+        # Keep the last point within max_gap of the previous kept point.
+        while times[last] - times[first] > max_gap:
+          next_point = numpy.searchsorted(times, times[first] + max_gap, "right") - 1
+          next_point = max(next_point, first + 1)
+          if next_point >= last:
+            break
+          keep[next_point] = True
+          first = next_point
+    return self.take(keep)
+
+  def to_api(self):
+    """Returns the points as a list of rawGpsTimeline dicts."""
+    return [api_point(point) for point in self]
+
+
+def api_point(point):
+  """Converts one point tuple to the rawGpsTimeline dict of the API."""
+  seconds, nanos, latitude, longitude, altitude = point
+  raw_gps_timeline = {
+      "latLngPair": {
+          "latitude": latitude,
+          "longitude": longitude
+      },
+      "gpsRecordTimestampUnixEpoch": {
+          "seconds": seconds,
+          "nanos": nanos
+      }
+  }
+  if altitude is not None:
+    raw_gps_timeline["altitude"] = altitude
+  return raw_gps_timeline
@@ -0,0 +1,104 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Tests for gps_timeline.
+#
+# GpsTimeline.spread_subseconds() replaced a loop over the points of a GPX
+# track in gopro_fusion_uploader.py.  The loop is kept here and both are run
+# on random tracks, which must give the same points.
+#
+# $ python gps_timeline_test.py
+
+
+import random
+import unittest
+import gps_timeline
+
+START = 1530448200
+
+
+def spread_subseconds_loop(points):
+  """The per-point loop spread_subseconds() replaced."""
+  repeated = {}
+  for point in points:
+    repeated[point[0]] = repeated.get(point[0], 0) + 1
+  spread = []
+  last = 0
+  counter = 0
+  for seconds, _, latitude, longitude, altitude in points:
+    if int(seconds) == int(last):
+      counter += 1
+      nanos = int((float(counter) / float(repeated[seconds])) * 1000000000)
+    elif int(seconds) < int(last):
+      continue
+    else:
+      counter = 0
+      nanos = 0
+    spread.append((seconds, nanos, latitude, longitude, altitude))
+    last = seconds
+  return spread
+
+
+def random_track(rng, length):
+  """Returns points with repeated and out-of-order seconds."""
+  points = []
+  seconds = START
+  for _ in range(length):
+    step = rng.random()
+    if step < 0.1:
+      point_seconds = seconds - rng.randint(1, 5)
+    elif step < 0.6:
+      point_seconds = seconds
+    else:
+      seconds += rng.randint(1, 2)
+      point_seconds = seconds
+    points.append((point_seconds, 0, rng.uniform(-90, 90), rng.uniform(-180, 180),
+                   rng.choice([None, rng.uniform(0, 3000)])))
+  return points
+
+
+class SpreadSubsecondsTest(unittest.TestCase):
+
+  def assertSameAsLoop(self, points):
+    timeline = gps_timeline.GpsTimeline.from_points(points)
+    self.assertEqual(spread_subseconds_loop(points), list(timeline.spread_subseconds()))
+
+  def test_random_tracks(self):
+    rng = random.Random(1)
+    for _ in range(300):
+      self.assertSameAsLoop(random_track(rng, rng.randint(1, 400)))
+
+  def test_one_second(self):
+    self.assertSameAsLoop([(START, 0, 1.0, 2.0, 3.0)] * 7)
+
+  def test_starts_out_of_order(self):
+    self.assertSameAsLoop([(START + 2, 0, 1.0, 2.0, None),
+                           (START, 0, 1.0, 2.0, None),
+                           (START + 2, 0, 1.0, 2.0, None),
+                           (START + 3, 0, 1.0, 2.0, None)])
+
+  def test_existing_nanos_ignored(self):
+    points = [(START, 500, 1.0, 2.0, 3.0), (START, 900, 1.0, 2.0, 3.0)]
+    spread = list(gps_timeline.GpsTimeline.from_points(points).spread_subseconds())
+    self.assertEqual([0, 500000000], [point[1] for point in spread])
+
+  def test_empty(self):
+    timeline = gps_timeline.GpsTimeline.from_points([])
+    self.assertEqual([], list(timeline.spread_subseconds()))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,111 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Reads the track points of a GPX file incrementally.
+#
+# The file is parsed with iterparse and every <trkpt> element is cleared as
+# soon as it has been read, so memory use doesn't grow with the length of the
+# track.  Timestamps are parsed by position instead of with strptime; GPX
+# times are always ISO 8601 ("2018-07-01T12:30:00.123Z", optionally with a
+# UTC offset instead of "Z").
+
+
+try:
+  import xml.etree.cElementTree as ElementTree
+except ImportError:
+  import xml.etree.ElementTree as ElementTree
+
+
+def _local_name(tag):
+  return tag.rsplit("}", 1)[-1]
+
+
+def _days_from_civil(year, month, day):
+  """Returns the number of days between 1970-01-01 and a date."""
+  if month <= 2:
+    year -= 1
+  era = year // 400
+  year_of_era = year - era * 400
+  day_of_year = (153 * (month + (9 if month <= 2 else -3)) + 2) // 5 + day - 1
+  day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+  return era * 146097 + day_of_era - 719468
+
+
+def parse_time(text):
+  """Parses an ISO 8601 timestamp of a GPX file.
+
+  Args:
+    text: The timestamp, e.g. "2018-07-01T12:30:00.123Z".
+  Returns:
+    Tuple of seconds since epoch and nanoseconds.
+  Raises:
+    ValueError: If the timestamp is not in the expected format.
+  """
+  text = text.strip()
+  if len(text) < 19 or text[4] != "-" or text[7] != "-" or text[13] != ":":
+    raise ValueError("Invalid GPX time: %s" % text)
+  seconds = (_days_from_civil(int(text[0:4]), int(text[5:7]), int(text[8:10])) * 86400 +
+             int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19]))
+  nanos = 0
+  end = 19
+  if end < len(text) and text[end] == ".":
+    end += 1
+    while end < len(text) and text[end].isdigit():
+      end += 1
+    nanos = int((text[20:end] + "000000000")[:9])
+  zone = text[end:]
+  if zone and zone != "Z":
+    if len(zone) != 6 or zone[0] not in "+-" or zone[3] != ":":
+      raise ValueError("Invalid GPX time: %s" % text)
+    offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+    seconds += -offset if zone[0] == "+" else offset
+  return seconds, nanos
+
+
+def read_points(gpx_file):
+  """Yields the track points of a GPX file, in file order.
+
+  Points without a timestamp are skipped.
+
+  Args:
+    gpx_file: Full path of the GPX file.
+  Yields:
+    Tuples of (seconds, nanos, latitude, longitude, elevation).  elevation
+    is None if the point has none.
+  """
+  parents = []
+  for event, element in ElementTree.iterparse(gpx_file, events=("start", "end")):
+    if event == "start":
+      parents.append(element)
+      continue
+    parents.pop()
+    if _local_name(element.tag) != "trkpt":
+      continue
+    time_text = None
+    elevation = None
+    for child in element:
+      name = _local_name(child.tag)
+      if name == "time":
+        time_text = child.text
+      elif name == "ele" and child.text:
+        elevation = float(child.text)
+    # Drop the point from the tree, so it never holds more than one point.
+    if parents:
+      parents[-1].remove(element)
+    if time_text:
+      seconds, nanos = parse_time(time_text)
+      yield (seconds, nanos, float(element.get("lat")), float(element.get("lon")),
+             elevation)
@@ -0,0 +1,124 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Uploads many videos concurrently from a single process.
+#
+# All transfers are driven by one pycurl CurlMulti loop, so N uploads share a
+# process, its credentials and its API service instead of running N copies of
+# an uploader.  At most max_concurrent transfers are active at any time; the
+# next file starts as soon as one finishes.
+
+
+import urlparse
+import pycurl
+
+MAX_CONCURRENT = 4
+SELECT_TIMEOUT = 1.0
+
+
+def _get_headers(access_token, file_size, url):
+  headers = {
+      "Content-Type": "video/mp4",
+      "Authorization": "Bearer " + access_token,
+      "X-Goog-Upload-Protocol": "raw",
+      "X-Goog-Upload-Content-Length": str(file_size),
+      "Host": urlparse.urlparse(url)[1]
+  }
+  return ["%s: %s" % (k, v) for (k, v) in headers.items()]
+
+
+def _make_curl(video_file, upload_url, credentials, progress):
+  fh = open(video_file, "rb")
+  fh.seek(0, 2)
+  file_size = fh.tell()
+  fh.seek(0)
+  curl = pycurl.Curl()
+  curl.setopt(pycurl.URL, upload_url)
+  curl.setopt(pycurl.CUSTOMREQUEST, "POST")
+  curl.setopt(pycurl.HTTPHEADER,
+              _get_headers(credentials.access_token, file_size, upload_url))
+  curl.setopt(pycurl.INFILESIZE, file_size)
+  curl.setopt(pycurl.READFUNCTION, fh.read)
+  curl.setopt(pycurl.WRITEFUNCTION, lambda data: None)
+  curl.setopt(pycurl.UPLOAD, 1)
+  if progress is not None:
+    curl.setopt(pycurl.NOPROGRESS, False)
+    curl.setopt(pycurl.XFERINFOFUNCTION,
+                lambda dt, d, ut, u: progress(video_file, dt, d, ut, u))
+  return curl, fh
+
+
+def upload_videos(jobs, credentials, max_concurrent=MAX_CONCURRENT,
+                  progress=None):
+  """Uploads videos concurrently on a single CurlMulti.
+
+  Args:
+    jobs: List of (video file, upload URL) tuples.
+    credentials: Credentials with a valid access_token.
+    max_concurrent: Maximum number of transfers running at the same time.
+    progress: Optional callback in the style of xfer_progress, with the video
+      file as an additional first argument.
+  Returns:
+    Dict of video file to a result dict with "response_code" (None if the
+    transfer failed) and "error" (None if the transfer succeeded).
+  """
+  multi = pycurl.CurlMulti()
+  pending = list(jobs)
+  active = {}
+  results = {}
+
+  def finish(curl, error):
+    video_file, fh = active.pop(curl)
+    response_code = None
+    if error is None:
+      response_code = curl.getinfo(pycurl.RESPONSE_CODE)
+      if response_code != 200:
+        error = "Response code %s" % response_code
+    results[video_file] = {"response_code": response_code, "error": error}
+    multi.remove_handle(curl)
+    curl.close()
+    fh.close()
+
+  try:
+    while pending or active:
+      while pending and len(active) < max_concurrent:
+        video_file, upload_url = pending.pop(0)
+        try:
+          curl, fh = _make_curl(video_file, upload_url, credentials, progress)
+        except IOError as error:
+          results[video_file] = {"response_code": None, "error": str(error)}
+          continue
+        active[curl] = (video_file, fh)
+        multi.add_handle(curl)
+      while True:
+        ret, _ = multi.perform()
+        if ret != pycurl.E_CALL_MULTI_PERFORM:
+          break
+      while True:
+        queued, succeeded, failed = multi.info_read()
+        for curl in succeeded:
+          finish(curl, None)
+        for curl, _, message in failed:
+          finish(curl, message)
+        if queued == 0:
+          break
+      if active:
+        multi.select(SELECT_TIMEOUT)
+  finally:
+    for curl in list(active):
+      finish(curl, "Aborted")
+    multi.close()
+  return results
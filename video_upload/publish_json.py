@@ -0,0 +1,102 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Writes the photoSequence.create request body point by point.
+#
+# The API client would first turn the GPS timeline into a list of dicts and
+# then serialize all of it.  Here the JSON text is produced one point at a
+# time straight from a GpsTimeline.  The text is written to the optional
+# debug file as it is produced, and appended to one growing buffer that
+# becomes the request body, so the timeline is only held in memory once as
+# text, without a string object per point.
+
+
+import json
+try:
+  from cStringIO import StringIO
+except ImportError:
+  from io import StringIO
+import gps_timeline
+
+
+def iter_request_json(request, timeline):
+  """Yields the JSON text of a publish request in pieces.
+
+  Args:
+    request: The publish request without rawGpsTimeline, as a dict.
+    timeline: The GpsTimeline to send as rawGpsTimeline.
+  Yields:
+    Strings that together form the JSON object.
+  """
+  head = json.dumps(request, sort_keys=True)
+  yield head[:-1]
+  if request:
+    yield ", "
+  yield '"rawGpsTimeline": [\n'
+  separator = ""
+  for point in timeline:
+    yield separator + json.dumps(gps_timeline.api_point(point), sort_keys=True)
+    separator = ",\n"
+  yield "\n]}\n"
+
+
+def timeline_size(timeline):
+  """Returns the number of bytes a timeline takes in the request body."""
+  return sum(len(piece) for piece in iter_request_json({}, timeline))
+
+
+def request_body(request, timeline, debug_file=None):
+  """Returns the JSON text of a publish request.
+
+  Args:
+    request: The publish request without rawGpsTimeline, as a dict.
+    timeline: The GpsTimeline to send as rawGpsTimeline.
+    debug_file: Optional path to write a copy of the request to.
+  Returns:
+    The request body as a string.
+  """
+  body = StringIO()
+  out = open(debug_file, "w") if debug_file else None
+  try:
+    for piece in iter_request_json(request, timeline):
+      body.write(piece)
+      if out is not None:
+        out.write(piece)
+    return body.getvalue()
+  finally:
+    body.close()
+    if out is not None:
+      out.close()
+
+
+def create_sequence(service, request, timeline, debug_file=None):
+  """Calls photoSequence.create with a streamed request body.
+
+  Args:
+    service: The Street View Publish API service object.
+    request: The publish request without rawGpsTimeline, as a dict.
+    timeline: The GpsTimeline to send as rawGpsTimeline.
+    debug_file: Optional path to write a copy of the request to.
+  Returns:
+    The response of the API call.
+  Raises:
+    errors.HttpError: If the API call failed.
+  """
+  http_request = service.photoSequence().create(body={}, inputType="VIDEO")
+  http_request.body = request_body(request, timeline, debug_file)
+  http_request.body_size = len(http_request.body)
+  http_request.headers["content-length"] = str(http_request.body_size)
+  return http_request.execute()
@@ -0,0 +1,261 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Resumable, chunked uploads of video bytes to an Upload URL.
+#
+# Instead of sending the whole file in a single raw POST, an upload session is
+# started on the Upload URL and the file is sent in fixed-size chunks.  After
+# every acknowledged chunk the Upload URL, the session URL and the committed
+# offset are written to a journal next to the video (<video>.upload.json).
+# If the connection drops, the server is asked how many bytes it has received
+# and the upload continues from there.  A restarted run finds the journal,
+# reuses the same Upload URL and continues from the last acknowledged byte.
+#
+# The journal is removed once the sequence has been published.
+
+
+import json
+import os
+import time
+import pycurl
+
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_RETRIES = 5
+RETRY_DELAY = 2
+JOURNAL_SUFFIX = ".upload.json"
+
+
+class UploadError(Exception):
+  """Raised when an upload can't be completed."""
+
+
+def journal_path(video_file):
+  """Returns the path of the upload journal for a video."""
+  return "%s%s" % (video_file, JOURNAL_SUFFIX)
+
+
+def load_journal(video_file):
+  """Returns the upload journal of a video, or None.
+
+  A journal is only returned if it was written for the same file, i.e. the
+  size and modification time of the video haven't changed since.
+  """
+  try:
+    with open(journal_path(video_file), "r") as fh:
+      journal = json.load(fh)
+    stat = os.stat(video_file)
+  except (IOError, OSError, ValueError):
+    return None
+  if journal.get("file_size") != stat.st_size or journal.get("mtime") != int(stat.st_mtime):
+    return None
+  return journal
+
+
+def save_journal(video_file, journal):
+  """Atomically writes the upload journal of a video."""
+  path = journal_path(video_file)
+  temp_path = path + ".tmp"
+  with open(temp_path, "w") as fh:
+    json.dump(journal, fh)
+  os.rename(temp_path, path)
+
+
+def clear_journal(video_file):
+  """Removes the upload journal of a video, if there is one."""
+  if os.path.exists(journal_path(video_file)):
+    os.remove(journal_path(video_file))
+
+
+def journaled_upload_url(video_file):
+  """Returns the Upload URL of an unfinished upload of this video, or None."""
+  journal = load_journal(video_file)
+  if journal is None or "upload_url" not in journal:
+    return None
+  return str(journal["upload_url"])
+
+
+def _request(url, headers, body=None, offset=0, length=0, progress=None):
+  """Sends one POST request.
+
+  Args:
+    url: The URL to post to.
+    headers: Dict of request headers.
+    body: Open file object to read the request body from, or None.
+    offset: Position in body of the first byte to send.
+    length: Number of bytes of body to send.
+    progress: Optional pycurl XFERINFOFUNCTION for this request.
+  Returns:
+    Tuple of the response code and a dict of the response headers, with
+    lower-case names.
+  """
+  response_headers = {}
+
+  def header_function(line):
+    line = line.decode("iso-8859-1") if isinstance(line, bytes) else line
+    if ":" in line:
+      name, value = line.split(":", 1)
+      response_headers[name.strip().lower()] = value.strip()
+
+  curl = pycurl.Curl()
+  try:
+    curl.setopt(pycurl.URL, url)
+    curl.setopt(pycurl.CUSTOMREQUEST, "POST")
+    curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (k, v) for (k, v) in headers.items()])
+    curl.setopt(pycurl.HEADERFUNCTION, header_function)
+    curl.setopt(pycurl.WRITEFUNCTION, lambda data: None)
+    curl.setopt(pycurl.UPLOAD, 1)
+    if body is not None:
+      body.seek(offset)
+      remaining = [length]
+
+      def read_function(size):
+        data = body.read(min(size, remaining[0]))
+        remaining[0] -= len(data)
+        return data
+
+      curl.setopt(pycurl.READFUNCTION, read_function)
+      curl.setopt(pycurl.INFILESIZE, length)
+      if progress is not None:
+        curl.setopt(pycurl.NOPROGRESS, False)
+        curl.setopt(pycurl.XFERINFOFUNCTION, progress)
+    else:
+      curl.setopt(pycurl.READFUNCTION, lambda size: b"")
+      curl.setopt(pycurl.INFILESIZE, 0)
+    curl.perform()
+    return curl.getinfo(pycurl.RESPONSE_CODE), response_headers
+  finally:
+    curl.close()
+
+
+def _headers(credentials, command, **extra):
+  headers = {
+      "Authorization": "Bearer " + credentials.access_token,
+      "X-Goog-Upload-Protocol": "resumable",
+      "X-Goog-Upload-Command": command
+  }
+  headers.update(extra)
+  return headers
+
+
+def start_session(upload_url, credentials, file_size):
+  """Starts a resumable upload session on an Upload URL.
+
+  Args:
+    upload_url: The Upload URL returned by startUpload.
+    credentials: Credentials with a valid access_token.
+    file_size: Total number of bytes that will be uploaded.
+  Returns:
+    Tuple of the session URL and the chunk granularity required by the
+    server, in bytes.
+  """
+  code, headers = _request(upload_url, _headers(
+      credentials, "start",
+      **{"X-Goog-Upload-Header-Content-Length": str(file_size),
+         "X-Goog-Upload-Header-Content-Type": "video/mp4"}))
+  if code != 200:
+    raise UploadError("Could not start upload session, response code %s" % code)
+  session_url = headers.get("x-goog-upload-url", upload_url)
+  granularity = int(headers.get("x-goog-upload-chunk-granularity", 1))
+  return session_url, granularity
+
+
+def query_offset(session_url, credentials):
+  """Asks the server how much of the upload it has received.
+
+  Returns:
+    Tuple of the upload status ("active" or "final") and the number of bytes
+    the server has committed.
+  """
+  code, headers = _request(session_url, _headers(credentials, "query"))
+  if code != 200:
+    raise UploadError("Could not query upload status, response code %s" % code)
+  return (headers.get("x-goog-upload-status", "active"),
+          int(headers.get("x-goog-upload-size-received", 0)))
+
+
+def upload(video_file, upload_url, credentials, chunk_size=CHUNK_SIZE,
+           progress=None):
+  """Uploads a video in chunks, resuming a journaled upload if possible.
+
+  Args:
+    video_file: Full path of the video to upload.
+    upload_url: The Upload URL returned by startUpload.
+    credentials: Credentials with a valid access_token.
+    chunk_size: Number of bytes to send per request.  Rounded up to the
+      granularity requested by the server.
+    progress: Optional callback in the style of xfer_progress.
+  Raises:
+    UploadError: If the upload failed more than MAX_RETRIES times in a row.
+  """
+  stat = os.stat(video_file)
+  file_size = stat.st_size
+  journal = load_journal(video_file)
+  if journal is None or journal.get("upload_url") != upload_url:
+    journal = {
+        "upload_url": upload_url,
+        "file_size": file_size,
+        "mtime": int(stat.st_mtime),
+        "offset": 0
+    }
+  if journal.get("complete"):
+    return
+
+  chunk_progress = None
+  if progress is not None:
+    # Report progress over the whole file rather than the current chunk.
+    chunk_progress = lambda dt, d, ut, u: progress(0, 0, file_size, offset + u)
+
+  offset = journal["offset"]
+  retries = 0
+  with open(video_file, "rb") as fh:
+    while True:
+      try:
+        if "session_url" not in journal:
+          journal["session_url"], journal["granularity"] = start_session(
+              upload_url, credentials, file_size)
+          save_journal(video_file, journal)
+        else:
+          status, journal["offset"] = query_offset(journal["session_url"], credentials)
+          if status == "final":
+            break
+        granularity = journal["granularity"]
+        size = -(-chunk_size // granularity) * granularity
+        while True:
+          offset = journal["offset"]
+          length = min(size, file_size - offset)
+          last = offset + length >= file_size
+          command = "upload, finalize" if last else "upload"
+          code, _ = _request(
+              journal["session_url"],
+              _headers(credentials, command,
+                       **{"X-Goog-Upload-Offset": str(offset)}),
+              fh, offset, length, chunk_progress)
+          if code != 200:
+            raise UploadError("Chunk at offset %d failed, response code %s" % (offset, code))
+          journal["offset"] = offset + length
+          save_journal(video_file, journal)
+          retries = 0
+          if last:
+            break
+        break
+      except (pycurl.error, UploadError) as error:
+        retries += 1
+        if retries > MAX_RETRIES:
+          raise UploadError("Giving up on %s after %d retries: %s" % (video_file, MAX_RETRIES, error))
+        print("Upload interrupted (%s), resuming in %d seconds" % (error, RETRY_DELAY * retries))
+        time.sleep(RETRY_DELAY * retries)
+  journal["complete"] = True
+  save_journal(video_file, journal)
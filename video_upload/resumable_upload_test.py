@@ -0,0 +1,185 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Tests for resumable_upload.
+#
+# The uploads go to a stand-in for the upload server on localhost, which
+# speaks the start, query and upload commands of the resumable protocol and
+# can fail chosen chunks.
+#
+# $ python resumable_upload_test.py
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+import resumable_upload
+
+GRANULARITY = 4096
+
+
+class Credentials(object):
+  access_token = "token"
+
+
+class UploadServer(HTTPServer):
+  """Keeps the bytes of one upload session and the requests it got."""
+
+  def __init__(self):
+    HTTPServer.__init__(self, ("127.0.0.1", 0), UploadHandler)
+    self.received = b""
+    self.commands = []
+    self.finalized = False
+    # Numbers of the upload requests, counted from 1, that fail with a 503.
+    self.fail_uploads = set()
+    self.uploads = 0
+
+  def url(self, path):
+    return "http://127.0.0.1:%d%s" % (self.server_port, path)
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+  def reply(self, code, headers=()):
+    self.send_response(code)
+    for name, value in headers:
+      self.send_header(name, value)
+    self.send_header("Content-Length", "0")
+    self.send_header("Connection", "close")
+    self.end_headers()
+    self.close_connection = True
+
+  def do_POST(self):
+    server = self.server
+    if (self.headers.get("Expect", "").lower() == "100-continue" and
+        not hasattr(self, "handle_expect_100")):
+      self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+    command = self.headers.get("X-Goog-Upload-Command")
+    server.commands.append((command, self.headers.get("X-Goog-Upload-Offset")))
+    if command == "start":
+      self.reply(200, [("X-Goog-Upload-URL", server.url("/session")),
+                       ("X-Goog-Upload-Chunk-Granularity", str(GRANULARITY))])
+    elif command == "query":
+      self.reply(200, [("X-Goog-Upload-Status", "final" if server.finalized else "active"),
+                       ("X-Goog-Upload-Size-Received", str(len(server.received)))])
+    else:
+      server.uploads += 1
+      if server.uploads in server.fail_uploads:
+        self.reply(503)
+      elif int(self.headers.get("X-Goog-Upload-Offset")) != len(server.received):
+        self.reply(400)
+      else:
+        server.received += body
+        server.finalized = "finalize" in command
+        self.reply(200)
+
+
+class ResumableUploadTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = UploadServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+    self.directory = tempfile.mkdtemp(prefix="resumable_upload_test")
+    self.video = os.path.join(self.directory, "video.mp4")
+    self.data = os.urandom(10 * GRANULARITY + 123)
+    with open(self.video, "wb") as fh:
+      fh.write(self.data)
+    self.retry_delay = resumable_upload.RETRY_DELAY
+    resumable_upload.RETRY_DELAY = 0
+
+  def tearDown(self):
+    resumable_upload.RETRY_DELAY = self.retry_delay
+    self.server.shutdown()
+    self.thread.join()
+    self.server.server_close()
+    shutil.rmtree(self.directory)
+
+  def upload(self, chunk_size=3 * GRANULARITY):
+    resumable_upload.upload(self.video, self.server.url("/upload"), Credentials(), chunk_size)
+
+  def upload_offsets(self):
+    return [int(offset) for command, offset in self.server.commands
+            if command.startswith("upload")]
+
+  def test_upload_in_chunks(self):
+    # The chunk size is rounded up to the granularity.
+    self.upload(chunk_size=2 * GRANULARITY + 1)
+    self.assertEqual(self.data, self.server.received)
+    self.assertTrue(self.server.finalized)
+    self.assertEqual([0, 3 * GRANULARITY, 6 * GRANULARITY, 9 * GRANULARITY],
+                     self.upload_offsets())
+    self.assertEqual("upload, finalize", self.server.commands[-1][0])
+
+  def test_resumes_after_server_error(self):
+    self.server.fail_uploads = set([2])
+    self.upload()
+    self.assertEqual(self.data, self.server.received)
+    commands = [command for command, _ in self.server.commands]
+    self.assertEqual(["start", "upload", "upload", "query"], commands[:4])
+    self.assertEqual([0, 3 * GRANULARITY, 3 * GRANULARITY], self.upload_offsets()[:3])
+
+  def test_restart_queries_offset(self):
+    self.server.fail_uploads = set([3])
+    max_retries = resumable_upload.MAX_RETRIES
+    resumable_upload.MAX_RETRIES = 0
+    try:
+      self.assertRaises(resumable_upload.UploadError, self.upload)
+    finally:
+      resumable_upload.MAX_RETRIES = max_retries
+    journal = resumable_upload.load_journal(self.video)
+    self.assertEqual(6 * GRANULARITY, journal["offset"])
+    self.assertEqual(self.server.url("/upload"),
+                     resumable_upload.journaled_upload_url(self.video))
+    # The server lost the last chunk it acknowledged, the query tells.
+    self.server.received = self.server.received[:3 * GRANULARITY]
+    del self.server.commands[:]
+    self.upload()
+    self.assertEqual(self.data, self.server.received)
+    self.assertEqual("query", self.server.commands[0][0])
+    self.assertEqual(3 * GRANULARITY, self.upload_offsets()[0])
+
+  def test_journal_completion_and_clearing(self):
+    self.upload()
+    self.assertTrue(resumable_upload.load_journal(self.video)["complete"])
+    del self.server.commands[:]
+    self.upload()
+    self.assertEqual([], self.server.commands)
+    resumable_upload.clear_journal(self.video)
+    self.assertFalse(os.path.exists(resumable_upload.journal_path(self.video)))
+    self.assertEqual(None, resumable_upload.load_journal(self.video))
+
+  def test_changed_file_ignores_journal(self):
+    self.upload()
+    with open(self.video, "ab") as fh:
+      fh.write(b"more")
+    os.utime(self.video, (0, 0))
+    self.assertEqual(None, resumable_upload.load_journal(self.video))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,201 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Runs an ffmpeg encode as several segments in parallel.
+#
+# A single x264 process doesn't keep many cores busy.  Here the input is cut
+# into consecutive time ranges, each range is encoded by its own ffmpeg
+# process with the same options, and the encoded segments are joined with
+# the concat demuxer without re-encoding.  Each segment starts with a
+# keyframe and, except for the last one, is cut to a whole number of output
+# frames, so the joined video has the same frames as a single-pass encode.
+
+
+import math
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+# Segments shorter than this aren't worth an extra process.
+MIN_SEGMENT_SECONDS = 10
+
+
+def default_jobs():
+  """Returns the number of CPU cores."""
+  try:
+    return multiprocessing.cpu_count()
+  except NotImplementedError:
+    return 1
+
+
+def input_seek(start):
+  """Returns the input options that start decoding at start seconds."""
+  return ["-ss", "%.3f" % start]
+
+
+def segment_command(command, start, length, frames, output, threads,
+                    seek=input_seek):
+  """Returns an ffmpeg command that encodes one time range of the input.
+
+  Args:
+    command: ffmpeg command line as a list, with one "-i" input and the
+      output file last.
+    start: Start of the range in seconds.
+    length: Length of the range in seconds.
+    frames: Number of frames to write, or None for all frames until the
+      end of the input.
+    output: The file the segment is written to.
+    threads: Number of encoder threads for the segment.
+    seek: Function returning the input options that start the input at a
+      given second.
+  Returns:
+    The command line as a list.
+  """
+  index = command.index("-i")
+  limit = ["-frames:v", str(frames)] if frames is not None else []
+  return (command[:index] + seek(start) + ["-t", "%.3f" % length] +
+          command[index:-1] + limit + ["-threads", str(threads), "-y", output])
+
+
+def concat(segments, output, list_file=None):
+  """Joins MP4 segments into one file without re-encoding.
+
+  Args:
+    segments: Full paths of the segments, in order.
+    output: The file the segments are joined into.
+    list_file: The file the list of segments is written to for the concat
+      demuxer, defaults to segments.txt next to the first segment.
+  Returns:
+    The exit code of ffmpeg.
+  """
+  if list_file is None:
+    list_file = os.path.join(os.path.dirname(segments[0]), "segments.txt")
+  with open(list_file, "w") as fh:
+    for segment in segments:
+      fh.write("file '%s'\n" % segment.replace("'", "'\\''"))
+  return subprocess.call(["ffmpeg", "-v", "error", "-f", "concat", "-safe", "0",
+                          "-i", list_file, "-c", "copy", "-y", output])
+
+
+def _encode_pieces(command, pieces, jobs, seek):
+  """Encodes (start, length, frames) pieces of the input and joins them."""
+  output = command[-1]
+  threads = max(1, default_jobs() // len(pieces))
+  work_dir = tempfile.mkdtemp(prefix="segments", dir=os.path.dirname(os.path.abspath(output)))
+  try:
+    segments = [os.path.join(work_dir, "segment_%04d.mp4" % i) for i in range(len(pieces))]
+    commands = [segment_command(command, start, length, frames, segment, threads, seek)
+                for (start, length, frames), segment in zip(pieces, segments)]
+    print("Encoding %d segments, %d at a time" % (len(pieces), jobs))
+    pool = ThreadPool(jobs)
+    try:
+      # Each worker thread only waits for its ffmpeg process.
+      results = pool.map(subprocess.call, commands)
+    finally:
+      pool.close()
+      pool.join()
+    if any(results):
+      return max(results)
+    return concat(segments, output)
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _segments(duration, jobs):
+  """Returns the length and number of segments encode() cuts an input into."""
+  length = max(MIN_SEGMENT_SECONDS, int(math.ceil(float(duration) / jobs)))
+  return length, int(math.ceil(float(duration) / length))
+
+
+def parallelism(duration, jobs=None):
+  """Returns how many ffmpeg processes encode() runs at the same time.
+
+  Args:
+    duration: Duration of the input in seconds.
+    jobs: Number of segments to encode at the same time, defaults to the
+      number of CPU cores.
+  Returns:
+    The number of segments encoded at once, 1 for a single-pass encode.
+  """
+  jobs = jobs or default_jobs()
+  _, count = _segments(duration, jobs)
+  if jobs < 2 or count < 2:
+    return 1
+  return min(jobs, count)
+
+
+def encode(command, duration, frame_rate, jobs=None, seek=input_seek):
+  """Runs an ffmpeg encode split into segments, in parallel.
+
+  Args:
+    command: ffmpeg command line as a list, with one "-i" input and the
+      output file last.
+    duration: Duration of the input in seconds.
+    frame_rate: Frame rate of the output.  Every segment but the last is cut
+      to exactly its length times this many frames, so that no frames are
+      repeated at the joins.
+    jobs: Number of segments to encode at the same time, defaults to the
+      number of CPU cores.
+    seek: Function returning the input options that start the input at a
+      given second, for inputs that -ss doesn't work with.
+  Returns:
+    The exit code: 0 if all segments were encoded and joined.
+  """
+  jobs = jobs or default_jobs()
+  length, count = _segments(duration, jobs)
+  if jobs < 2 or count < 2:
+    return subprocess.call(command)
+  pieces = [(i * length, length, int(round(length * frame_rate))) for i in range(count - 1)]
+  pieces.append(((count - 1) * length, length, None))
+  return _encode_pieces(command, pieces, jobs, seek)
+
+
+def encode_ranges(command, ranges, frame_rate, jobs=None, seek=input_seek):
+  """Encodes only the given time ranges of the input, one after the other.
+
+  Long ranges are split into several segments, so that all jobs are busy.
+
+  Args:
+    command: ffmpeg command line as a list, with one "-i" input and the
+      output file last.
+    ranges: List of (start, end) tuples in seconds, in order.  The bounds
+      should be multiples of 1 / frame_rate.
+    frame_rate: Frame rate of the output.  Every range is cut to exactly its
+      length times this many frames.
+    jobs: Number of segments to encode at the same time, defaults to the
+      number of CPU cores.
+    seek: Function returning the input options that start the input at a
+      given second.
+  Returns:
+    The exit code: 0 if all ranges were encoded and joined.
+  Raises:
+    ValueError: If the ranges are empty.
+  """
+  if not ranges:
+    raise ValueError("No ranges to encode")
+  jobs = jobs or default_jobs()
+  total = sum(end - start for start, end in ranges)
+  length = max(MIN_SEGMENT_SECONDS, int(math.ceil(float(total) / jobs)))
+  pieces = []
+  for start, end in ranges:
+    while end - start > 1e-6:
+      piece = min(length, end - start)
+      pieces.append((start, piece, int(round(piece * frame_rate))))
+      start += piece
+  return _encode_pieces(command, pieces, max(1, jobs), seek)
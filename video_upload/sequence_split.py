@@ -0,0 +1,194 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Splits a long video into parts that are published as separate sequences.
+#
+# One upload of a multi-hour video is lost completely if it fails, and the
+# server can't start processing it until the last byte has arrived.  Here
+# the video is cut into parts of bounded duration, and each part gets its
+# own Upload URL and is uploaded and published on its own, several at once.
+#
+# The video is only cut at keyframes, so the parts are copied out of the
+# video without re-encoding.  A part also ends where the GPS track has a gap,
+# so that no sequence spans a stretch without positions.  The GPS track of a
+# part is the part of the track between the start and end of the part.
+
+
+import os
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+MAX_JOBS = 4
+MAX_GPS_GAP = 30
+
+
+def max_part_seconds(video_file, duration, max_minutes=None, max_mb=None):
+  """Returns the longest part duration that meets the duration and size limits.
+
+  Args:
+    video_file: Full path of the video.
+    duration: Duration of the video in seconds.
+    max_minutes: Optional maximum duration of a part in minutes.
+    max_mb: Optional maximum size of a part in MB, converted to a duration
+      with the average bitrate of the video.
+  Returns:
+    The duration in seconds, or None if there is no limit.
+  """
+  limits = []
+  if max_minutes:
+    limits.append(max_minutes * 60.0)
+  if max_mb and duration:
+    limits.append(max_mb * 1e6 / (os.path.getsize(video_file) / float(duration)))
+  return min(limits) if limits else None
+
+
+def gps_gaps(timeline, start_time, max_gap=MAX_GPS_GAP):
+  """Returns the gaps in a GPS track, in seconds after the start of a video.
+
+  Args:
+    timeline: A sorted GpsTimeline.
+    start_time: Start time of the video in seconds since epoch.
+    max_gap: Gaps between points of up to this many seconds are ignored.
+  Returns:
+    List of (start, end) tuples.
+  """
+  times = timeline.times() - float(start_time)
+  if len(times) < 2:
+    return []
+  gaps = (times[1:] - times[:-1]) > max_gap
+  return [(float(start), float(end))
+          for start, end in zip(times[:-1][gaps], times[1:][gaps])]
+
+
+def plan_parts(duration, keyframes, max_seconds=None, gaps=()):
+  """Picks the keyframes to cut a video at.
+
+  Args:
+    duration: Duration of the video in seconds.
+    keyframes: Sorted keyframe times of the video, in seconds.
+    max_seconds: Optional maximum duration of a part.  A part only gets
+      longer than that if there is no keyframe to cut at.
+    gaps: (start, end) tuples of GPS gaps, in seconds.  The video is cut at
+      the first keyframe of each gap.
+  Returns:
+    List of (start, end) tuples, in seconds.
+  """
+  keyframes = [k for k in keyframes if 0 < k < duration]
+  forced = set()
+  for gap_start, _ in gaps:
+    after = [k for k in keyframes if k >= gap_start]
+    if after:
+      forced.add(after[0])
+  cuts = []
+  start = 0.0
+  for i, keyframe in enumerate(keyframes):
+    next_keyframe = keyframes[i + 1] if i + 1 < len(keyframes) else duration
+    if keyframe in forced:
+      cuts.append(keyframe)
+      start = keyframe
+    elif max_seconds and next_keyframe - start > max_seconds and keyframe > start:
+      # The next keyframe is too far, so this is the last one within the limit.
+      cuts.append(keyframe)
+      start = keyframe
+  bounds = [0.0] + cuts + [duration]
+  return list(zip(bounds[:-1], bounds[1:]))
+
+
+def part_file(video_file, index):
+  """Returns the file name of part index of a video."""
+  return "%s.part%03d.mp4" % (os.path.splitext(video_file)[0], index)
+
+
+def part_name(file_name, index):
+  """Returns the name of a file that belongs to part index, e.g. a debug file.
+
+  The parts are published at the same time, so each needs its own file.
+  Returns None if file_name is None.
+  """
+  if file_name is None:
+    return None
+  base, extension = os.path.splitext(file_name)
+  return "%s.part%03d%s" % (base, index, extension)
+
+
+def cut_part(video_file, start, end, output, last=False):
+  """Copies a part of a video into a new file, without re-encoding.
+
+  Args:
+    video_file: Full path of the video.
+    start: Start of the part in seconds, a keyframe.
+    end: End of the part in seconds.
+    output: The file the part is written to.
+    last: True if the part runs to the end of the video.
+  Returns:
+    The exit code of ffmpeg.
+  """
+  length = [] if last else ["-t", "%.6f" % (end - start)]
+  return subprocess.call(["ffmpeg", "-v", "error", "-ss", "%.6f" % start, "-i", video_file] +
+                         length + ["-c", "copy", "-avoid_negative_ts", "make_zero",
+                                   "-y", output])
+
+
+def summarize(parts, sequence_ids):
+  """Prints the sequence id of each part, and the parts that failed.
+
+  Returns:
+    The sequence ids separated by commas, or None if any part failed.
+  """
+  for index, ((start, end), sequence_id) in enumerate(zip(parts, sequence_ids)):
+    print("Part %d, %.0fs to %.0fs: %s" % (index, start, end, sequence_id or "failed"))
+  failed = [str(index) for index, sequence_id in enumerate(sequence_ids) if sequence_id is None]
+  if failed:
+    print("%d of %d parts failed: %s" % (len(failed), len(parts), ", ".join(failed)))
+    return None
+  return ", ".join(sequence_ids)
+
+
+def publish_parts(video_file, parts, publish_part, jobs=MAX_JOBS, keep=None):
+  """Cuts a video into parts, then uploads and publishes them concurrently.
+
+  Args:
+    video_file: Full path of the video.
+    parts: The (start, end) tuples returned by plan_parts().
+    publish_part: Function taking the index of a part, its file, and its
+      start and end in seconds, that uploads and publishes the part and
+      returns the sequence id, or None if that failed.  It is called from
+      several threads at once.
+    jobs: Number of parts handled at the same time.
+    keep: Optional function taking the file of a part, that returns True if
+      the existing file should be used instead of cutting it again, e.g.
+      because an upload of it can be resumed.
+  Returns:
+    List of sequence ids, None for the parts that failed.
+  """
+  def run(index):
+    start, end = parts[index]
+    output = part_file(video_file, index)
+    if not (keep is not None and os.path.exists(output) and keep(output)):
+      if cut_part(video_file, start, end, output, last=index == len(parts) - 1) != 0:
+        print("Could not cut part %d of %s" % (index, video_file))
+        return None
+    sequence_id = publish_part(index, output, start, end)
+    if sequence_id is not None:
+      os.remove(output)
+    return sequence_id
+
+  pool = ThreadPool(max(1, min(jobs, len(parts))))
+  try:
+    return pool.map(run, range(len(parts)))
+  finally:
+    pool.close()
+    pool.join()
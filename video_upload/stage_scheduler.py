@@ -0,0 +1,156 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Runs the independent steps of an upload concurrently.
+#
+# Each stage is a function with a list of stages it depends on.  A stage
+# starts as soon as all of its dependencies have finished, in its own thread;
+# the steps are dominated by ffmpeg, gopro2gpx and network calls, so threads
+# are enough to overlap them.  After the run, report() prints when each stage
+# ran and which stages formed the critical path.
+
+
+import threading
+import time
+
+
+class StageError(Exception):
+  """Raised by run() when a stage failed."""
+
+
+class Stage(object):
+  """A single step of a StageScheduler."""
+
+  def __init__(self, name, func, args, deps, after):
+    self.name = name
+    self.func = func
+    self.args = tuple(args)
+    self.deps = tuple(deps)
+    self.after = tuple(after)
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.start = None
+    self.end = None
+
+
+class StageScheduler(object):
+  """Runs stages as soon as their dependencies are done.
+
+  Usage:
+    scheduler = StageScheduler()
+    scheduler.add("gpx", extract_gpmf, args=[front])
+    scheduler.add("video", convert_video, args=[video])
+    scheduler.add("url", request_upload_url)
+    scheduler.add("upload", upload_video, deps=["video", "url"])
+    results = scheduler.run()
+    scheduler.report()
+  """
+
+  def __init__(self):
+    self.stages = []
+    self.by_name = {}
+    self.started = None
+
+  def add(self, name, func, args=(), deps=(), after=()):
+    """Adds a stage.
+
+    Args:
+      name: Unique name of the stage.
+      func: The function to run.
+      args: Positional arguments for func.
+      deps: Names of stages whose results are appended to args, in order.
+      after: Names of stages that must finish first, without passing on
+        their results.
+    """
+    for dep in tuple(deps) + tuple(after):
+      if dep not in self.by_name:
+        raise ValueError("Stage %s depends on unknown stage %s" % (name, dep))
+    stage = Stage(name, func, args, deps, after)
+    self.stages.append(stage)
+    self.by_name[name] = stage
+
+  def _run_stage(self, stage):
+    try:
+      for dep in stage.deps + stage.after:
+        self.by_name[dep].done.wait()
+        if self.by_name[dep].error is not None:
+          stage.error = StageError("skipped because %s failed" % dep)
+          return
+      args = stage.args + tuple(self.by_name[dep].result for dep in stage.deps)
+      stage.start = time.time()
+      stage.result = stage.func(*args)
+    except Exception as error:
+      stage.error = error
+    finally:
+      stage.end = time.time()
+      stage.done.set()
+
+  def run(self):
+    """Runs all stages and waits for them.
+
+    Returns:
+      Dict of stage name to the value returned by its function.
+    Raises:
+      StageError: If a stage raised an exception.
+    """
+    self.started = time.time()
+    threads = []
+    for stage in self.stages:
+      thread = threading.Thread(target=self._run_stage, args=(stage,))
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      # Join with a timeout so that Ctrl-C still interrupts the main thread.
+      while thread.is_alive():
+        thread.join(1)
+    for stage in self.stages:
+      if stage.error is not None and not isinstance(stage.error, StageError):
+        raise StageError("Stage %s failed: %s" % (stage.name, stage.error))
+    return dict((stage.name, stage.result) for stage in self.stages)
+
+  def critical_path(self):
+    """Returns the names of the stages on the critical path, in order.
+
+    The path is followed backwards from the stage that finished last, always
+    through the dependency that finished last.
+    """
+    finished = [stage for stage in self.stages if stage.start is not None]
+    if not finished:
+      return []
+    stage = max(finished, key=lambda s: s.end)
+    path = [stage.name]
+    while stage.deps or stage.after:
+      stage = max((self.by_name[dep] for dep in stage.deps + stage.after),
+                  key=lambda s: s.end)
+      path.append(stage.name)
+    return list(reversed(path))
+
+  def report(self):
+    """Prints the start, end and duration of each stage."""
+    critical = set(self.critical_path())
+    print("Stage timings (* = critical path):")
+    for stage in self.stages:
+      marker = "*" if stage.name in critical else " "
+      if stage.start is None:
+        print(" %s %-20s not run" % (marker, stage.name))
+        continue
+      print(" %s %-20s start %8.1fs  end %8.1fs  took %8.1fs" % (
+          marker, stage.name, stage.start - self.started,
+          stage.end - self.started, stage.end - stage.start))
+    if self.stages:
+      print("Total: %.1fs" % (max(s.end for s in self.stages) - self.started))
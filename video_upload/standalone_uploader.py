@@ -23,20 +23,48 @@
 #
 # $ python standalone_uploader.py \
 #   --video=<video file> \
-#   --gpx=<gpx file> \
+#   --gpx=<gpx file> (or --gpx_archive=<archive file>) \
 #   --time=<video starting time in seconds since epoch>
 #   --blur (optional) \
+#   --resumable (optional) \
+#   --align (optional) \
 #   --key=<your developer key>
+#
+# Pass --gpx_archive instead of --gpx to read the track from a local archive
+# of GPS points, which is created if it doesn't exist.  If --gpx is also given,
+# the GPX file is added to the archive first; files that were added before are
+# skipped.  Archived points can be fetched for any video within milliseconds,
+# without reading GPX files again.
+#
+# Pass --align to check the start time before uploading.  The motion in a
+# low resolution pass over the video is matched against the speed in the GPX
+# track, within --max_offset seconds of the given start time.  The start
+# time is corrected if the match is at least --min_confidence (0 to 1).
+#
+# Pass --resumable to upload the video in chunks.  If the upload is interrupted,
+# running the same command again continues from the last acknowledged byte.
+#
+# Pass --split_minutes or --split_mb to publish a long video as several
+# sequences.  The video is cut at keyframes, and also where the GPX track has a
+# gap longer than --split_gap seconds.  The parts are uploaded and published
+# --split_jobs at a time, each with its own Upload URL.  With --metadata_json,
+# the request of each part goes to its own file, e.g. metadata.part000.json.
+# Splitting needs ffprobe.
 
 # Requirements:
 # This script requires the following libraries:
 #
 # - google-api-python-client
+# - numpy
 # - pycurl
 #
 # The libraries can be installed by running:
 #
 # $ pip install <library name>
+#
+# ffprobe, which comes with FFmpeg, is used to read the duration of the video.
+# Only the part of the GPX track that covers the video, plus --gpx_margin
+# seconds on either side, is sent.  Without ffprobe the whole track is sent.
 
 
 import argparse
@@ -46,16 +74,24 @@ import time
 import json
 import os
 import re
+import threading
 import urlparse
-from apiclient import discovery
 from apiclient import errors
-import gpxpy
-import gpxpy.gpx
 import httplib2
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
 import pycurl
+import discovery_cache
+import gps_archive
+import gps_timeline
+import gpx_stream
+import publish_json
+import resumable_upload
+import sequence_split
+import time_align
+import token_manager
+import video_probe
 
 API_NAME = "streetviewpublish"
 API_VERSION = "v1"
@@ -68,11 +104,29 @@ CLIENT_SECRETS_FILE = "streetviewpublish_config.json"
 parser = argparse.ArgumentParser(parents=[tools.argparser])
 parser.add_argument("--video", help="Full path of the video to upload")
 parser.add_argument("--gpx", help="Full path of the gpx file to upload")
+parser.add_argument("--gpx_archive", help="Full path of a GPS archive to read the track from; --gpx files are added to it first")
 parser.add_argument("--time", help="Video start time in seconds since epoch")
 parser.add_argument("--blur", default=False, action='store_true', help="Enable auto-blurring")
 parser.add_argument("--key", help="Your developer key")
+parser.add_argument("--resumable", default=False, action='store_true', help="Upload in chunks and resume interrupted uploads")
+parser.add_argument("--metadata_json", help="Also write the publish request to this JSON file, for debugging")
+parser.add_argument("--simplify", type=float, help="Drop GPS points that are within this many metres of the simplified track")
+parser.add_argument("--max_gap", type=float, default=5, help="With --simplify, maximum seconds between GPS points kept")
+parser.add_argument("--gpx_margin", type=float, default=10, help="Seconds of GPS track to send before and after the video")
+parser.add_argument("--align", default=False, action='store_true', help="Correct the video start time by matching the video's motion to the GPX track")
+parser.add_argument("--max_offset", type=float, default=time_align.MAX_OFFSET, help="With --align, largest correction in seconds")
+parser.add_argument("--min_confidence", type=float, default=0.1, help="With --align, minimum confidence to apply the correction")
+parser.add_argument("--split_minutes", type=float, help="Split the video into sequences of at most this many minutes")
+parser.add_argument("--split_mb", type=float, help="Split the video into sequences of at most this many MB")
+parser.add_argument("--split_gap", type=float, default=sequence_split.MAX_GPS_GAP, help="When splitting, also split where the GPS track has a gap of more than this many seconds")
+parser.add_argument("--split_jobs", type=int, default=sequence_split.MAX_JOBS, help="Number of parts to upload and publish at the same time")
+parser.add_argument("--chunk_size", type=int, default=8, help="Chunk size in MB for resumable uploads")
 flags = parser.parse_args()
 
+api_service = threading.local()
+service_lock = threading.Lock()
+tokens = None
+
 
 def get_discovery_service_url():
   """Returns the discovery service url."""
@@ -84,13 +138,44 @@ def get_discovery_service_url():
   return discovery_service_url
 
 
+def get_service():
+  """Returns the API service object of the calling thread.
+
+  The service is built once per thread from a cached copy of the discovery
+  document, and reused by every step on that thread.  httplib2 connections
+  aren't thread-safe, so the threads that publish parts of a split video
+  each get their own service.
+
+  Returns:
+    The Street View Publish API service object.
+  """
+  service = getattr(api_service, "service", None)
+  if service is None:
+    with service_lock:
+      credentials = get_credentials()
+      http = credentials.authorize(httplib2.Http())
+      service = discovery_cache.build(
+          API_NAME,
+          API_VERSION,
+          developerKey=flags.key,
+          discoveryServiceUrl=get_discovery_service_url(),
+          http=http)
+    api_service.service = service
+  return service
+
+
 def get_credentials():
   """Gets valid user credentials from storage.
   If nothing has been stored, or if the stored credentials are invalid,
   the OAuth2 flow is completed to obtain the new credentials.
+  The credentials are only loaded once per run.  After that, a TokenManager
+  keeps the access token valid and the same credentials are returned.
   Returns:
       Credentials, the obtained credential.
   """
+  global tokens
+  if tokens is not None:
+    return tokens.get_credentials()
   home_dir = os.path.expanduser("~")
   credential_dir = os.path.join(home_dir, ".credentials")
   if not os.path.exists(credential_dir):
@@ -108,7 +193,9 @@ def get_credentials():
     else:
       credentials = tools.run(flow, store)
     print "Storing credentials to " + credential_path
-  return credentials
+  tokens = token_manager.TokenManager(credential_path, credentials)
+  tokens.start()
+  return tokens.get_credentials()
 
 
 def get_file_size(file_name):
@@ -141,6 +228,59 @@ def get_headers(credentials, file_size, url):
   return ["%s: %s" % (k, v) for (k, v) in headers.iteritems()]
 
 
+def read_timeline(gpx_file):
+  """Reads the GPX file into a sorted GpsTimeline."""
+  return gps_timeline.GpsTimeline.from_points(gpx_stream.read_points(gpx_file)).sort()
+
+
+def read_archive(gpx_files, create_time, duration):
+  """Reads the GPS points covering the video from the --gpx_archive.
+
+  Args:
+    gpx_files: GPX files to add to the archive first, may be empty.
+    create_time: Start time of video in seconds since epoch.
+    duration: Duration of the video in seconds.
+  Returns:
+    A sorted GpsTimeline.
+  """
+  archive = gps_archive.GpsArchive(flags.gpx_archive)
+  try:
+    for gpx_file in gpx_files:
+      print("Added %d GPS points from %s to the archive" % (
+          archive.add_gpx(gpx_file), gpx_file))
+    margin = flags.gpx_margin
+    if flags.align:
+      margin += flags.max_offset
+    return archive.window(float(create_time) - margin,
+                          float(create_time) + duration + margin)
+  finally:
+    archive.close()
+
+
+def align_create_time(video_file, timeline, create_time):
+  """Corrects the start time of the video by matching it to the GPS track.
+
+  Args:
+    video_file: Full path of the video.
+    timeline: The sorted GpsTimeline of the GPX file.
+    create_time: Start time of video in seconds since epoch.
+  Returns:
+    The corrected start time, or create_time if the match is not reliable.
+  """
+  print("Aligning video with GPX track")
+  try:
+    offset, confidence = time_align.estimate_offset(
+        video_file, timeline.unique(), float(create_time), flags.max_offset)
+  except (OSError, ValueError) as error:
+    print("Could not align video: %s" % error)
+    return create_time
+  print("Estimated offset %+.1f seconds, confidence %.2f" % (offset, confidence))
+  if confidence < flags.min_confidence:
+    print("Confidence too low, keeping start time %s" % create_time)
+    return create_time
+  return float(create_time) + offset
+
+
 def publish(video_file, gpx_file, create_time):
   """Uploads a video and returns the sequence id.
   Args:
@@ -150,25 +290,78 @@ def publish(video_file, gpx_file, create_time):
   Returns:
     The id if the upload was successful, otherwise None.
   """
-  upload_url = request_upload_url()
+  # The GPX file is read and the video aligned before anything is uploaded,
+  # so a bad start time is found before a long upload.
+  duration = video_probe.duration(video_file)
+  if flags.gpx_archive:
+    if duration is None:
+      print("Could not read the duration of %s, which --gpx_archive needs" % video_file)
+      return None
+    timeline = read_archive([gpx_file] if gpx_file else [], create_time, duration)
+    print("Read %d GPS points from the archive" % len(timeline))
+  else:
+    timeline = read_timeline(gpx_file)
+  if flags.align:
+    create_time = align_create_time(video_file, timeline, create_time)
+  if flags.split_minutes or flags.split_mb:
+    if duration is None:
+      print("Could not read the duration of %s, uploading it in one piece" % video_file)
+    else:
+      return publish_split(video_file, timeline, create_time, duration)
+  upload_url = None
+  if flags.resumable:
+    upload_url = resumable_upload.journaled_upload_url(video_file)
+  if upload_url is None:
+    upload_url = request_upload_url()
   upload_video(video_file, upload_url)
-  publish_response = publish_sequence(upload_url, gpx_file, create_time)
+  publish_response = publish_sequence(upload_url, timeline, create_time, duration)
+  if publish_response is not None:
+    resumable_upload.clear_journal(video_file)
   return publish_response
 
 
+def publish_split(video_file, timeline, create_time, duration):
+  """Splits a video into parts and publishes each part as a sequence.
+
+  Args:
+    video_file: Full path of the video to upload.
+    timeline: The sorted GpsTimeline of the video.
+    create_time: Start time of video in seconds since epoch.
+    duration: Duration of the video in seconds.
+  Returns:
+    The ids of the sequences if all parts were published, otherwise None.
+  """
+  parts = sequence_split.plan_parts(
+      duration, video_probe.keyframe_times(video_file),
+      sequence_split.max_part_seconds(video_file, duration, flags.split_minutes, flags.split_mb),
+      sequence_split.gps_gaps(timeline, create_time, flags.split_gap))
+  print("Splitting %s into %d parts" % (video_file, len(parts)))
+
+  def publish_part(index, part_file, start, end):
+    upload_url = None
+    if flags.resumable:
+      upload_url = resumable_upload.journaled_upload_url(part_file)
+    if upload_url is None:
+      upload_url = request_upload_url()
+    upload_video(part_file, upload_url)
+    publish_response = publish_sequence(upload_url, timeline, float(create_time) + start, end - start,
+                                        sequence_split.part_name(flags.metadata_json, index))
+    if publish_response is not None:
+      resumable_upload.clear_journal(part_file)
+    return publish_response
+
+  sequence_ids = sequence_split.publish_parts(
+      video_file, parts, publish_part, flags.split_jobs,
+      keep=lambda part_file: flags.resumable and resumable_upload.load_journal(part_file) is not None)
+  return sequence_split.summarize(parts, sequence_ids)
+
+
 def request_upload_url():
   """Requests an Upload URL from SV servers (step 1/3).
   Returns:
     The Upload URL.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   start_upload_response = service.photoSequence().startUpload(body={}).execute()
   upload_url = str(start_upload_response["uploadUrl"])
   return upload_url
@@ -184,6 +377,13 @@ def upload_video(video_file, upload_url):
   """
   credentials = get_credentials()
   credentials.authorize(httplib2.Http())
+  if flags.resumable:
+    try:
+      resumable_upload.upload(str(video_file), upload_url, credentials,
+                              chunk_size=flags.chunk_size * 1024 * 1024)
+    except resumable_upload.UploadError as error:
+      print("Error uploading file %s: %s" % (video_file, error))
+    return
   file_size = get_file_size(str(video_file))
   try:
     curl = pycurl.Curl()
@@ -204,47 +404,40 @@ def upload_video(video_file, upload_url):
     print("Error uploading file %s", video_file)
 
 
-def publish_sequence(upload_url, gpx_file, create_time):
+def publish_sequence(upload_url, timeline, create_time, duration=None, debug_file=None):
   """Publishes the content on Street View (step 3/3).
   Args:
     upload_url: The upload URL returned by step 1.
-    gpx_file: Full path of the gpx file to upload.
+    timeline: The sorted GpsTimeline returned by read_timeline().
     create_time: Creation time of the video, in seconds since epoch.
+    duration: Duration of the video in seconds.  If set, only the GPS points
+      recorded while the video was recorded are sent, plus --gpx_margin.
+    debug_file: File to write the publish request to, defaults to
+      --metadata_json.
   Returns:
     The id if the upload was successful, otherwise None.
   """
-  credentials = get_credentials()
-  http = credentials.authorize(httplib2.Http())
-  service = discovery.build(
-      API_NAME,
-      API_VERSION,
-      developerKey=flags.key,
-      discoveryServiceUrl=get_discovery_service_url(),
-      http=http)
+  service = get_service()
   publish_request = {"uploadReference": {"uploadUrl": upload_url}}
   if flags.blur:
     publish_request["blurringOptions"] = {"blurFaces":"true","blurLicensePlates":"true"}
-  publish_request["captureTimeOverride"] = {"seconds": create_time}
-  gpx_file = open(gpx_file, 'r')
-  gpx = gpxpy.parse(gpx_file)
-  rawGpsTimelines = []
-  for track in gpx.tracks:
-    for segment in track.segments:
-      for point in segment.points:
-        time_epoch = timegm(time.strptime(str(point.time), '%Y-%m-%d %H:%M:%S'))
-        rawGpsTimeline = {}
-        rawGpsTimeline["latLngPair"] = {
-            "latitude": point.latitude,
-            "longitude": point.longitude
-        }
-        rawGpsTimeline["altitude"] = point.elevation
-        rawGpsTimeline["gpsRecordTimestampUnixEpoch"] = {
-            "seconds": time_epoch
-        }
-        rawGpsTimelines.append(rawGpsTimeline)
-  publish_request.update({"rawGpsTimeline": rawGpsTimelines})
+  publish_request["captureTimeOverride"] = {"seconds": int(float(create_time))}
+  if duration is not None:
+    start = float(create_time) - flags.gpx_margin
+    end = float(create_time) + duration + flags.gpx_margin
+    clipped = timeline.clip(start, end)
+    print("Sending %d of %d GPS points, from %d to %d" % (len(clipped), len(timeline), start, end))
+    timeline = clipped
+  else:
+    print("Could not read the video duration, sending the whole GPX track")
+  if flags.simplify is not None:
+    simplified = timeline.simplify(flags.simplify, flags.max_gap)
+    saved = publish_json.timeline_size(timeline) - publish_json.timeline_size(simplified)
+    print("Kept %d of %d GPS points, %d bytes saved" % (len(simplified), len(timeline), saved))
+    timeline = simplified
   try:
-    publish_response = service.photoSequence().create(body=publish_request, inputType="VIDEO").execute()
+    publish_response = publish_json.create_sequence(
+        service, publish_request, timeline, debug_file or flags.metadata_json)
     return publish_response["name"]
   except errors.HttpError as error:
     photo_response_error = json.loads(error.content)
@@ -270,8 +463,8 @@ def main():
     print "You must include your developer key."
     exit(1)
 
-  if flags.video is None or flags.gpx is None:
-    print "You must provide a video file and a gpx file."
+  if flags.video is None or (flags.gpx is None and flags.gpx_archive is None):
+    print "You must provide a video file and a gpx file or archive."
     exit(1)
   
   create_time = 0
@@ -283,6 +476,9 @@ def main():
 
   if flags.video is not None:
     sequence_id = publish(flags.video, flags.gpx, create_time)
+    if sequence_id is None:
+      print "Publishing failed."
+      exit(1)
     output = "Sequence uploaded! Sequence id: " + sequence_id
     print output
 
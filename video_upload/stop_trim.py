@@ -0,0 +1,103 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Finds the stops in a GPS track and cuts them out of the track.
+#
+# The track is resampled to one position per second, which averages out most
+# of the GPS jitter while standing still.  A stop is a run of seconds in
+# which the speed stays below a threshold for longer than a minimum time.
+# The rest of the video is kept, as intervals in seconds after the start of
+# the video.  Once the stops are cut out of the video, the points of the
+# track are moved back in time by the length of the stops before them, so
+# the track still matches the shorter video.
+
+
+import numpy
+import gps_timeline
+
+NANOS_PER_SECOND = gps_timeline.NANOS_PER_SECOND
+MIN_SPEED = 1.0
+
+
+def keep_intervals(timeline, min_stop, min_speed=MIN_SPEED, duration=None):
+  """Returns the parts of a video that aren't stops.
+
+  Args:
+    timeline: A sorted GpsTimeline whose first point is at the start of the
+      video.
+    min_stop: Stops of this many seconds or shorter are kept.
+    min_speed: Speed in metres per second below which the camera stands still.
+    duration: Duration of the video in seconds, defaults to the duration of
+      the timeline.
+  Returns:
+    List of (start, end) tuples in whole seconds after the start of the
+    video, in order.
+  """
+  times = timeline.times()
+  if len(times) < 2:
+    return [(0, duration if duration is not None else 0)]
+  elapsed = times - times[0]
+  if duration is None:
+    duration = elapsed[-1]
+  x, y = timeline.metres()
+  grid = numpy.arange(0, int(elapsed[-1]) + 1)
+  speed = numpy.hypot(numpy.diff(numpy.interp(grid, elapsed, x)),
+                      numpy.diff(numpy.interp(grid, elapsed, y)))
+  # Second i of speed runs from grid[i] to grid[i + 1].
+  still = numpy.concatenate(([False], speed < min_speed, [False]))
+  edges = numpy.flatnonzero(numpy.diff(still.astype(numpy.int8)))
+  intervals = []
+  start = 0
+  for stop_start, stop_end in zip(edges[0::2], edges[1::2]):
+    if stop_end - stop_start > min_stop:
+      if stop_start > start:
+        intervals.append((start, int(stop_start)))
+      start = int(stop_end)
+  if duration > start:
+    intervals.append((start, duration))
+  return intervals
+
+
+def trim_timeline(timeline, intervals):
+  """Cuts the stops out of a timeline.
+
+  Args:
+    timeline: A sorted GpsTimeline whose first point is at the start of the
+      video.
+    intervals: The (start, end) tuples returned by keep_intervals().
+  Returns:
+    A GpsTimeline with only the points within the intervals, moved back in
+    time to match the video with only the intervals.
+  """
+  if len(timeline) == 0:
+    return timeline
+  nanos = timeline.seconds * NANOS_PER_SECOND + timeline.nanos
+  elapsed = nanos - nanos[0]
+  index = []
+  shifted = []
+  kept = 0
+  for start, end in intervals:
+    start_ns = int(round(start * NANOS_PER_SECOND))
+    end_ns = int(round(end * NANOS_PER_SECOND))
+    inside = numpy.flatnonzero((elapsed >= start_ns) & (elapsed < end_ns))
+    index.append(inside)
+    shifted.append(nanos[inside] - start_ns + kept)
+    kept += end_ns - start_ns
+  index = numpy.concatenate(index) if index else numpy.zeros(0, dtype=numpy.int64)
+  shifted = numpy.concatenate(shifted) if shifted else numpy.zeros(0, dtype=numpy.int64)
+  return gps_timeline.GpsTimeline(
+      shifted // NANOS_PER_SECOND, shifted % NANOS_PER_SECOND, timeline.latitude[index],
+      timeline.longitude[index], timeline.altitude[index])
@@ -0,0 +1,191 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Uploads the output of ffmpeg while it is being encoded.
+#
+# ffmpeg writes a fragmented MP4 to a pipe instead of a file.  A pump thread
+# copies the pipe into a bounded ring buffer, and pycurl reads the request
+# body from that buffer.  The total size is unknown up front, so the body is
+# sent with chunked transfer encoding.  Encoding and uploading overlap, and
+# no scratch disk space is needed for the video.
+#
+# The ring buffer absorbs short stalls on either side: ffmpeg only blocks if
+# the upload falls behind by more than the buffer size, and the upload only
+# waits when the encoder has nothing new.
+
+
+import subprocess
+import threading
+import urlparse
+import pycurl
+
+BUFFER_SIZE = 64 * 1024 * 1024
+PIPE_READ_SIZE = 256 * 1024
+
+# Output options that make ffmpeg write an MP4 that doesn't need seeking.
+FRAGMENTED_MP4_ARGS = ["-movflags", "frag_keyframe+empty_moov", "-f", "mp4"]
+
+
+class RingBuffer(object):
+  """A bounded byte buffer with one blocking writer and one blocking reader."""
+
+  def __init__(self, capacity=BUFFER_SIZE):
+    self.data = bytearray(capacity)
+    self.capacity = capacity
+    self.start = 0
+    self.size = 0
+    self.closed = False
+    self.condition = threading.Condition()
+
+  def write(self, chunk):
+    """Appends bytes, blocking while the buffer is full."""
+    view = memoryview(chunk)
+    while len(view):
+      with self.condition:
+        while self.size == self.capacity and not self.closed:
+          self.condition.wait()
+        if self.closed:
+          raise IOError("Write to closed buffer")
+        end = (self.start + self.size) % self.capacity
+        count = min(len(view), self.capacity - self.size, self.capacity - end)
+        self.data[end:end + count] = view[:count]
+        self.size += count
+        self.condition.notify_all()
+      view = view[count:]
+
+  def read(self, max_size):
+    """Returns up to max_size bytes, or an empty string at the end.
+
+    Blocks while the buffer is empty and the writer hasn't closed it.
+    """
+    with self.condition:
+      while self.size == 0 and not self.closed:
+        self.condition.wait()
+      count = min(max_size, self.size, self.capacity - self.start)
+      chunk = bytes(self.data[self.start:self.start + count])
+      self.start = (self.start + count) % self.capacity
+      self.size -= count
+      self.condition.notify_all()
+      return chunk
+
+  def close(self):
+    """Marks the end of the data, or aborts a blocked writer."""
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+
+
+def pipe_command(command):
+  """Turns an ffmpeg command writing a file into one writing to stdout.
+
+  Args:
+    command: ffmpeg command line as a list, with the output file last.
+  Returns:
+    The same command writing a fragmented MP4 to stdout.
+  """
+  return command[:-1] + FRAGMENTED_MP4_ARGS + ["pipe:1"]
+
+
+def _pump(source, buffer):
+  try:
+    while True:
+      chunk = source.read(PIPE_READ_SIZE)
+      if not chunk:
+        break
+      buffer.write(chunk)
+  except IOError:
+    pass
+  finally:
+    buffer.close()
+
+
+def upload_stream(source, upload_url, access_token, buffer_size=BUFFER_SIZE,
+                  source_ok=None):
+  """Uploads a byte stream of unknown length to an Upload URL.
+
+  Args:
+    source: File object to read the video from, e.g. a pipe.
+    upload_url: The Upload URL returned by startUpload.
+    access_token: A valid OAuth access token.
+    buffer_size: Size of the ring buffer between source and upload, in bytes.
+    source_ok: Optional callable, called at the end of the stream.  If it
+      returns False the upload is aborted instead of being completed, so a
+      truncated video is never committed.
+  Returns:
+    Tuple of the response code and the number of bytes uploaded.  The
+    response code is None if the transfer failed or was aborted.
+  """
+  buffer = RingBuffer(buffer_size)
+  pump = threading.Thread(target=_pump, args=(source, buffer))
+  pump.daemon = True
+  pump.start()
+  uploaded = [0]
+
+  def read_function(size):
+    chunk = buffer.read(size)
+    if not chunk and source_ok is not None and not source_ok():
+      return pycurl.READFUNC_ABORT
+    uploaded[0] += len(chunk)
+    return chunk
+
+  headers = {
+      "Content-Type": "video/mp4",
+      "Authorization": "Bearer " + access_token,
+      "X-Goog-Upload-Protocol": "raw",
+      "Transfer-Encoding": "chunked",
+      "Host": urlparse.urlparse(upload_url)[1]
+  }
+  curl = pycurl.Curl()
+  try:
+    curl.setopt(pycurl.URL, upload_url)
+    curl.setopt(pycurl.CUSTOMREQUEST, "POST")
+    curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (k, v) for (k, v) in headers.items()])
+    curl.setopt(pycurl.READFUNCTION, read_function)
+    curl.setopt(pycurl.WRITEFUNCTION, lambda data: None)
+    curl.setopt(pycurl.UPLOAD, 1)
+    curl.perform()
+    return curl.getinfo(pycurl.RESPONSE_CODE), uploaded[0]
+  except pycurl.error:
+    return None, uploaded[0]
+  finally:
+    curl.close()
+    # Unblock the pump if the upload stopped before the end of the stream.
+    buffer.close()
+
+
+def encode_and_upload(command, upload_url, access_token, buffer_size=BUFFER_SIZE):
+  """Runs an ffmpeg command and uploads its output as it is produced.
+
+  Args:
+    command: ffmpeg command line as a list, with the output file last.
+    upload_url: The Upload URL returned by startUpload.
+    access_token: A valid OAuth access token.
+    buffer_size: Size of the ring buffer between ffmpeg and upload, in bytes.
+  Returns:
+    Tuple of the response code and the number of bytes uploaded.  The
+    response code is None if ffmpeg failed.
+  """
+  process = subprocess.Popen(pipe_command(command), stdout=subprocess.PIPE)
+  try:
+    response_code, uploaded = upload_stream(
+        process.stdout, upload_url, access_token, buffer_size,
+        source_ok=lambda: process.wait() == 0)
+  finally:
+    process.stdout.close()
+    returncode = process.wait()
+  if returncode != 0:
+    return None, uploaded
+  return response_code, uploaded
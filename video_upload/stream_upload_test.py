@@ -0,0 +1,158 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Tests for stream_upload.
+#
+# The streams are uploaded to a server on localhost that decodes the chunked
+# request body and keeps it only if the body ended properly.
+#
+# $ python stream_upload_test.py
+
+
+import io
+import os
+import threading
+import unittest
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+import stream_upload
+
+
+class StreamServer(HTTPServer):
+  """Keeps the bodies of the requests that were completely received."""
+
+  def __init__(self):
+    HTTPServer.__init__(self, ("127.0.0.1", 0), StreamHandler)
+    self.bodies = []
+    self.truncated = 0
+
+  def url(self):
+    return "http://127.0.0.1:%d/upload" % self.server_port
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+  def read_chunked(self):
+    """Returns the decoded body, or None if the connection ended early."""
+    body = []
+    while True:
+      line = self.rfile.readline()
+      if not line.endswith(b"\r\n"):
+        return None
+      size = int(line.split(b";")[0], 16)
+      if size == 0:
+        self.rfile.readline()
+        return b"".join(body)
+      chunk = self.rfile.read(size)
+      if len(chunk) < size or self.rfile.read(2) != b"\r\n":
+        return None
+      body.append(chunk)
+
+  def do_POST(self):
+    if (self.headers.get("Expect", "").lower() == "100-continue" and
+        not hasattr(self, "handle_expect_100")):
+      self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+    body = self.read_chunked()
+    if body is None:
+      self.server.truncated += 1
+      self.close_connection = True
+      return
+    self.server.bodies.append(body)
+    self.send_response(200)
+    self.send_header("Content-Length", "0")
+    self.send_header("Connection", "close")
+    self.end_headers()
+    self.close_connection = True
+
+
+class RingBufferTest(unittest.TestCase):
+
+  def test_wraps_around(self):
+    data = os.urandom(100000)
+    buffer = stream_upload.RingBuffer(1000)
+
+    def write():
+      for start in range(0, len(data), 777):
+        buffer.write(data[start:start + 777])
+      buffer.close()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    chunks = []
+    while True:
+      chunk = buffer.read(333)
+      if not chunk:
+        break
+      chunks.append(chunk)
+    writer.join()
+    self.assertEqual(data, b"".join(chunks))
+
+  def test_write_after_close(self):
+    buffer = stream_upload.RingBuffer(10)
+    buffer.close()
+    self.assertRaises(IOError, buffer.write, b"data")
+
+
+class UploadStreamTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = StreamServer()
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.thread.join()
+    self.server.server_close()
+
+  def test_uploads_all_bytes(self):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    code, uploaded = stream_upload.upload_stream(
+        io.BytesIO(data), self.server.url(), "token", buffer_size=64 * 1024)
+    self.assertEqual(200, code)
+    self.assertEqual(len(data), uploaded)
+    self.assertEqual([data], self.server.bodies)
+
+  def test_source_ok_true_completes(self):
+    data = os.urandom(1000)
+    code, _ = stream_upload.upload_stream(
+        io.BytesIO(data), self.server.url(), "token", source_ok=lambda: True)
+    self.assertEqual(200, code)
+    self.assertEqual([data], self.server.bodies)
+
+  def test_failed_source_aborts_upload(self):
+    data = os.urandom(200000)
+    code, uploaded = stream_upload.upload_stream(
+        io.BytesIO(data), self.server.url(), "token", buffer_size=64 * 1024,
+        source_ok=lambda: False)
+    self.assertEqual(None, code)
+    self.assertEqual(len(data), uploaded)
+    self.assertEqual([], self.server.bodies)
+
+  def test_pipe_command(self):
+    self.assertEqual(
+        ["ffmpeg", "-i", "in.mov", "-c", "copy"] + stream_upload.FRAGMENTED_MP4_ARGS + ["pipe:1"],
+        stream_upload.pipe_command(["ffmpeg", "-i", "in.mov", "-c", "copy", "out.mp4"]))
+
+
+if __name__ == "__main__":
+  unittest.main()
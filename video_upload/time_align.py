@@ -0,0 +1,125 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Estimates the offset between the clock of a video and a GPS track.
+#
+# The video is decoded once at a low frame rate and resolution, and the mean
+# absolute difference between consecutive frames is used as its motion
+# energy: it is high while the camera moves and low while it stands still.
+# The GPS speed is resampled to the same rate, and the offset at which the
+# two curves correlate best is taken as the clock offset.
+
+
+import subprocess
+import numpy
+
+SAMPLE_RATE = 5
+FRAME_WIDTH = 64
+FRAME_HEIGHT = 36
+MAX_OFFSET = 60
+# Offsets closer than this to the best one don't count as a competing peak.
+PEAK_WIDTH = 2.0
+
+
+def motion_energy(video_file, rate=SAMPLE_RATE):
+  """Returns the motion energy of a video, sampled at a fixed rate.
+
+  Args:
+    video_file: Full path of the video.
+    rate: Samples per second.
+  Returns:
+    Array with one value per pair of consecutive samples.  Value i belongs
+    to the time (i + 0.5) / rate after the start of the video.
+  Raises:
+    OSError: If ffmpeg fails.
+  """
+  process = subprocess.Popen(
+      ["ffmpeg", "-v", "error", "-i", video_file, "-an",
+       "-vf", "fps=%d,scale=%d:%d" % (rate, FRAME_WIDTH, FRAME_HEIGHT),
+       "-pix_fmt", "gray", "-f", "rawvideo", "pipe:1"],
+      stdout=subprocess.PIPE)
+  data = process.stdout.read()
+  process.stdout.close()
+  if process.wait() != 0:
+    raise OSError("ffmpeg could not decode %s" % video_file)
+  frame_size = FRAME_WIDTH * FRAME_HEIGHT
+  frames = numpy.frombuffer(data[:len(data) // frame_size * frame_size],
+                            dtype=numpy.uint8).reshape(-1, frame_size)
+  return numpy.abs(numpy.diff(frames.astype(numpy.int16), axis=0)).mean(axis=1)
+
+
+def speed_at(timeline, times):
+  """Returns the GPS speed in metres per second at the given times.
+
+  Args:
+    timeline: A sorted GpsTimeline without repeated timestamps.
+    times: Array of times in seconds since epoch.
+  """
+  point_times = timeline.times()
+  if len(point_times) < 2:
+    return numpy.zeros(len(times))
+  x, y = timeline.metres()
+  speed = numpy.hypot(numpy.diff(x), numpy.diff(y)) / numpy.diff(point_times)
+  middle = (point_times[1:] + point_times[:-1]) / 2
+  return numpy.interp(times, middle, speed)
+
+
+def _sliding_correlation(signal, template):
+  """Returns the Pearson correlation of template with every window of signal."""
+  count = len(template)
+  template = (template - template.mean()) / (template.std() or 1.0)
+  sums = numpy.concatenate(([0], numpy.cumsum(signal)))
+  squares = numpy.concatenate(([0], numpy.cumsum(signal * signal)))
+  window_sum = sums[count:] - sums[:-count]
+  window_mean = window_sum / count
+  window_var = (squares[count:] - squares[:-count]) / count - window_mean ** 2
+  window_std = numpy.sqrt(numpy.maximum(window_var, 0))
+  dot = numpy.correlate(signal, template, "valid")
+  with numpy.errstate(divide="ignore", invalid="ignore"):
+    correlation = dot / (count * window_std)
+  return numpy.nan_to_num(correlation)
+
+
+def estimate_offset(video_file, timeline, start_time, max_offset=MAX_OFFSET,
+                    rate=SAMPLE_RATE):
+  """Estimates how far the given start time of a video is off.
+
+  Args:
+    video_file: Full path of the video.
+    timeline: A sorted GpsTimeline covering the video.
+    start_time: The assumed start time of the video, in seconds since epoch.
+    max_offset: Largest offset to consider, in seconds, in either direction.
+    rate: Samples per second used for the comparison.
+  Returns:
+    Tuple of the offset in seconds to add to start_time, and a confidence
+    between 0 and 1: how much better the best offset correlates than the
+    best offset that is not next to it.
+  Raises:
+    OSError: If ffmpeg fails.
+    ValueError: If the video is too short to compare.
+  """
+  energy = motion_energy(video_file, rate)
+  if len(energy) < 2 * rate:
+    raise ValueError("%s is too short to align" % video_file)
+  lags = int(max_offset * rate)
+  # Value i of the motion energy is at start_time + (i + 0.5) / rate.
+  times = start_time + (numpy.arange(len(energy) + 2 * lags) + 0.5 - lags) / float(rate)
+  correlation = _sliding_correlation(speed_at(timeline, times), energy)
+  best = int(numpy.argmax(correlation))
+  others = numpy.abs(numpy.arange(len(correlation)) - best) > PEAK_WIDTH * rate
+  runner_up = correlation[others].max() if others.any() else 0.0
+  confidence = max(0.0, min(1.0, correlation[best] - max(runner_up, 0.0)))
+  return (best - lags) / float(rate), confidence
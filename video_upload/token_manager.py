@@ -0,0 +1,145 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Keeps the OAuth access token of an upload run valid.
+#
+# The credentials are loaded once and shared by the API service and the
+# pycurl uploads.  A background thread refreshes the access token a few
+# minutes before it expires, so long uploads never start a request with an
+# expired token.  Refreshes are serialized across processes with a lock file
+# next to the credentials file: a process that gets the lock after another
+# process has refreshed picks up the stored token instead of refreshing again.
+
+
+import datetime
+import fcntl
+import threading
+import httplib2
+
+REFRESH_MARGIN = 5 * 60
+MAX_SLEEP = 10 * 60
+RETRY_DELAY = 30
+
+
+class FileLock(object):
+  """An exclusive lock on a file, shared between processes."""
+
+  def __init__(self, path):
+    self.path = path
+    self.fh = None
+
+  def __enter__(self):
+    self.fh = open(self.path, "a")
+    fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+    self.fh.close()
+    self.fh = None
+
+
+class TokenManager(object):
+  """Refreshes stored OAuth2 credentials ahead of their expiry.
+
+  Usage:
+    tokens = TokenManager(credential_path, store.get())
+    tokens.start()
+    ...
+    credentials = tokens.get_credentials()
+  """
+
+  def __init__(self, credential_path, credentials, margin=REFRESH_MARGIN):
+    """Creates a token manager.
+
+    Args:
+      credential_path: Path of the credentials file the credentials were
+        loaded from.  Refreshed tokens are written back to it.
+      credentials: The OAuth2Credentials loaded from credential_path.
+      margin: Refresh the token when it expires in less than this many
+        seconds.
+    """
+    self.credentials = credentials
+    self.lock_path = credential_path + ".lock"
+    self.margin = datetime.timedelta(seconds=margin)
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def _expires_in(self):
+    if self.credentials.token_expiry is None:
+      return None
+    return self.credentials.token_expiry - datetime.datetime.utcnow()
+
+  def _needs_refresh(self):
+    expires_in = self._expires_in()
+    return (self.credentials.access_token is None or
+            (expires_in is not None and expires_in < self.margin))
+
+  def refresh(self, force=False):
+    """Refreshes the access token if it is about to expire.
+
+    The credentials object is refreshed in place, so every authorized http
+    and every header built from it afterwards uses the new token.
+
+    Args:
+      force: Refresh even if the token is not about to expire.
+    """
+    with self.lock:
+      if not force and not self._needs_refresh():
+        return
+      with FileLock(self.lock_path):
+        # The credentials are attached to their Storage, so refresh() first
+        # checks whether another process already stored a newer token.
+        self.credentials.refresh(httplib2.Http())
+
+  def get_credentials(self):
+    """Returns the shared credentials, with a token valid for a while."""
+    self.refresh()
+    return self.credentials
+
+  def get_access_token(self):
+    """Returns an access token valid for at least the refresh margin."""
+    return self.get_credentials().access_token
+
+  def start(self):
+    """Starts refreshing the token in the background."""
+    if self.thread is None:
+      self.thread = threading.Thread(target=self._run)
+      self.thread.daemon = True
+      self.thread.start()
+
+  def stop(self):
+    """Stops the background refresh."""
+    self.stopped.set()
+
+  def _run(self):
+    while not self.stopped.is_set():
+      expires_in = self._expires_in()
+      if expires_in is None:
+        sleep = MAX_SLEEP
+      else:
+        sleep = (expires_in - self.margin).total_seconds()
+        sleep = max(1, min(MAX_SLEEP, sleep))
+      if self.stopped.wait(sleep):
+        return
+      try:
+        self.refresh()
+      except Exception as error:
+        # get_credentials() refreshes synchronously if it is still needed,
+        # here we just try again a little later.
+        print("Could not refresh access token: %s" % error)
+        self.stopped.wait(RETRY_DELAY)
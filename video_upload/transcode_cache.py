@@ -0,0 +1,170 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Keeps converted videos, so that a rerun doesn't convert the same video again.
+#
+# An entry is keyed by a fingerprint of the source video and the ffmpeg
+# command that converted it.  Hashing a whole video of many GB would take
+# almost as long as reading it, so the fingerprint is made of the file size,
+# the modification time and a hash of a few blocks spread over the file.
+# Input and output file names are left out of the command, so a moved or
+# renamed video still hits the cache.
+#
+# The cache has a size budget.  When it is exceeded, the entries that were
+# used least recently are removed.  Entries are hard linked to the output file
+# where possible, so a hit doesn't copy the video.  A linked output shares its
+# contents with the entry, so it must be removed before it is written again,
+# never overwritten in place.
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+SAMPLE_BLOCKS = 16
+BLOCK_SIZE = 64 * 1024
+
+
+def fingerprint(path):
+  """Returns a fingerprint of the contents of a file.
+
+  Args:
+    path: Full path of the file.
+  Returns:
+    The fingerprint as a hex string.
+  """
+  stat = os.stat(path)
+  digest = hashlib.sha1(("%d:%d" % (stat.st_size, int(stat.st_mtime * 1000))).encode("ascii"))
+  with open(path, "rb") as fh:
+    last = max(0, stat.st_size - BLOCK_SIZE)
+    for i in range(SAMPLE_BLOCKS):
+      fh.seek(last * i // (SAMPLE_BLOCKS - 1))
+      digest.update(fh.read(BLOCK_SIZE))
+  return digest.hexdigest()
+
+
+def _place(source, target):
+  """Hard links source to target, or copies it if it can't be linked."""
+  if os.path.exists(target):
+    os.remove(target)
+  try:
+    os.link(source, target)
+  except (OSError, AttributeError):
+    shutil.copyfile(source, target)
+
+
+class TranscodeCache(object):
+  """A directory of converted videos with a size budget.
+
+  Usage:
+    cache = TranscodeCache(cache_dir, max_bytes)
+    key = cache.key(video_file, command, output_mp4)
+    if not cache.fetch(key, output_mp4):
+      subprocess.call(command)
+      cache.store(key, output_mp4)
+  """
+
+  def __init__(self, directory, max_bytes):
+    """Opens the cache, creating the directory if it doesn't exist.
+
+    Args:
+      directory: Full path of the cache directory.
+      max_bytes: Size budget of the cache in bytes.
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def key(self, source, command, output):
+    """Returns the cache key for converting source with command.
+
+    Args:
+      source: Full path of the source video.
+      command: ffmpeg command line as a list.  Other settings that change
+        the output can be appended, as values that json can serialize.
+      output: The output file in the command.
+    Returns:
+      The key as a hex string.
+    """
+    names = {source: "<input>", output: "<output>"}
+    params = [names.get(arg, arg) if isinstance(arg, str) else arg for arg in command]
+    digest = hashlib.sha1(fingerprint(source).encode("ascii"))
+    digest.update(json.dumps(params).encode("utf-8"))
+    return digest.hexdigest()
+
+  def _path(self, key):
+    return os.path.join(self.directory, key + ".mp4")
+
+  def fetch(self, key, target):
+    """Places the cached file for key at target.
+
+    Args:
+      key: A key returned by key().
+      target: Full path the file is placed at.
+    Returns:
+      True if the key was cached, False otherwise.
+    """
+    path = self._path(key)
+    if not os.path.exists(path):
+      return False
+    # The modification time of an entry is the time it was last used.
+    os.utime(path, None)
+    _place(path, target)
+    return True
+
+  def store(self, key, source):
+    """Adds a converted file to the cache and evicts old entries.
+
+    Args:
+      key: A key returned by key().
+      source: Full path of the converted file.
+    """
+    if os.path.getsize(source) > self.max_bytes:
+      return
+    handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+    os.close(handle)
+    _place(source, temp_path)
+    os.rename(temp_path, self._path(key))
+    os.utime(self._path(key), None)
+    self.evict(keep=key)
+
+  def evict(self, keep=None):
+    """Removes the least recently used entries until the cache fits its budget.
+
+    Args:
+      keep: Optional key that is never removed.
+    Returns:
+      Number of bytes removed.
+    """
+    entries = []
+    for name in os.listdir(self.directory):
+      if name.endswith(".mp4") and name != "%s.mp4" % keep:
+        stat = os.stat(os.path.join(self.directory, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    if keep is not None and os.path.exists(self._path(keep)):
+      total += os.path.getsize(self._path(keep))
+    removed = 0
+    for _, size, name in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      os.remove(os.path.join(self.directory, name))
+      total -= size
+      removed += size
+    return removed
@@ -0,0 +1,85 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Tests for transcode_cache.
+#
+# $ python transcode_cache_test.py
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import transcode_cache
+
+COMMAND = ["ffmpeg", "-i", "<video>", "-c:v", "libx264", "-crf", "18", "<mp4>"]
+
+
+def intervals_param(intervals):
+  """Formats the kept intervals the way gopro_fusion_uploader does."""
+  return "intervals=%s" % json.dumps([[float(start), float(end)] for start, end in intervals])
+
+
+class TranscodeCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp(prefix="transcode_cache_test")
+    self.cache = transcode_cache.TranscodeCache(os.path.join(self.directory, "cache"), 10 ** 6)
+    self.video = os.path.join(self.directory, "video.mov")
+    with open(self.video, "wb") as fh:
+      fh.write(os.urandom(200 * 1024))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def key(self, video, extra, output="out.mp4"):
+    command = [video if arg == "<video>" else output if arg == "<mp4>" else arg
+               for arg in COMMAND]
+    return self.cache.key(video, command + extra, output)
+
+  def test_key_with_intervals(self):
+    first = self.key(self.video, ["exif=False", None, intervals_param([(0, 5), (9, 12.5)])])
+    again = self.key(self.video, ["exif=False", None, intervals_param([(0, 5), (9, 12.5)])])
+    other = self.key(self.video, ["exif=False", None, intervals_param([(0, 5), (9, 13)])])
+    self.assertEqual(first, again)
+    self.assertNotEqual(first, other)
+
+  def test_key_with_unhashable_params(self):
+    key = self.key(self.video, ["exif=False", None, [(0, 5), (9, 12.5)]])
+    self.assertNotEqual(key, self.key(self.video, ["exif=False", None, [(0, 5)]]))
+
+  def test_key_ignores_file_names(self):
+    moved = os.path.join(self.directory, "moved.mov")
+    key = self.key(self.video, ["exif=False"])
+    shutil.copy2(self.video, moved)
+    self.assertEqual(key, self.key(moved, ["exif=False"], "other.mp4"))
+
+  def test_store_and_fetch(self):
+    output = os.path.join(self.directory, "out.mp4")
+    with open(output, "wb") as fh:
+      fh.write(b"converted")
+    key = self.key(self.video, ["exif=False"])
+    self.cache.store(key, output)
+    target = os.path.join(self.directory, "fetched.mp4")
+    self.assertTrue(self.cache.fetch(key, target))
+    with open(target, "rb") as fh:
+      self.assertEqual(b"converted", fh.read())
+    self.assertFalse(self.cache.fetch(self.key(self.video, ["exif=True"]), target))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,113 @@
+# Copyright 2018 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# ==============================================================================
+
+# Reads properties of video files with ffprobe.
+#
+# ffprobe is installed together with FFmpeg.  It only reads the container
+# headers, so probing takes a fraction of a second even for large files.
+
+
+import subprocess
+
+# Video codecs Street View accepts, as named by ffprobe.
+COPY_CODECS = ("h264", "hevc")
+# Containers a video stream can be copied out of into MP4.
+COPY_FORMATS = ("mov", "mp4")
+
+
+def _probe(video_file, entries, streams=None):
+  """Returns the values of ffprobe entries, one string per line of output."""
+  select = ["-select_streams", streams] if streams else []
+  output = subprocess.check_output(
+      ["ffprobe", "-v", "error"] + select + ["-show_entries", entries,
+       "-of", "default=noprint_wrappers=1:nokey=1", video_file])
+  return output.decode("utf-8").split()
+
+
+def duration(video_file):
+  """Returns the duration of a video in seconds.
+
+  Args:
+    video_file: Full path of the video.
+  Returns:
+    The duration as a float, or None if it can't be determined.
+  """
+  try:
+    return float(_probe(video_file, "format=duration")[0])
+  except (OSError, subprocess.CalledProcessError, ValueError, IndexError):
+    return None
+
+
+def video_codec(video_file):
+  """Returns the codec of the first video stream, e.g. "h264" or "cfhd".
+
+  Args:
+    video_file: Full path of the video.
+  Returns:
+    The ffprobe codec name, or None if it can't be determined.
+  """
+  try:
+    return _probe(video_file, "stream=codec_name", "v:0")[0]
+  except (OSError, subprocess.CalledProcessError, IndexError):
+    return None
+
+
+def container_formats(video_file):
+  """Returns the names of the formats the container matches, e.g. ["mov", "mp4"].
+
+  Args:
+    video_file: Full path of the video.
+  Returns:
+    List of ffprobe format names, empty if they can't be determined.
+  """
+  try:
+    return _probe(video_file, "format=format_name")[0].split(",")
+  except (OSError, subprocess.CalledProcessError, IndexError):
+    return []
+
+
+def can_remux(video_file):
+  """Returns True if the video stream can be copied into an MP4 as it is.
+
+  That is the case for H.264 and H.265 video in a MOV or MP4 container.
+  Other codecs, like CFHD and ProRes, have to be encoded.
+  """
+  return (video_codec(video_file) in COPY_CODECS and
+          any(name in COPY_FORMATS for name in container_formats(video_file)))
+
+
+def keyframe_times(video_file):
+  """Returns the times of the keyframes of the first video stream.
+
+  Only the packet headers are read, the video isn't decoded.
+
+  Args:
+    video_file: Full path of the video.
+  Returns:
+    Sorted list of keyframe times in seconds, empty if they can't be read.
+  """
+  try:
+    values = _probe(video_file, "packet=pts_time,flags", "v:0")
+  except (OSError, subprocess.CalledProcessError):
+    return []
+  times = []
+  for pts_time, packet_flags in zip(values[0::2], values[1::2]):
+    if "K" in packet_flags:
+      try:
+        times.append(float(pts_time))
+      except ValueError:
+        pass
+  return sorted(times)